@@ -0,0 +1,233 @@
+# Cohorts and product transition matrices for any pair of segments
+# (FantasyVerse / game / dlc / Other / ... from segment_group), window and
+# date range; FV_sequence.sql is the FantasyVerse <-> game case.
+#
+#   from FantasyVerse import fv_cohorts
+#   h = fv_cohorts.history(date(2024, 11, 14), date(2025, 9, 1))
+#   users = h.cohorts(target="FantasyVerse", source="dlc").index
+#   m, products = h.matrix("dlc", "FantasyVerse", window_days=14, users=users)
+#   h.top("game", "FantasyVerse", window_days=60)
+#   h.between(date(2025, 1, 1), date(2025, 4, 1)).top("FantasyVerse", "Other")
+#
+# history() builds the per-user ordered order list once per (range, statuses,
+# positive_only) and caches it as Parquet through common/cache.py (closed
+# ranges are kept, ranges touching the open month follow its TTL) and in
+# memory, so changing segments, windows or sub-ranges never re-queries.
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root, for common/
+from common import cache, snapshots
+from FantasyVerse import fv_engine
+
+# ---- CONFIG ----
+FV_LAUNCH = fv_engine.FV_LAUNCH
+SEQ_WINDOW_DAYS = fv_engine.SEQ_WINDOW_DAYS
+TOP_TRANSITIONS = fv_engine.TOP_TRANSITIONS
+HISTORY_VERSION = 1  # bump when the cached frames change shape
+HISTORY_MEMO_SIZE = 8  # histories kept in memory, oldest dropped first
+
+SEG_PREFIX = "seg_"
+PRODUCT_COLUMNS = ["order_id", "product_id", "product_name", "segment_final", "segment_group"]
+
+
+def _segment_flags(lines: pd.DataFrame, orders: pd.DataFrame) -> pd.DataFrame:
+    """One boolean seg_<segment_group> column per segment seen, per order."""
+    flags = pd.get_dummies(lines["segment_group"].fillna("Unknown")).groupby(lines["order_id"].to_numpy()).max()
+    flags = flags.reindex(orders["order_id"].to_numpy(), fill_value=False).astype(bool)
+    flags.columns = [SEG_PREFIX + c for c in flags.columns]
+    return pd.concat([orders, flags.reset_index(drop=True)], axis=1)
+
+
+def _build(start, end_excl, statuses, positive_only):
+    lines = fv_engine.load_lines(start, end_excl, statuses=statuses, positive_only=positive_only)
+    lines = lines[lines["user_id"].notna()]
+    orders = _segment_flags(lines, fv_engine.orders_from_lines(lines))
+    products = lines[PRODUCT_COLUMNS].drop_duplicates(["order_id", "product_id"], ignore_index=True)
+    return orders, products
+
+
+_histories = {}  # (start, end_excl, statuses, positive_only) -> OrderHistory
+
+
+def history(start, end_excl, statuses=None, positive_only=True, refresh=False) -> "OrderHistory":
+    """
+    The ordered order list for [start, end_excl). Defaults match
+    FV_sequence.sql (every status, revenue and margin > 0). refresh=True
+    rebuilds it and replaces both cached copies.
+    """
+    start, end_excl = pd.Timestamp(start).date(), pd.Timestamp(end_excl).date()
+    statuses = tuple(sorted(statuses)) if statuses else None
+    key = (start, end_excl, statuses, bool(positive_only))
+    if refresh or key not in _histories:
+        h = _load(*key, refresh=refresh)
+        _histories.pop(key, None)
+        while len(_histories) >= HISTORY_MEMO_SIZE:
+            _histories.pop(next(iter(_histories)))
+        _histories[key] = h
+    return _histories[key]
+
+
+def _load(start, end_excl, statuses, positive_only, refresh=False) -> "OrderHistory":
+    params = [start, end_excl, statuses, positive_only, snapshots.SNAPSHOT_VERSION, HISTORY_VERSION]
+    label = f"fv_history_{start:%Y%m%d}_{end_excl:%Y%m%d}"
+    keys = {name: f"fv_cohorts.history {name}" for name in ("orders", "products")}
+    built = {}
+
+    def build(name):
+        if not built:
+            print(f"Building FV order history {start} to (excl) {end_excl}")
+            built["orders"], built["products"] = _build(start, end_excl, statuses, positive_only)
+        return built[name]
+
+    frames = {name: cache.cached_frame(sql, params, lambda name=name: build(name), end_excl=end_excl,
+                                       label=f"{label}_{name}", refresh=refresh)
+              for name, sql in keys.items()}
+    if built and any(frames[name] is not built[name] for name in keys):
+        # one half was cached, the other rebuilt: keep both from the same build
+        for name, sql in keys.items():
+            if frames[name] is not built[name]:
+                cache.store(sql, params, built[name], end_excl=end_excl, label=f"{label}_{name}")
+        frames = built
+    return OrderHistory(frames["orders"], frames["products"])
+
+
+class OrderHistory:
+    """
+    Orders sorted by (user_id, order_ts) as fv_engine.orders_from_lines
+    returns them, plus a seg_<segment> flag per segment_group, and the
+    distinct products of each order.
+    """
+
+    def __init__(self, orders: pd.DataFrame, products: pd.DataFrame):
+        self.orders = orders.reset_index(drop=True)
+        self.products = products[products["order_id"].isin(self.orders["order_id"])].reset_index(drop=True)
+        # one shared product index so every matrix has the same rows/columns
+        codes, ids = pd.factorize(self.products["product_id"], sort=True)
+        self.product_index = pd.Index(ids, name="product_id")
+        self.product_names = (self.products.assign(code=codes).drop_duplicates("code")
+                              .set_index("code")["product_name"].sort_index())
+        self.products["code"] = codes
+
+    @property
+    def segments(self) -> list:
+        return [c[len(SEG_PREFIX):] for c in self.orders.columns if c.startswith(SEG_PREFIX)]
+
+    def has(self, segment) -> np.ndarray:
+        """Orders containing `segment` (a segment_group, or a list meaning any of them)."""
+        unknown = set(_as_list(segment)) - set(self.segments)
+        if unknown:
+            raise ValueError(f"Unknown segment(s) {sorted(unknown)}; have {self.segments}")
+        return _has(self.orders, segment)
+
+    def between(self, start, end_excl) -> "OrderHistory":
+        """The orders dated in [start, end_excl), re-sequenced; no query."""
+        d = self.orders["order_date"]
+        o = self.orders[(d >= pd.Timestamp(start)) & (d < pd.Timestamp(end_excl))].reset_index(drop=True)
+        o["seq"] = o.groupby("user_code").cumcount() + 1
+        return OrderHistory(o, self.products)
+
+    def cohorts(self, target="FantasyVerse", source="game", launch=FV_LAUNCH) -> pd.Series:
+        """
+        user_id -> <TARGET>_FIRST / <SOURCE>_THEN_<TARGET>, the
+        FV_FIRST / GAME_THEN_FV split of FV_sequence.sql for any two segments.
+        """
+        t, s = target.upper(), source.upper()
+        return fv_engine.segment_cohorts(self.orders, self.has(target), self.has(source), launch,
+                                         f"{t}_FIRST", f"{s}_THEN_{t}")
+
+    def transitions(self, source, target, window_days=SEQ_WINDOW_DAYS, users=None, later_day=False) -> pd.DataFrame:
+        """
+        One row per (source order, next target order, source product, target
+        product) within window_days: from each order containing `source` to
+        the same user's next order containing `target` (the order itself
+        counts unless later_day). `users` restricts to those user_ids.
+        """
+        o = self.orders
+        if users is not None:
+            o = o[o["user_id"].isin(users)].reset_index(drop=True)
+        self.has([*_as_list(source), *_as_list(target)])  # validates both
+        src = _has(o, source)
+        j = fv_engine.next_match(o, _has(o, target), later_day=later_day)
+        days = fv_engine.days_to(o, j)
+        keep = src & (j >= 0) & (days <= window_days)
+        pairs = pd.DataFrame({
+            "user_id": o["user_id"].to_numpy()[keep],
+            "source_order_id": o["order_id"].to_numpy()[keep],
+            "target_order_id": o["order_id"].to_numpy()[j[keep]],
+            "days_to_next": days[keep],
+        })
+        p = self.products[["order_id", "code", "segment_group"]]
+        src_p = p[p["segment_group"].isin(_as_list(source))].drop(columns="segment_group")
+        tgt_p = p[p["segment_group"].isin(_as_list(target))].drop(columns="segment_group")
+        return (pairs.merge(src_p.rename(columns={"order_id": "source_order_id", "code": "source_code"}))
+                     .merge(tgt_p.rename(columns={"order_id": "target_order_id", "code": "target_code"})))
+
+    def matrix(self, source, target, window_days=SEQ_WINDOW_DAYS, users=None, later_day=False,
+               count="order_pairs"):
+        """
+        Sparse (n_products x n_products) CSR matrix of source -> target product
+        transitions, and the product index its rows and columns follow.
+        count="order_pairs" counts (source order, target order) pairs,
+        count="users" distinct users.
+        """
+        from scipy import sparse
+
+        e = self.transitions(source, target, window_days, users, later_day)
+        if count == "users":
+            e = e.drop_duplicates(["user_id", "source_code", "target_code"])
+        elif count != "order_pairs":
+            raise ValueError(f"count must be 'order_pairs' or 'users', not {count!r}")
+        n = len(self.product_index)
+        m = sparse.coo_matrix((np.ones(len(e), dtype="int64"), (e["source_code"], e["target_code"])), shape=(n, n))
+        return m.tocsr(), self.product_index
+
+    def top(self, source, target, window_days=SEQ_WINDOW_DAYS, users=None, later_day=False,
+            top=TOP_TRANSITIONS) -> pd.DataFrame:
+        """The FV_sequence.sql result for one direction: top product pairs by users, then order pairs."""
+        e = self.transitions(source, target, window_days, users, later_day)
+        keys = ["source_code", "target_code"]
+        out = e.groupby(keys).agg(users=("user_id", "nunique"), order_pairs=("user_id", "size"),
+                                  avg_days_to_next=("days_to_next", "mean")).reset_index()
+        out = out.sort_values(["users", "order_pairs"], ascending=False, ignore_index=True).head(top)
+        out.insert(0, "direction", f"{_label(source)}→{_label(target)}")
+        out.insert(1, "source_product", self.product_names.reindex(out["source_code"]).to_numpy())
+        out.insert(2, "target_product", self.product_names.reindex(out["target_code"]).to_numpy())
+        out["avg_days_to_next"] = out["avg_days_to_next"].round(2)
+        return out.drop(columns=keys)
+
+
+def _as_list(segment) -> list:
+    return [segment] if isinstance(segment, str) else list(segment)
+
+
+def _has(orders: pd.DataFrame, segment) -> np.ndarray:
+    return orders[[SEG_PREFIX + s for s in _as_list(segment)]].any(axis=1).to_numpy()
+
+
+def _label(segment) -> str:
+    return "+".join(_as_list(segment))
+
+
+def matrix_frame(m, product_index, names=None) -> pd.DataFrame:
+    """Non-zero cells of a transition matrix as (source, target, count) rows."""
+    coo = m.tocoo()
+    out = pd.DataFrame({
+        "source_product_id": product_index[coo.row],
+        "target_product_id": product_index[coo.col],
+        "count": coo.data,
+    })
+    if names is not None:
+        out["source_product"] = names.reindex(coo.row).to_numpy()
+        out["target_product"] = names.reindex(coo.col).to_numpy()
+    return out.sort_values("count", ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    h = history(FV_LAUNCH, date.today().replace(day=1))
+    print(h.cohorts().value_counts().to_string())
+    print(h.top("game", "FantasyVerse").to_string(index=False))
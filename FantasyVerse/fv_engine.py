@@ -0,0 +1,272 @@
+# FantasyVerse order sequencing, computed locally instead of with the
+# quadratic self-joins in FV_sequence.sql / FV_analytics_main.sql:
+#
+#   python FantasyVerse/fv_engine.py edges --launch 2024-11-14 --end 2025-09-01 --window 30
+#   python FantasyVerse/fv_engine.py user-month --start 2024-11-14 --end 2025-08-25 --window 30
+#
+# Order lines come from the local order snapshots (common/snapshots.py).
+# Orders are sorted once by (user_id, order_ts); "the user's next order that
+# matches X" is then one np.searchsorted over the positions (or user/day keys)
+# of the matching orders, so the cost is O(n log n) however many orders a
+# heavy buyer has.
+import argparse
+import sys
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root, for common/
+from common import snapshots
+
+# ---- CONFIG ----
+FV_LAUNCH = date(2024, 11, 14)
+SEQ_WINDOW_DAYS = 30
+TOP_TRANSITIONS = 50
+# product types folded into 'Other' (segment_group in FV_analytics_main.sql)
+OTHER_TYPES = {"gift-card", "video", "comic", "voucher", "book", "audio", "software"}
+
+LINE_COLUMNS = ["order_id", "user_id", "order_ts", "order_date", "product_id", "product_name",
+                "product_type", "is_fv", "units", "revenue_ex_vat", "margin", "status"]
+SEGMENT_FLAGS = {"has_fv": "FantasyVerse", "has_game": "game", "has_dlc": "dlc", "has_other": "Other"}
+
+
+# ---------------- lines and orders ----------------
+
+def load_lines(start, end_excl, statuses=("COMPLETE",), positive_only=False) -> pd.DataFrame:
+    """
+    Order lines in [start, end_excl) with segment_final/segment_group.
+    FV_analytics_main.sql keeps COMPLETE lines; FV_sequence.sql keeps every
+    status but only lines with revenue and margin > 0 (positive_only).
+    """
+    import pyarrow.dataset as ds
+
+    where = None
+    if statuses:
+        where = ds.field("status").isin(list(statuses))
+    if positive_only:
+        cond = (ds.field("revenue_ex_vat") > 0) & (ds.field("margin") > 0)
+        where = cond if where is None else where & cond
+    return add_segments(snapshots.read(start, end_excl, columns=LINE_COLUMNS, where=where))
+
+
+def add_segments(lines: pd.DataFrame) -> pd.DataFrame:
+    """segment_final (FantasyVerse / product_type / Other / Unknown) and segment_group."""
+    ptype = lines["product_type"]
+    final = np.select(
+        [lines["is_fv"].eq(True).to_numpy(), ptype.notna().to_numpy(), lines["is_fv"].eq(False).to_numpy()],
+        ["FantasyVerse", ptype.to_numpy(dtype=object), "Other"],
+        default="Unknown",
+    )
+    lines = lines.assign(segment_final=final)
+    folded = lines["segment_final"].str.lower().isin(OTHER_TYPES) & lines["segment_final"].ne("FantasyVerse")
+    lines["segment_group"] = lines["segment_final"].where(~folded, "Other")
+    return lines
+
+
+def orders_from_lines(lines: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per order, sorted by (user_id, order_ts), with the segment flags,
+    order_type, totals, the order's position `seq` within the user and a
+    day number for date arithmetic.
+    """
+    lines = lines[lines["user_id"].notna()]  # guest lines can't be sequenced
+    flags = {name: lines["segment_group"].eq(seg) for name, seg in SEGMENT_FLAGS.items()}
+    g = lines.assign(**flags).groupby(["order_id", "user_id"], sort=False)
+    orders = g.agg(
+        order_ts=("order_ts", "min"),
+        order_date=("order_date", "min"),
+        revenue=("revenue_ex_vat", "sum"),
+        margin=("margin", "sum"),
+        units=("units", "sum"),
+        **{name: (name, "max") for name in SEGMENT_FLAGS},
+    ).reset_index()
+
+    n_segments = orders[list(SEGMENT_FLAGS)].sum(axis=1)
+    orders["order_type"] = np.select(
+        [n_segments > 1] + [orders[f] for f in SEGMENT_FLAGS],
+        ["Mixed"] + list(SEGMENT_FLAGS.values()),
+        default="Unknown",
+    )
+    orders["order_date"] = pd.to_datetime(orders["order_date"])
+    orders["order_month"] = orders["order_date"].dt.to_period("M").dt.start_time
+
+    orders = orders.sort_values(["user_id", "order_ts", "order_id"], ignore_index=True)
+    orders["user_code"] = pd.factorize(orders["user_id"], sort=True)[0]
+    orders["seq"] = orders.groupby("user_code").cumcount() + 1
+    orders["day"] = (orders["order_date"].to_numpy().astype("datetime64[D]").astype("int64"))
+    return orders
+
+
+# ---------------- sequencing ----------------
+
+def next_match(orders: pd.DataFrame, target, later_day=False) -> np.ndarray:
+    """
+    Row index of each order's next order (same user) for which `target` is
+    True, or -1. By default the order itself counts (seq >=, as in
+    FV_sequence.sql); with later_day=True only orders on a later date do
+    (o1.order_date < o2.order_date, as in FV_analytics_main.sql).
+    `orders` must be sorted as orders_from_lines returns them.
+    """
+    target_pos = np.flatnonzero(np.asarray(target, dtype=bool))
+    n = len(orders)
+    if not len(target_pos):
+        return np.full(n, -1)
+    code = orders["user_code"].to_numpy()
+    if later_day:
+        # (user, day) packed into one sortable key; sorted because orders are
+        key = (code.astype("int64") << 32) | orders["day"].to_numpy()
+        k = np.searchsorted(key[target_pos], key, side="right")
+    else:
+        k = np.searchsorted(target_pos, np.arange(n), side="left")
+    j = target_pos[np.minimum(k, len(target_pos) - 1)]
+    found = (k < len(target_pos)) & (code[j] == code)
+    return np.where(found, j, -1)
+
+
+def days_to(orders: pd.DataFrame, j: np.ndarray) -> np.ndarray:
+    """Days from each order to order j (NaN where j == -1)."""
+    day = orders["day"].to_numpy()
+    return np.where(j >= 0, day[np.maximum(j, 0)] - day, np.nan)
+
+
+def pure(orders: pd.DataFrame, flag: str) -> pd.Series:
+    """Orders containing only the `flag` segment."""
+    others = [f for f in SEGMENT_FLAGS if f != flag]
+    return orders[flag] & ~orders[others].any(axis=1)
+
+
+# ---------------- FV_analytics_main.sql ----------------
+
+def user_month(orders: pd.DataFrame, window_days=SEQ_WINDOW_DAYS) -> pd.DataFrame:
+    """
+    The FV_analytics_main.sql output: per order, the gap since the user's
+    previous order, whether a pure game order was followed by an FV order
+    within the window (and FV-only by game), and months since first order.
+    """
+    o = orders
+    prev_day = o.groupby("user_code")["day"].shift()
+    g2fv = pure(o, "has_game") & (days_to(o, next_match(o, o["has_fv"], later_day=True)) <= window_days)
+    fv2g = pure(o, "has_fv") & (days_to(o, next_match(o, o["has_game"], later_day=True)) <= window_days)
+
+    out = pd.DataFrame({
+        "order_id": o["order_id"],
+        "user_id": o["user_id"],
+        "order_month": o["order_month"].dt.date,
+        "order_type": o["order_type"],
+        "orders_count": 1,
+        "revenue_total": o["revenue"],
+        "margin_total": o["margin"],
+        "avg_days_between_orders": o["day"] - prev_day,
+        f"seq_g2fv_{window_days}d_count": g2fv.astype(int),
+        f"seq_fv2g_{window_days}d_count": fv2g.astype(int),
+        **{f: o[f].astype(int) for f in ["has_fv", "has_other", "has_dlc", "has_game"]},
+    })
+    first = o.groupby("user_code")["order_month"].transform("min")
+    out["first_order_month"] = first.dt.date
+    out["months_since_first"] = ((o["order_month"].dt.year - first.dt.year) * 12
+                                 + o["order_month"].dt.month - first.dt.month)
+    return out.sort_values("order_month", ascending=False, kind="stable", ignore_index=True)
+
+
+# ---------------- FV_sequence.sql ----------------
+
+def segment_cohorts(orders: pd.DataFrame, target, source, launch, target_label, source_label) -> pd.Series:
+    """
+    user_id -> target_label (first order contains the target segment, on/after
+    launch) or source_label (first order has the source segment but not the
+    target, and a target order follows on/after launch). target/source are
+    per-order boolean masks.
+    """
+    target = pd.Series(np.asarray(target, dtype=bool), index=orders.index)
+    source = pd.Series(np.asarray(source, dtype=bool), index=orders.index)
+    after_launch = orders["order_ts"].dt.date >= launch
+    first = orders.groupby("user_code").head(1).index
+    t_first = orders.loc[first[(target[first] & after_launch[first]).to_numpy()], "user_id"]
+    s_first = orders.loc[first[(source[first] & ~target[first]).to_numpy()], "user_id"]
+    t_later = orders.loc[target & after_launch, "user_id"].unique()
+    s_then_t = s_first[s_first.isin(t_later)]
+    return pd.concat([
+        pd.Series(target_label, index=t_first.to_numpy()),
+        pd.Series(source_label, index=s_then_t.to_numpy()),
+    ]).rename("cohort_type").rename_axis("user_id")
+
+
+def cohorts(orders: pd.DataFrame, launch=FV_LAUNCH) -> pd.Series:
+    """FV_FIRST / GAME_THEN_FV users, as in FV_sequence.sql."""
+    return segment_cohorts(orders, orders["has_fv"], orders["has_game"], launch, "FV_FIRST", "GAME_THEN_FV")
+
+
+def edges(orders: pd.DataFrame, lines: pd.DataFrame, launch=FV_LAUNCH) -> pd.DataFrame:
+    """
+    Same-or-next order transitions for cohort users, one row per
+    (source product, target product) pair: FV->Game from each FV order to the
+    next game order, Game->FV the other way round.
+    """
+    eligible = cohorts(orders, launch)
+    o = orders[orders["user_id"].isin(eligible.index)].reset_index(drop=True)
+    fv_lines = lines.loc[lines["segment_final"].eq("FantasyVerse"), ["order_id", "product_name"]].drop_duplicates()
+    game_lines = lines.loc[lines["segment_final"].eq("game"), ["order_id", "product_name"]].drop_duplicates()
+
+    parts = []
+    for direction, src_flag, tgt_flag, src_lines, tgt_lines in [
+        ("FV→Game", "has_fv", "has_game", fv_lines, game_lines),
+        ("Game→FV", "has_game", "has_fv", game_lines, fv_lines),
+    ]:
+        j = next_match(o, o[tgt_flag])
+        keep = o[src_flag].to_numpy() & (j >= 0)
+        e = pd.DataFrame({
+            "user_id": o["user_id"].to_numpy()[keep],
+            "source_order_id": o["order_id"].to_numpy()[keep],
+            "target_order_id": o["order_id"].to_numpy()[j[keep]],
+            "days_to_next": days_to(o, j)[keep],
+            "direction": direction,
+        })
+        e = (e.merge(src_lines.rename(columns={"order_id": "source_order_id", "product_name": "source_product"}))
+              .merge(tgt_lines.rename(columns={"order_id": "target_order_id", "product_name": "target_product"})))
+        parts.append(e)
+    return pd.concat(parts, ignore_index=True)
+
+
+def top_transitions(all_edges: pd.DataFrame, window_days=SEQ_WINDOW_DAYS, top=TOP_TRANSITIONS) -> pd.DataFrame:
+    """The FV_sequence.sql result: top product transitions per direction within the window."""
+    keys = ["direction", "source_product", "target_product"]
+    e = all_edges[all_edges["days_to_next"] <= window_days]
+    agg = e.groupby(keys).agg(users=("user_id", "nunique"), avg_days_to_next=("days_to_next", "mean"))
+    pairs = e.drop_duplicates(keys + ["user_id", "source_order_id", "target_order_id"]).groupby(keys).size()
+    out = agg.assign(order_pairs=pairs).reset_index()
+    out["avg_days_to_next"] = out["avg_days_to_next"].round(2)
+    out = out.sort_values(["direction", "users", "order_pairs"], ascending=[True, False, False], ignore_index=True)
+    out = out.groupby("direction", sort=False).head(top)
+    return out[keys + ["users", "order_pairs", "avg_days_to_next"]].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FantasyVerse sequencing from the local order snapshots.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("edges", help="top FV<->Game product transitions (FV_sequence.sql)")
+    e.add_argument("--launch", type=date.fromisoformat, default=FV_LAUNCH)
+    e.add_argument("--end", type=date.fromisoformat, required=True, help="exclusive")
+    e.add_argument("--window", type=int, default=SEQ_WINDOW_DAYS)
+    e.add_argument("--top", type=int, default=TOP_TRANSITIONS)
+    u = sub.add_parser("user-month", help="order-level sequencing flags (FV_analytics_main.sql)")
+    u.add_argument("--start", type=date.fromisoformat, default=FV_LAUNCH)
+    u.add_argument("--end", type=date.fromisoformat, required=True, help="exclusive")
+    u.add_argument("--window", type=int, default=SEQ_WINDOW_DAYS)
+    args = parser.parse_args()
+
+    if args.cmd == "edges":
+        lines = load_lines(args.launch, args.end, statuses=None, positive_only=True)
+        result = top_transitions(edges(orders_from_lines(lines), lines, args.launch), args.window, args.top)
+        out = f"fv_transitions_{args.launch:%Y%m%d}_{args.end:%Y%m%d}_{args.window}d.csv"
+    else:
+        lines = load_lines(args.start, args.end)
+        result = user_month(orders_from_lines(lines), args.window)
+        out = f"fv_user_month_{args.start:%Y%m%d}_{args.end:%Y%m%d}_{args.window}d.csv"
+    result.to_csv(out, index=False)
+    print(f"Wrote {out} ({len(result)} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# Deterministic synthetic data for the benchmarks (see benchmarks/run.py).
+#
+# Every generator takes a row count and a seed and returns the same frame for
+# the same arguments, so timings from different runs are comparable. Shapes
+# follow the real inputs: the Genba report uses the COLMAP Excel headers, the
+# VaultN workbook the columns the VaultN script reads, and the order tables
+# the shop.* columns FANATICAL_SQL and the VaultN queries touch.
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+MONTH_START = date(2025, 8, 1)
+MONTH_END_EXCL = date(2025, 9, 1)
+COUNTRIES = ["GB", "US", "DE", "FR", "ES", "IT", "NL", "PL", "SE", "AU", "CA", "BR"]
+CURRENCIES = ["GBP", "USD", "EUR", "AUD", "CAD", "BRL", "PLN", "SEK"]
+PUBLISHER_WORDS = ["Studio", "Games", "Interactive", "Entertainment", "Digital", "Publishing",
+                   "Softworks", "Media", "Labs", "Works", "Arts", "Forge"]
+SUFFIXES = ["", " Ltd", " Limited", " Inc.", " GmbH", " S.A.", " LLC"]
+
+
+def _rng(seed, stream):
+    # one independent stream per generator so adding columns to one leaves the others unchanged
+    return np.random.default_rng([seed, stream])
+
+
+def _names(rng, n, prefix):
+    words = np.array(PUBLISHER_WORDS)
+    a = rng.integers(0, len(words), n)
+    b = rng.integers(0, len(words), n)
+    return [f"{prefix} {i:05d} {words[x]} {words[y]}" for i, (x, y) in enumerate(zip(a, b))]
+
+
+def _dates(rng, n, lo=MONTH_START, hi=MONTH_END_EXCL):
+    days = (hi - lo).days
+    return pd.to_datetime(lo) + pd.to_timedelta(rng.integers(0, days, n), unit="D")
+
+
+def publishers(n_publishers, seed=0) -> pd.DataFrame:
+    """shop.suppliers: supplier_id, supplier_name plus the flags the queries filter on."""
+    rng = _rng(seed, 1)
+    return pd.DataFrame({
+        "supplier_id": np.arange(1, n_publishers + 1, dtype="int64"),
+        "supplier_name": _names(rng, n_publishers, "Publisher"),
+        "vaultn": rng.random(n_publishers) < 0.5,
+        "genba_service_charge": rng.choice([np.nan, 0.10, 0.125, 0.15], n_publishers),
+        "allows_transaction_fees": rng.random(n_publishers) < 0.3,
+    })
+
+
+def products(n_products, n_publishers, seed=0) -> pd.DataFrame:
+    """shop.products."""
+    rng = _rng(seed, 2)
+    return pd.DataFrame({
+        "product_id": np.arange(1, n_products + 1, dtype="int64"),
+        "product_name": [f"Game Title {i:06d}" for i in range(n_products)],
+        "supplier_id": rng.integers(1, n_publishers + 1, n_products),
+    })
+
+
+def dimension_sizes(n_rows):
+    """Products and publishers grow with the row count, more slowly."""
+    n_products = int(max(50, n_rows // 200))
+    n_publishers = int(max(20, n_products // 20))
+    return n_products, n_publishers
+
+
+def order_details(n_rows, seed=0, n_products=None) -> pd.DataFrame:
+    """
+    shop.order_details. iids are "<order_id><line>" strings; money is in pence
+    as in the warehouse. A tenth of the lines fall before the month so the
+    window/temp-table fetch modes have something to skip.
+    """
+    rng = _rng(seed, 3)
+    if n_products is None:
+        n_products = dimension_sizes(n_rows)[0]
+    order_id = np.arange(n_rows, dtype="int64") // 2 + 10_000_000
+    revenue = rng.integers(199, 6999, n_rows)
+    pct = rng.choice([0.6, 0.65, 0.7, 0.75], n_rows)
+    dates = _dates(rng, n_rows, MONTH_START - timedelta(days=10), MONTH_END_EXCL)
+    return pd.DataFrame({
+        "iid": [f"{o}{i % 2}" for i, o in enumerate(order_id)],
+        "order_id": order_id,
+        "product_id": rng.integers(1, n_products + 1, n_rows),
+        "order_date": dates,
+        "status": rng.choice(["COMPLETE", "COMPLETE", "COMPLETE", "REFUNDED", "CANCELLED"], n_rows),
+        "currency": rng.choice(CURRENCIES, n_rows),
+        "revenue_ex_vat": revenue,
+        "revenue_ex_vat_pf": revenue,
+        "royalty": np.round(revenue * pct).astype("int64"),
+        "royalty_percentage": pct,
+        "transaction_fee": rng.integers(0, 50, n_rows),
+        "vat_rate": rng.choice([0.0, 0.2, 0.19, 0.21], n_rows),
+        "promo_name": rng.choice([None, "Summer Sale", "Bethesda Week", "Weekend Deal"], n_rows),
+        "bundle_name": rng.choice([None, None, None, "Mystery Bundle"], n_rows),
+        "product_discount_self_fund_percent": rng.choice([0.0, 0.1, 0.25], n_rows),
+    })
+
+
+def product_discounts(n_products, seed=0) -> pd.DataFrame:
+    """shop.product_discounts for a quarter of the products; star_deals for a few of them."""
+    rng = _rng(seed, 4)
+    ids = np.sort(rng.choice(np.arange(1, n_products + 1), max(1, n_products // 4), replace=False))
+    return pd.DataFrame({
+        "product_id": ids,
+        "discount_percent": rng.choice([0.1, 0.25, 0.5, 0.75], len(ids)),
+        "self_funded_percent": rng.choice([0.0, 0.05, 0.1], len(ids)),
+        "star_deal": rng.random(len(ids)) < 0.05,
+    })
+
+
+def genba_report(n_rows, seed=0, orders=None) -> pd.DataFrame:
+    """
+    The Genba report with its Excel headers (COLMAP keys). CTIDs point at the
+    given order lines (95% of rows; the rest are unmatched iids); with no
+    orders the iids are made up in the same format.
+    """
+    rng = _rng(seed, 5)
+    n_products, _ = dimension_sizes(n_rows)
+    if orders is not None and len(orders):
+        picked = orders["iid"].to_numpy()[rng.integers(0, len(orders), n_rows)]
+    else:
+        picked = np.array([f"{10_000_000 + i // 2}{i % 2}" for i in range(n_rows)])
+    unmatched = rng.random(n_rows) < 0.05
+    picked = np.where(unmatched, np.char.add("9", picked.astype(str)), picked)
+    product = rng.integers(0, n_products, n_rows)
+    sale = _dates(rng, n_rows)
+    wsp = np.round(rng.uniform(1, 40, n_rows), 2)
+    svc = np.round(wsp * 0.125, 2)
+    currency = rng.choice(CURRENCIES, n_rows)
+    return pd.DataFrame({
+        "Date of Sale": sale,
+        "Original Date of Sale": sale,
+        "Date Fulfilled": sale,
+        "Transaction GUID": [f"{seed:04x}-{i:012x}" for i in range(n_rows)],
+        "CTID": np.char.add(picked.astype(str), "-1"),
+        "Publisher Name": np.char.add("Publisher ", (product % 97).astype(str)),
+        "Product Title": np.char.add("Game Title ", np.char.zfill(product.astype(str), 6)),
+        "SKU": np.char.add("SKU", product.astype(str)),
+        "Genba Product ID": np.char.add("GP", product.astype(str)),
+        "Country Sold": rng.choice(COUNTRIES, n_rows),
+        "Activation Qty": rng.choice([1, 1, 1, 1, -1], n_rows),
+        "Activation Currency": currency,
+        "SRP Activation Currency": np.round(wsp * 1.6, 2),
+        "Promotion %": rng.choice([0, 10, 25, 50], n_rows),
+        "WSP Activation Currency": wsp,
+        "Service Charge Activation Currency": svc,
+        "Exchange Rate": 1.0,
+        "Billing Currency": "GBP",
+        "WSP Billing Currency": wsp,
+        "WSP VAT": 0.0,
+        "Service Charge Billing Currency": svc,
+        "Service Charge VAT": 0.0,
+        "Grand Total": wsp + svc,
+    })
+
+
+def fanatical_frame(orders, suppliers, products_df) -> pd.DataFrame:
+    """
+    What fetch_fanatical returns for these order lines, computed in pandas so
+    the merge/pivot stages can run without a warehouse.
+    """
+    p = products_df.merge(suppliers, on="supplier_id", how="left")
+    df = orders.merge(p, on="product_id", how="left")
+    svc = df["genba_service_charge"]
+    return pd.DataFrame({
+        "iid": df["iid"],
+        "product_name": df["product_name"],
+        "product_id": df["product_id"],
+        "sales": 1,
+        "fanatical_reported_royalty": df["royalty"] / 100,
+        "f_royalty_calc": df["revenue_ex_vat_pf"] * df["royalty_percentage"] / 100,
+        "fanatical_assumed_royalty": (df["revenue_ex_vat_pf"] / 100)
+        * ((1 - df["royalty_percentage"]) * (svc / 100).fillna(0.125) + df["royalty_percentage"]),
+        "assumed_royalty_rate": (1 - df["royalty_percentage"]) * svc.fillna(0.125) + df["royalty_percentage"],
+        "royalty_percentage": df["royalty_percentage"],
+        "genba_service_charge": svc,
+        "order_date": df["order_date"].dt.normalize(),
+        "status": df["status"],
+        "order_id": df["order_id"],
+        "fanatical_currency": df["currency"],
+        "supplier_name": df["supplier_name"],
+        "deal": df["bundle_name"].fillna(df["promo_name"]),
+        "product_discount_self_fund_percent": df["product_discount_self_fund_percent"],
+        "expected_discount": np.nan,
+        "vat_rate": df["vat_rate"],
+        "allowable_transaction_fee": np.where(df["allows_transaction_fees"], df["transaction_fee"] / 100, 0.0),
+    })
+
+
+def vaultn_report(n_rows, suppliers, seed=0) -> pd.DataFrame:
+    """
+    The VaultN workbook. Publisher names are the VaultN suppliers' names with
+    the kind of noise seen in real reports (case, legal suffixes, a dropped
+    character), so fuzzy_merge has real work to do.
+    """
+    rng = _rng(seed, 6)
+    names = suppliers.loc[suppliers["vaultn"], "supplier_name"].to_numpy()
+    if not len(names):
+        names = suppliers["supplier_name"].to_numpy()
+    noisy = []
+    for i, name in enumerate(names):
+        r = rng.random()
+        if r < 0.3:
+            name = name.upper()
+        elif r < 0.4 and len(name) > 8:
+            cut = rng.integers(1, len(name) - 1)
+            name = name[:cut] + name[cut + 1:]
+        noisy.append(name + SUFFIXES[i % len(SUFFIXES)])
+    noisy = np.array(noisy)
+    return pd.DataFrame({
+        "Publisher Name": noisy[rng.integers(0, len(noisy), n_rows)],
+        "Invoicing Currency": rng.choice(CURRENCIES, n_rows),
+        "Client Order Reference": [f"{10_000_000 + i // 2}{i % 2}" for i in range(n_rows)],
+        "Purchase Price In Invoicing Currency": np.round(rng.uniform(0.5, 45, n_rows), 2),
+        "Promotion Name": rng.choice(["", "Bethesda Week", "Summer Sale"], n_rows),
+        "Status": rng.choice(["Completed", "Refunded"], n_rows, p=[0.97, 0.03]),
+    })
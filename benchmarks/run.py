@@ -0,0 +1,328 @@
+# Benchmarks for the reconciliation pipeline on synthetic data
+# (benchmarks/generators.py). Runs offline:
+#
+#   python benchmarks/run.py run --sizes 10k 100k 1M
+#   python benchmarks/run.py run --sizes 1M --warehouse sqlite
+#   python benchmarks/run.py run --sizes 100k --warehouse postgres   # local PostgreSQL via REDSHIFT_*
+#   python benchmarks/run.py list
+#   python benchmarks/run.py compare <run_a> <run_b>
+#
+# Each size is run twice: a timing pass (wall clock, tracemalloc off, since
+# tracing slows allocation-heavy pandas code several times over) and a memory
+# pass recording each stage's peak traced memory (--no-memory skips it). One
+# result per stage is appended to RESULTS_FILE tagged with a run id and the
+# git commit, so runs before and after a change can be compared.
+#
+# Warehouse stand-ins:
+#   none     - the Fanatical frame is generated in pandas (default)
+#   sqlite   - order lines in an in-memory SQLite db; times the temp-table
+#              iid join that fetch_fanatical uses
+#   postgres - loads the shop.* tables into the database the REDSHIFT_* env
+#              points at (must be localhost, with REDSHIFT_SSLMODE=disable)
+#              and times the real fetch_fanatical. FANATICAL_SQL is Redshift
+#              SQL, so an nvl() shim is created there (PostgreSQL 13+, for
+#              anycompatible: Redshift's nvl mixes numeric and float args).
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from benchmarks import generators as gen
+
+# ---- CONFIG ----
+BENCH_DIR = Path(__file__).resolve().parent
+DATA_DIR = Path(os.getenv("CMA_BENCH_DATA_DIR", BENCH_DIR / "data"))
+RESULTS_FILE = Path(os.getenv("CMA_BENCH_RESULTS", BENCH_DIR / "results.jsonl"))
+EXCEL_MAX_ROWS = 1_048_575  # one sheet; larger sizes skip the Excel stages
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+STAGES = ["read_excel_normalise", "read_excel_cached", "build_genba_cte_from_excel", "fetch",
+          "compute_raw", "pivot_overcharge", "stream_pivot", "fuzzy_merge"]
+
+
+def parse_size(s):
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1], 1)
+    return int(float(s[:-1] if s[-1] in "km" else s) * mult)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """
+    Collects per-stage results over a timing pass and an optional memory
+    pass (self.tracing), then appends one result line per stage in flush().
+    """
+
+    def __init__(self, run_id, size, meta):
+        self.run_id, self.size, self.meta = run_id, size, meta
+        self.tracing = False
+        self.results = {}  # stage -> values, in the order stages ran
+
+    def stage(self, name, fn, *args, **kwargs):
+        values = self.results.setdefault(name, {})
+        if not self.tracing:
+            t0 = time.perf_counter()
+            out = fn(*args, **kwargs)
+            values["seconds"] = round(time.perf_counter() - t0, 4)
+            values["out_rows"] = len(out) if hasattr(out, "__len__") else None
+            return out
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        out = fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        values["peak_mb"] = round((peak - before) / 2 ** 20, 1)
+        return out
+
+    def skip(self, name, reason):
+        self.results[name] = {"skipped": reason}
+
+    def flush(self):
+        for name, values in self.results.items():
+            self.write(name, **values)
+            if "skipped" in values:
+                print(f"  {name:<28} skipped ({values['skipped']})")
+            else:
+                peak = f"peak +{values['peak_mb']:8.1f} MB" if "peak_mb" in values else ""
+                print(f"  {name:<28} {values['seconds']:9.3f}s  {peak}")
+        self.results = {}
+
+    def write(self, stage, **values):
+        rec = {"run_id": self.run_id, "size": self.size, "stage": stage, **values, **self.meta}
+        RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(rec, default=str) + "\n")
+
+
+def synthetic_inputs(n, seed):
+    n_products, n_publishers = gen.dimension_sizes(n)
+    suppliers = gen.publishers(n_publishers, seed)
+    prods = gen.products(n_products, n_publishers, seed)
+    orders = gen.order_details(n, seed, n_products=n_products)
+    return suppliers, prods, orders
+
+
+def genba_workbook(report, n, seed):
+    """The synthetic Genba report as .xlsx, written once per (size, seed)."""
+    path = DATA_DIR / f"genba_{n}_{seed}.xlsx"
+    if not path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        print(f"  writing {path.name} (one-off)...")
+        report.to_excel(path, index=False)
+    return path
+
+
+# ---------------- warehouse stand-ins ----------------
+
+def sqlite_fetch(orders):
+    """Returns a fetch(iids) running the temp-table iid join against in-memory SQLite."""
+    db = sqlite3.connect(":memory:")
+    cols = ["iid", "order_id", "product_id", "order_date", "status", "royalty", "transaction_fee"]
+    orders[cols].assign(order_date=orders["order_date"].dt.strftime("%Y-%m-%d")).to_sql("order_details", db, index=False)
+    db.execute("CREATE INDEX order_details_iid ON order_details (iid)")
+
+    def fetch(iids):
+        db.execute("DROP TABLE IF EXISTS genba_iids")
+        db.execute("CREATE TEMP TABLE genba_iids (iid TEXT)")
+        db.executemany("INSERT INTO genba_iids VALUES (?)", ((i,) for i in sorted(set(iids))))
+        return pd.read_sql("""
+            SELECT a.iid, a.order_id, a.product_id, a.order_date, a.status,
+                   a.royalty / 100.0 AS fanatical_reported_royalty,
+                   a.transaction_fee / 100.0 AS allowable_transaction_fee
+            FROM order_details a JOIN genba_iids g ON g.iid = a.iid
+        """, db)
+    return fetch
+
+
+def _copy_frame(cur, table, df):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep="\\N")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+
+def load_postgres(conn, suppliers, prods, orders, discounts):
+    """(Re)creates the shop.* tables FANATICAL_SQL reads and bulk-loads the synthetic rows."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            DROP SCHEMA IF EXISTS shop CASCADE;
+            CREATE SCHEMA shop;
+            CREATE OR REPLACE FUNCTION nvl(anycompatible, anycompatible) RETURNS anycompatible
+                LANGUAGE sql IMMUTABLE AS 'SELECT COALESCE($1, $2)';
+            CREATE TABLE shop.suppliers (supplier_id bigint, supplier_name text, vaultn boolean,
+                genba_service_charge double precision, allows_transaction_fees boolean);
+            CREATE TABLE shop.products (product_id bigint, product_name text, supplier_id bigint);
+            CREATE TABLE shop.product_discounts (product_id bigint, discount_percent double precision,
+                self_funded_percent double precision, star_deal boolean);
+            CREATE TABLE shop.star_deals (product_id bigint);
+            CREATE TABLE shop.order_details (iid varchar(64), order_id bigint, product_id bigint,
+                order_date timestamp, status text, currency text, revenue_ex_vat bigint,
+                revenue_ex_vat_pf bigint, royalty bigint, royalty_percentage double precision,
+                transaction_fee bigint, vat_rate double precision, promo_name text, bundle_name text,
+                product_discount_self_fund_percent double precision);
+        """)
+        _copy_frame(cur, "shop.suppliers", suppliers)
+        _copy_frame(cur, "shop.products", prods)
+        _copy_frame(cur, "shop.product_discounts", discounts)
+        _copy_frame(cur, "shop.star_deals", discounts.loc[discounts["star_deal"], ["product_id"]])
+        _copy_frame(cur, "shop.order_details", orders)
+        cur.execute("CREATE INDEX ON shop.order_details (iid); ANALYZE;")
+    conn.commit()
+
+
+# ---------------- run ----------------
+
+def bench_size(rec, n, seed, warehouse_kind):
+    from common import excel_ingest
+    from common.matching import fuzzy_merge
+    from royalty.genba import genba_refactor as genba
+
+    print(f"size {n:,} (seed {seed}, {'memory' if rec.tracing else 'timing'} pass)")
+    suppliers, prods, orders = synthetic_inputs(n, seed)
+    report = gen.genba_report(n, seed, orders=orders)
+
+    if n <= EXCEL_MAX_ROWS:
+        path = genba_workbook(report, n, seed)
+        # a fresh Excel cache per run, so the first read is cold and the second warm
+        with tempfile.TemporaryDirectory() as tmp:
+            excel_ingest.EXCEL_CACHE_DIR = Path(tmp)
+            excel_df = rec.stage("read_excel_normalise", genba.read_excel_normalise, path)
+            rec.stage("read_excel_cached", genba.read_excel_normalise, path)
+    else:
+        rec.skip("read_excel_normalise", "over one sheet")
+        rec.skip("read_excel_cached", "over one sheet")
+        excel_df = genba.compact(report.rename(columns=genba.COLMAP), genba.GENBA_EXCEL_PLAN, "genba excel")
+    del report
+
+    genba_df = rec.stage("build_genba_cte_from_excel", genba.build_genba_cte_from_excel, excel_df)
+    del excel_df
+
+    fan_df = gen.fanatical_frame(orders, suppliers, prods)
+    fan_df = fan_df[fan_df["iid"].isin(set(genba_df["iid"]))].reset_index(drop=True)
+    iids = genba_df["iid"].astype(str)
+    if warehouse_kind == "sqlite":
+        rec.stage("fetch", sqlite_fetch(orders), iids)
+    elif warehouse_kind == "postgres":
+        from common import warehouse
+        with warehouse.connection() as conn:
+            load_postgres(conn, suppliers, prods, orders, gen.product_discounts(len(prods), seed))
+            fan_df = rec.stage("fetch", genba.fetch_fanatical, conn, gen.MONTH_START, gen.MONTH_END_EXCL, iids=iids)
+    else:
+        rec.skip("fetch", "no warehouse stand-in")
+    fan_df = genba.compact(fan_df, genba.FANATICAL_PLAN, "fanatical")
+
+    raw = rec.stage("compute_raw", genba.compute_raw, genba_df, fan_df)
+    rec.stage("pivot_overcharge", genba.pivot_overcharge, raw)
+    del raw
+    chunk = max(1, genba.warehouse.FETCH_SIZE)
+    rec.stage("stream_pivot", genba.stream_pivot, genba_df,
+              (fan_df.iloc[i:i + chunk] for i in range(0, len(fan_df), chunk)))
+
+    vaultn = gen.vaultn_report(n, suppliers, seed)
+    grouped = vaultn.groupby("Publisher Name", as_index=False)["Purchase Price In Invoicing Currency"].sum()
+    rec.stage("fuzzy_merge", fuzzy_merge, grouped, suppliers[suppliers["vaultn"]], "Publisher Name", "supplier_name")
+
+
+def cmd_run(args):
+    if args.warehouse == "postgres":
+        host = os.getenv("REDSHIFT_HOST", "")
+        if host not in LOCAL_HOSTS:
+            sys.exit(f"--warehouse postgres drops and reloads schema shop; REDSHIFT_HOST must be local, not {host!r}")
+
+    run_id = args.run_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+    meta = {
+        "commit": git_commit(), "warehouse": args.warehouse, "seed": args.seed,
+        "python": platform.python_version(), "pandas": pd.__version__,
+        "host": platform.node(), "at": datetime.now().isoformat(timespec="seconds"),
+    }
+    print(f"run {run_id} -> {RESULTS_FILE}")
+    for size in args.sizes:
+        n = parse_size(size)
+        rec = Recorder(run_id, n, meta)
+        bench_size(rec, n, args.seed, args.warehouse)
+        # before the memory pass, which only adds tracemalloc's own overhead
+        rec.write("max_rss", max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))
+        if args.memory:
+            rec.tracing = True
+            tracemalloc.start()
+            try:
+                bench_size(rec, n, args.seed, args.warehouse)
+            finally:
+                tracemalloc.stop()
+                rec.tracing = False
+        rec.flush()
+
+
+def load_results():
+    if not RESULTS_FILE.exists():
+        sys.exit(f"no results yet ({RESULTS_FILE})")
+    return pd.read_json(RESULTS_FILE, lines=True, dtype={"run_id": str})
+
+
+def cmd_list(args):
+    df = load_results()
+    runs = df.groupby("run_id").agg(at=("at", "first"), commit=("commit", "first"),
+                                    warehouse=("warehouse", "first"),
+                                    sizes=("size", lambda s: ", ".join(f"{x:,}" for x in sorted(s.unique()))))
+    print(runs.to_string())
+
+
+def cmd_compare(args):
+    df = load_results()
+    df = df[df["stage"].isin(STAGES) & df["run_id"].isin([args.a, args.b])]
+    if "seconds" not in df.columns:
+        sys.exit("nothing to compare")
+    values = [c for c in ("seconds", "peak_mb") if c in df.columns]
+    t = df.pivot_table(index=["size", "stage"], columns="run_id", values=values, aggfunc="last")
+    out = pd.DataFrame({
+        f"s {args.a}": t[("seconds", args.a)],
+        f"s {args.b}": t[("seconds", args.b)],
+        "speedup": t[("seconds", args.a)] / t[("seconds", args.b)],
+    })
+    for run in (args.a, args.b):
+        if ("peak_mb", run) in t.columns:  # absent for --no-memory runs
+            out[f"MB {run}"] = t[("peak_mb", run)]
+    print(out.round(3).to_string())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconciliation pipeline benchmarks on synthetic data.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("--sizes", nargs="+", default=["10k", "100k", "1M"], help="row counts, e.g. 10k 1M 10M")
+    p.add_argument("--warehouse", choices=["none", "sqlite", "postgres"], default="none")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--memory", action=argparse.BooleanOptionalAction, default=True,
+                   help="second, traced pass for per-stage peak memory")
+    p.add_argument("--run-id")
+    p.set_defaults(fn=cmd_run)
+    sub.add_parser("list").set_defaults(fn=cmd_list)
+    p = sub.add_parser("compare")
+    p.add_argument("a")
+    p.add_argument("b")
+    p.set_defaults(fn=cmd_compare)
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Helpers shared by the royalty, FantasyVerse and web analytics jobs."""
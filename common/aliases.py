@@ -0,0 +1,201 @@
+# Persistent publisher-name -> supplier_id alias table.
+#
+# Stored mappings are looked up first; only names never seen before are
+# fuzzy matched, and accepted fuzzy matches are written back, unconfirmed
+# (confirmed_by='fuzzy'), so next month they are a plain lookup. Manual fixes
+# (previously hard-coded in the scripts) go in MANUAL_ALIASES or via
+# AliasStore.upsert(..., confirmed_by="manual"). Review fuzzy aliases with
+#
+#   python -m common.aliases list --source vaultn --unconfirmed
+#   python -m common.aliases confirm --source vaultn "Some Publisher Ltd"
+#   python -m common.aliases reject --source vaultn "Some Publisher Ltd"
+#
+# A rejected name is left unmatched (never fuzzy matched again) until a
+# manual alias replaces it.
+import argparse
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from common.matching import FuzzyMatcher, normalize_name
+
+# ----------------- CONFIG -----------------
+ALIAS_DB = Path(os.getenv("CMA_ALIAS_DB", Path(__file__).resolve().parents[1] / "royalty" / "publisher_aliases.sqlite"))
+
+# report name -> name to match against shop.suppliers instead
+MANUAL_ALIASES = {
+    "vaultn": {
+        "THUNDERFUL PUBLISHING": "THUNDERFUL",
+    },
+}
+# ------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publisher_aliases (
+    source          TEXT NOT NULL,      -- distributor report, e.g. 'vaultn'
+    name_norm       TEXT NOT NULL,      -- normalize_name(publisher_name)
+    publisher_name  TEXT NOT NULL,
+    supplier_id     INTEGER NOT NULL,
+    supplier_name   TEXT,
+    match_score     REAL,
+    confirmed_by    TEXT NOT NULL,      -- 'manual', 'fuzzy' (unconfirmed) or 'rejected'
+    updated_at      TEXT NOT NULL,
+    PRIMARY KEY (source, name_norm)
+)
+"""
+
+
+class AliasStore:
+    """SQLite-backed alias table for one distributor `source`."""
+
+    def __init__(self, source, path=ALIAS_DB):
+        self.source = source
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3's own context manager only commits; closing() closes too
+        with closing(sqlite3.connect(self.path)) as db, db:
+            yield db
+
+    def lookup(self, names) -> pd.DataFrame:
+        """Known aliases for `names` (already normalised), one row per name_norm."""
+        names = sorted({n for n in names if n})
+        if not names:
+            return pd.DataFrame(columns=["name_norm", "supplier_id", "supplier_name", "match_score", "confirmed_by"])
+        with self._connect() as db:
+            db.execute("CREATE TEMP TABLE wanted (name_norm TEXT PRIMARY KEY)")
+            db.executemany("INSERT INTO wanted VALUES (?)", [(n,) for n in names])
+            return pd.read_sql_query(
+                "SELECT a.name_norm, a.supplier_id, a.supplier_name, a.match_score, a.confirmed_by "
+                "FROM publisher_aliases a JOIN wanted w USING (name_norm) WHERE a.source = ?",
+                db, params=(self.source,),
+            )
+
+    def upsert(self, rows: pd.DataFrame, confirmed_by="fuzzy"):
+        """Writes publisher_name/supplier_id/supplier_name/match_score rows back to the table."""
+        if rows.empty:
+            return
+        now = datetime.now().isoformat(timespec="seconds")
+        records = [
+            (self.source, normalize_name(r.publisher_name), r.publisher_name, int(r.supplier_id),
+             r.supplier_name, float(r.match_score), confirmed_by, now)
+            for r in rows.itertuples(index=False)
+        ]
+        with self._connect() as db:
+            # only a manual alias may overwrite a manual or rejected one
+            db.executemany(
+                "INSERT INTO publisher_aliases VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (source, name_norm) DO UPDATE SET "
+                "publisher_name = excluded.publisher_name, supplier_id = excluded.supplier_id, "
+                "supplier_name = excluded.supplier_name, match_score = excluded.match_score, "
+                "confirmed_by = excluded.confirmed_by, updated_at = excluded.updated_at "
+                "WHERE publisher_aliases.confirmed_by = 'fuzzy' OR excluded.confirmed_by = 'manual'",
+                records,
+            )
+
+    def entries(self, unconfirmed=False) -> pd.DataFrame:
+        """The stored aliases, optionally only the unconfirmed fuzzy ones."""
+        sql = ("SELECT publisher_name, supplier_id, supplier_name, match_score, confirmed_by, updated_at "
+               "FROM publisher_aliases WHERE source = ?")
+        if unconfirmed:
+            sql += " AND confirmed_by = 'fuzzy'"
+        with self._connect() as db:
+            return pd.read_sql_query(sql + " ORDER BY match_score, publisher_name", db, params=(self.source,))
+
+    def review(self, publisher_name, confirmed_by) -> bool:
+        """Marks a stored alias 'manual' (confirmed) or 'rejected'. False if there is none."""
+        if confirmed_by not in ("manual", "rejected"):
+            raise ValueError(f"confirmed_by must be 'manual' or 'rejected', not {confirmed_by!r}")
+        with self._connect() as db:
+            cur = db.execute(
+                "UPDATE publisher_aliases SET confirmed_by = ?, updated_at = ? WHERE source = ? AND name_norm = ?",
+                (confirmed_by, datetime.now().isoformat(timespec="seconds"), self.source,
+                 normalize_name(publisher_name)),
+            )
+            return cur.rowcount > 0
+
+
+def alias_merge(df_left, df_right, left_key, right_key, source, id_key="supplier_id",
+                threshold=90, store=None):
+    """
+    fuzzy_merge with an alias table in front of it.
+
+    Rows of df_left whose normalised name has a stored alias are joined to
+    df_right by `id_key`, rejected names stay unmatched, and the rest are
+    fuzzy matched on names with accepted matches saved unconfirmed. Output
+    columns follow fuzzy_merge.
+    """
+    store = store or AliasStore(source)
+    manual = {normalize_name(k): normalize_name(v) for k, v in MANUAL_ALIASES.get(source, {}).items()}
+
+    L = df_left.copy()
+    R = df_right.copy()
+    L['_name_norm'] = L[left_key].map(normalize_name)
+    R['_name_norm'] = R[right_key].map(normalize_name)
+
+    known = store.lookup(L['_name_norm']).set_index('name_norm')
+    rejected = L['_name_norm'].map(known['confirmed_by']).eq('rejected')
+    L['_alias_id'] = L['_name_norm'].map(known['supplier_id']).where(~rejected)
+    # an alias pointing at a supplier not in this month's results can't be used
+    L.loc[~L['_alias_id'].isin(R[id_key]), '_alias_id'] = np.nan
+    unconfirmed = L['_alias_id'].notna() & L['_name_norm'].map(known['confirmed_by']).eq('fuzzy')
+    if unconfirmed.any():
+        print(f"{unconfirmed.sum()} names use unconfirmed fuzzy aliases "
+              f"(review: python -m common.aliases list --source {source} --unconfirmed)")
+
+    todo = L[L['_alias_id'].isna() & ~rejected]
+    if len(todo):
+        queries = todo['_name_norm'].map(lambda s: manual.get(s, s))
+        M = FuzzyMatcher(R['_name_norm']).match(queries, k=1, threshold=threshold)
+        hits = R.iloc[M['choice_pos'].to_numpy(dtype=int)]
+        L.loc[todo.index[M['query_pos'].to_numpy(dtype=int)], '_alias_id'] = hits[id_key].to_numpy()
+
+        accepted = pd.DataFrame({
+            'publisher_name': todo[left_key].iloc[M['query_pos'].to_numpy(dtype=int)].to_numpy(),
+            'supplier_id': hits[id_key].to_numpy(),
+            'supplier_name': hits[right_key].to_numpy(),
+            'match_score': M['score'].to_numpy(),
+        }).drop_duplicates('publisher_name')
+        is_manual = accepted['publisher_name'].map(normalize_name).isin(manual.keys())
+        store.upsert(accepted[~is_manual], confirmed_by="fuzzy")
+        store.upsert(accepted[is_manual], confirmed_by="manual")
+    print(f"Alias table resolved {len(L) - len(todo) - rejected.sum()} of {len(L)} names "
+          f"({rejected.sum()} rejected); fuzzy matched the other {len(todo)}")
+
+    out = L.merge(R, left_on='_alias_id', right_on=id_key, how='left', suffixes=('_left', '_right'))
+    out = out.drop(columns=[c for c in ['_name_norm_left', '_name_norm_right', '_alias_id'] if c in out.columns])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Review the publisher alias table.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("list")
+    ls.add_argument("--source", required=True, help="distributor, e.g. vaultn")
+    ls.add_argument("--unconfirmed", action="store_true", help="only fuzzy matches nobody has reviewed")
+    for cmd in ("confirm", "reject"):
+        p = sub.add_parser(cmd)
+        p.add_argument("--source", required=True)
+        p.add_argument("publisher_name", nargs="+")
+    args = parser.parse_args()
+
+    store = AliasStore(args.source)
+    if args.cmd == "list":
+        print(store.entries(unconfirmed=args.unconfirmed).to_string(index=False))
+        return
+    for name in args.publisher_name:
+        ok = store.review(name, "manual" if args.cmd == "confirm" else "rejected")
+        print(f"{args.cmd}ed {name!r}" if ok else f"no alias stored for {name!r}")
+
+
+if __name__ == "__main__":
+    main()
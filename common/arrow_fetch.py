@@ -0,0 +1,164 @@
+# Typed result fetching.
+#
+# pd.read_sql boxes every cell as a Python object (NUMERIC as Decimal) and
+# pandas then re-infers dtypes per chunk. Here every column is built as an
+# Arrow array of the type an explicit per-query schema gives it, so dtypes
+# are the same in every chunk and every run.
+#
+# Backends (CMA_FETCH_BACKEND):
+#   "cursor"     - server-side cursor. Still row-based: psycopg2 returns
+#                  tuples of Python objects (NUMERIC decoded straight to float
+#                  rather than Decimal), transposed into typed Arrow columns
+#                  per batch. Stable dtypes, not a faster decode. Works everywhere.
+#   "connectorx" - connectorx decodes into Arrow columns in Rust, on its own
+#                  connection: this session's temp tables aren't visible to it
+#                  (see sees_temp_tables). Needs `pip install connectorx`.
+#   "copy"       - COPY (...) TO STDOUT as CSV parsed column-wise by pyarrow.
+#                  PostgreSQL only: Redshift cannot COPY to STDOUT.
+import io
+import os
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# ----------------- CONFIG -----------------
+FETCH_BACKEND = os.getenv("CMA_FETCH_BACKEND", "cursor")
+# ------------------------------------------
+
+ARROW_TYPES = {
+    "string": pa.string(),
+    "float64": pa.float64(),
+    "float32": pa.float32(),
+    "int64": pa.int64(),
+    "int32": pa.int32(),
+    "bool": pa.bool_(),
+    "date32": pa.date32(),
+    "timestamp": pa.timestamp("us"),
+}
+
+# NUMERIC/DECIMAL -> float instead of decimal.Decimal
+NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, "CMA_NUMERIC_AS_FLOAT",
+    lambda value, cur: float(value) if value is not None else None,
+)
+
+
+def _column(values, type_name):
+    if type_name is None:
+        return pa.array(values)
+    target = ARROW_TYPES[type_name]
+    try:
+        return pa.array(values, type=target)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values).cast(target, safe=False)
+
+
+def _to_table(rows, names, schema):
+    schema = schema or {}
+    if rows:
+        columns = list(zip(*rows))
+    else:
+        columns = [() for _ in names]
+    arrays = [_column(list(col), schema.get(name)) for col, name in zip(columns, names)]
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    return table.to_pandas(date_as_object=False, self_destruct=True)
+
+
+def iter_cursor_tables(conn, sql, params=None, schema=None, fetch_size=200_000):
+    """Yields Arrow tables of up to fetch_size rows from a server-side cursor."""
+    with conn.cursor(name=f"cma_{uuid.uuid4().hex[:12]}") as cur:
+        psycopg2.extensions.register_type(NUMERIC_AS_FLOAT, cur)
+        cur.itersize = fetch_size
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield _to_table(rows, [d[0] for d in cur.description], schema)
+
+
+def _inline(conn, sql, params):
+    if not params:
+        return sql
+    with conn.cursor() as cur:
+        return cur.mogrify(sql, params).decode()
+
+
+def _cast(table, schema):
+    if not schema:
+        return table
+    fields = [
+        pa.field(f.name, ARROW_TYPES[schema[f.name]]) if f.name in schema else f
+        for f in table.schema
+    ]
+    return table.cast(pa.schema(fields), safe=False)
+
+
+def sees_temp_tables(backend=None) -> bool:
+    """False for backends that read on a connection of their own (connectorx)."""
+    return (backend or FETCH_BACKEND) != "connectorx"
+
+
+def connectorx_uri(conn) -> str:
+    """A connectorx URI for the database `conn` is connected to, with the same sslmode."""
+    p = conn.get_dsn_parameters()
+    user, password = quote(p["user"], safe=""), quote(os.getenv("REDSHIFT_PASSWORD", ""), safe="")
+    sslmode = quote(p.get("sslmode") or "require", safe="")
+    return f"redshift://{user}:{password}@{p['host']}:{p['port']}/{p['dbname']}?sslmode={sslmode}"
+
+
+def read_connectorx(conn, sql, params=None, schema=None) -> pa.Table:
+    import connectorx as cx
+
+    uri = connectorx_uri(conn)
+    query = _inline(conn, sql, params).rstrip().rstrip(";")
+    return _cast(cx.read_sql(uri, query, return_type="arrow"), schema)
+
+
+def read_copy(conn, sql, params=None, schema=None) -> pa.Table:
+    query = _inline(conn, sql, params).rstrip().rstrip(";")
+    buf = io.BytesIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buf)
+    buf.seek(0)
+    column_types = {k: ARROW_TYPES[v] for k, v in (schema or {}).items()}
+    return pa_csv.read_csv(
+        buf,
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+
+
+def iter_typed_frames(conn, sql, params=None, schema=None, fetch_size=200_000, backend=None):
+    """Yields typed DataFrames; connectorx/copy return the whole result as one frame."""
+    backend = backend or FETCH_BACKEND
+    if backend == "cursor":
+        for table in iter_cursor_tables(conn, sql, params, schema, fetch_size):
+            yield to_frame(table)
+    elif backend == "connectorx":
+        yield to_frame(read_connectorx(conn, sql, params, schema))
+    elif backend == "copy":
+        yield to_frame(read_copy(conn, sql, params, schema))
+    else:
+        raise ValueError(f"Unknown fetch backend: {backend}")
+
+
+def read_typed_frame(conn, sql, params=None, schema=None, fetch_size=200_000, backend=None) -> pd.DataFrame:
+    """The whole result of a query as one typed DataFrame."""
+    backend = backend or FETCH_BACKEND
+    if backend == "cursor":
+        tables = list(iter_cursor_tables(conn, sql, params, schema, fetch_size))
+        if not tables:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT * FROM ({sql.rstrip().rstrip(';')}) q LIMIT 0", params)
+                return to_frame(_to_table([], [d[0] for d in cur.description], schema))
+        # promote so an all-NULL column in one batch doesn't clash with a typed one
+        return to_frame(pa.concat_tables(tables, promote_options="default"))
+    return next(iter_typed_frames(conn, sql, params, schema, fetch_size, backend))
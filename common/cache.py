@@ -0,0 +1,227 @@
+# Local Parquet cache for warehouse extracts.
+#
+# Results are keyed by a hash of the SQL text + params. Extracts whose window
+# ends before the current month are closed and kept until evicted; anything
+# touching the open month expires after OPEN_MONTH_TTL.
+#
+#   python -m common.cache list
+#   python -m common.cache invalidate --label genba_fanatical_202508
+#   python -m common.cache invalidate --all
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+# ----------------- CONFIG -----------------
+CACHE_DIR = Path(os.getenv("CMA_CACHE_DIR", Path(__file__).resolve().parents[1] / ".cache" / "warehouse"))
+OPEN_MONTH_TTL = timedelta(hours=int(os.getenv("CMA_CACHE_TTL_HOURS", "6")))
+MAX_CACHE_BYTES = int(os.getenv("CMA_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+# ------------------------------------------
+
+
+def cache_key(sql, params=None) -> str:
+    """Stable hash of the query text (whitespace-insensitive) and its params."""
+    text = re.sub(r"\s+", " ", sql).strip()
+    payload = json.dumps([text, params], default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def is_closed_window(end_excl, today=None) -> bool:
+    """A window is closed once it ends on or before the first of the current month."""
+    if end_excl is None:
+        return False
+    if isinstance(end_excl, datetime):
+        end_excl = end_excl.date()
+    first_this = (today or date.today()).replace(day=1)
+    return end_excl <= first_this
+
+
+def _paths(key):
+    return CACHE_DIR / f"{key}.parquet", CACHE_DIR / f"{key}.json"
+
+
+def _read_meta(meta_path):
+    try:
+        return json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(meta) -> bool:
+    if meta is None:
+        return False
+    if meta.get("closed"):
+        return True
+    return time.time() - meta["created"] < OPEN_MONTH_TTL.total_seconds()
+
+
+def cached_frame(sql, params, loader, end_excl=None, label=None, refresh=False) -> pd.DataFrame:
+    """
+    Returns the cached result for (sql, params), calling `loader()` on a miss.
+
+    `sql`/`params` only identify the entry; `loader` does the actual fetch so
+    callers can keep their own chunking, temp tables and fallbacks.
+    """
+    key = cache_key(sql, params)
+    data_path, meta_path = _paths(key)
+    meta = _read_meta(meta_path)
+
+    if not refresh and data_path.exists() and _is_fresh(meta):
+        try:
+            os.utime(data_path)  # LRU: reads count as use
+            df = pd.read_parquet(data_path)
+        except FileNotFoundError:
+            pass  # evicted by another process in between: load it again
+        else:
+            print(f"Cache hit [{label or key}] ({len(df)} rows)")
+            return df
+
+    df = loader()
+    store(sql, params, df, end_excl=end_excl, label=label)
+    return df
+
+
+def is_cached(sql, params) -> bool:
+    """Whether a fresh entry exists for (sql, params)."""
+    data_path, meta_path = _paths(cache_key(sql, params))
+    return data_path.exists() and _is_fresh(_read_meta(meta_path))
+
+
+def store(sql, params, df, end_excl=None, label=None):
+    """Writes df as the entry for (sql, params), e.g. to seed months from one wider extract."""
+    key = cache_key(sql, params)
+    data_path, meta_path = _paths(key)
+    meta = {
+        "key": key,
+        "label": label,
+        "sql": re.sub(r"\s+", " ", sql).strip(),
+        "params": params,
+        "end_excl": end_excl,
+        "closed": is_closed_window(end_excl),
+        "created": time.time(),
+    }
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # temp file + rename, so a concurrent reader never sees half a file
+        _atomic_write(data_path, lambda f: df.to_parquet(f, index=False))
+        _atomic_write(meta_path, lambda f: f.write(json.dumps(meta, default=str, indent=2).encode()))
+        print(f"Cached [{label or key}] ({len(df)} rows)")
+    except Exception as e:
+        # never fail a run because the cache could not be written
+        print(f"Could not cache [{label or key}]: {e}")
+        data_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+    evict()
+
+
+def _atomic_write(path, write):
+    """Calls write(binary file) on a temp file next to `path`, then renames it into place."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def cached_read_sql(conn, sql, params=None, end_excl=None, label=None, refresh=False, schema=None) -> pd.DataFrame:
+    """Cached warehouse.read_frame."""
+    from common import warehouse  # psycopg2 is only needed on a miss
+
+    key_params = params if schema is None else [params, schema]
+    return cached_frame(
+        sql, key_params,
+        lambda: warehouse.read_frame(conn, sql, params, schema=schema),
+        end_excl=end_excl, label=label, refresh=refresh,
+    )
+
+
+def entries():
+    """All cache entries as a DataFrame, least recently used first."""
+    rows = []
+    for data_path in CACHE_DIR.glob("*.parquet"):
+        meta = _read_meta(data_path.with_suffix(".json")) or {}
+        try:
+            st = data_path.stat()
+        except FileNotFoundError:  # evicted by another process since the glob
+            continue
+        rows.append({
+            "key": data_path.stem,
+            "label": meta.get("label"),
+            "closed": meta.get("closed", False),
+            "fresh": _is_fresh(meta or None),
+            "bytes": st.st_size,
+            "last_used": datetime.fromtimestamp(st.st_mtime),
+        })
+    cols = ["key", "label", "closed", "fresh", "bytes", "last_used"]
+    return pd.DataFrame(rows, columns=cols).sort_values("last_used", ignore_index=True)
+
+
+def _remove(key):
+    for p in _paths(key):
+        p.unlink(missing_ok=True)
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Drops expired entries, then least recently used ones until under max_bytes."""
+    if not CACHE_DIR.exists():
+        return
+    df = entries()
+    fresh = df["fresh"].astype(bool)  # object dtype when there are no entries
+    for key in df.loc[~fresh, "key"]:
+        _remove(key)
+    df = df[fresh]
+    total = df["bytes"].sum()
+    for key, size in zip(df["key"], df["bytes"]):
+        if total <= max_bytes:
+            break
+        _remove(key)
+        total -= size
+
+
+def invalidate(key=None, label=None, everything=False) -> int:
+    """Removes entries by key, by label prefix, or all of them. Returns the count removed."""
+    if not CACHE_DIR.exists():
+        return 0
+    df = entries()
+    if everything:
+        drop = df["key"]
+    elif key:
+        drop = df.loc[df["key"] == key, "key"]
+    elif label:
+        drop = df.loc[df["label"].fillna("").str.startswith(label), "key"]
+    else:
+        raise ValueError("Pass key, label or everything=True")
+    for k in drop:
+        _remove(k)
+    return len(drop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local warehouse extract cache.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    inv = sub.add_parser("invalidate")
+    inv.add_argument("--key")
+    inv.add_argument("--label", help="label prefix, e.g. genba_fanatical_202508")
+    inv.add_argument("--all", action="store_true")
+    args = parser.parse_args()
+
+    if args.cmd == "list":
+        print(entries().to_string(index=False))
+    else:
+        n = invalidate(key=args.key, label=args.label, everything=args.all)
+        print(f"Removed {n} cache entries from {CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
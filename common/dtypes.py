@@ -0,0 +1,68 @@
+# Compact dtype plans for reconciliation frames.
+#
+# A plan maps column -> target dtype and is applied right after ingestion
+# (Excel or warehouse). Repetitive text becomes categorical, counts nullable
+# ints, and descriptive money/rate columns float32. Columns that feed the
+# reconciled totals should stay float64 so sums still agree to the penny.
+#
+# Set CMA_MEMORY_REPORT=1 to print a before/after footprint per frame; it is
+# off by default because measuring object columns (deep=True) is itself slow.
+import os
+
+import pandas as pd
+
+MEMORY_REPORT = os.getenv("CMA_MEMORY_REPORT") == "1"
+
+_report = []
+
+
+def apply_plan(df: pd.DataFrame, plan: dict) -> pd.DataFrame:
+    """Casts the plan's columns that are present in df; everything else is left alone."""
+    out = df.copy(deep=False)
+    for col, dtype in plan.items():
+        if col not in out.columns:
+            continue
+        if dtype == "date":
+            out[col] = pd.to_datetime(out[col], errors="coerce").dt.normalize()
+        elif dtype in ("float32", "float64"):
+            out[col] = pd.to_numeric(out[col], errors="coerce").astype(dtype)
+        elif dtype in ("Int8", "Int16", "Int32", "Int64"):
+            num = pd.to_numeric(out[col], errors="coerce")
+            # leave fractional values alone rather than silently rounding them
+            if (num.dropna() % 1 == 0).all():
+                out[col] = num.astype(dtype)
+            else:
+                out[col] = num
+        elif dtype == "category":
+            # object first so string/Arrow-backed text gets plain string categories
+            out[col] = out[col].astype(object).astype("category")
+        else:
+            out[col] = out[col].astype(dtype)
+    return out
+
+
+def compact(df: pd.DataFrame, plan: dict, label: str) -> pd.DataFrame:
+    """apply_plan, recording the frame's footprint before and after when MEMORY_REPORT is on."""
+    if not MEMORY_REPORT:
+        return apply_plan(df, plan)
+    before = df.memory_usage(deep=True).sum()
+    out = apply_plan(df, plan)
+    after = out.memory_usage(deep=True).sum()
+    _report.append({"frame": label, "rows": len(df), "before_mb": before / 2**20, "after_mb": after / 2**20})
+    return out
+
+
+def record(df: pd.DataFrame, label: str):
+    """Adds an already-built frame (e.g. a merge result) to the memory report."""
+    if MEMORY_REPORT:
+        mb = df.memory_usage(deep=True).sum() / 2**20
+        _report.append({"frame": label, "rows": len(df), "before_mb": float("nan"), "after_mb": mb})
+
+
+def print_memory_report():
+    if not _report:
+        return
+    rep = pd.DataFrame(_report)
+    rep["saved_pct"] = (1 - rep["after_mb"] / rep["before_mb"]) * 100
+    print("Memory footprint (MB):")
+    print(rep.round(1).to_string(index=False))
@@ -0,0 +1,107 @@
+# Fast, cached ingestion of publisher Excel reports.
+#
+# Only the requested columns are parsed, dtypes are applied by the reader,
+# and the normalised frame is stored as Parquet keyed by the workbook's
+# content hash so repeat runs skip Excel parsing entirely.
+import hashlib
+import importlib.util
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+# ----------------- CONFIG -----------------
+EXCEL_CACHE_DIR = Path(os.getenv("CMA_EXCEL_CACHE_DIR", Path(__file__).resolve().parents[1] / ".cache" / "excel"))
+# bump when the normalisation below changes so stale Parquet is ignored
+INGEST_VERSION = 1
+# ------------------------------------------
+
+
+def excel_engine() -> str:
+    """calamine (Rust) when installed, otherwise openpyxl."""
+    return "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+
+def file_digest(path: Path) -> str:
+    """Content hash of a file, memoised on (size, mtime) in the cache dir."""
+    st = path.stat()
+    index_path = EXCEL_CACHE_DIR / "digests.json"
+    try:
+        index = json.loads(index_path.read_text())
+    except (OSError, ValueError):
+        index = {}
+    stamp = f"{st.st_size}:{st.st_mtime_ns}"
+    entry = index.get(str(path.resolve()))
+    if entry and entry["stamp"] == stamp:
+        return entry["sha256"]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    index[str(path.resolve())] = {"stamp": stamp, "sha256": h.hexdigest()}
+    EXCEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    index_path.write_text(json.dumps(index, indent=2))
+    return h.hexdigest()
+
+
+def read_excel_fast(path, columns=None, text=(), numeric=(), dates=(), sheet_name=0) -> pd.DataFrame:
+    """
+    Reads `columns` (all when None) from the sheet with header whitespace stripped.
+
+    `text`, `numeric` and `dates` name columns (post-strip) that are typed at
+    read time; numeric/date cells that don't parse become NaN/NaT.
+    """
+    engine = excel_engine()
+    header = pd.read_excel(path, sheet_name=sheet_name, nrows=0, engine=engine).columns
+    raw_name = {str(c).strip(): c for c in header}
+    if columns is not None:
+        missing = [c for c in columns if c not in raw_name]
+        if missing:
+            raise ValueError(f"Excel missing columns: {missing}")
+        wanted = {raw_name[c] for c in columns}
+        usecols = [c for c in header if c in wanted]
+    else:
+        usecols = None
+
+    dtype = {raw_name[c]: "string" for c in text if c in raw_name}
+    dtype.update({raw_name[c]: "float64" for c in numeric if c in raw_name})
+    try:
+        df = pd.read_excel(path, sheet_name=sheet_name, usecols=usecols, dtype=dtype, engine=engine)
+    except (ValueError, TypeError):
+        # a stray text cell in a numeric column: read those as-is and coerce below
+        for c in numeric:
+            dtype.pop(raw_name.get(c), None)
+        df = pd.read_excel(path, sheet_name=sheet_name, usecols=usecols, dtype=dtype, engine=engine)
+    df.columns = df.columns.str.strip()
+
+    for c in numeric:
+        if c in df.columns and not pd.api.types.is_float_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    for c in dates:
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], errors="coerce")
+    return df
+
+
+def read_excel_cached(path, columns=None, text=(), numeric=(), dates=(), sheet_name=0, refresh=False) -> pd.DataFrame:
+    """read_excel_fast, memoised as Parquet on the workbook contents and the read spec."""
+    path = Path(path)
+    spec = json.dumps([INGEST_VERSION, sheet_name, columns, list(text), list(numeric), list(dates)], default=str)
+    key = hashlib.sha256((file_digest(path) + spec).encode()).hexdigest()[:32]
+    cache_path = EXCEL_CACHE_DIR / f"{path.stem}_{key}.parquet"
+
+    if cache_path.exists() and not refresh:
+        df = pd.read_parquet(cache_path)
+        print(f"Loaded {path.name} from Parquet cache ({len(df)} rows)")
+        return df
+
+    df = read_excel_fast(path, columns=columns, text=text, numeric=numeric, dates=dates, sheet_name=sheet_name)
+    try:
+        df.to_parquet(cache_path, index=False)
+        print(f"Parsed {path.name} with {excel_engine()} ({len(df)} rows), cached to {cache_path.name}")
+    except Exception as e:
+        print(f"Could not cache {path.name}: {e}")
+        cache_path.unlink(missing_ok=True)
+    return df
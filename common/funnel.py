@@ -0,0 +1,322 @@
+# Search funnel counts from a local per-day, per-session rollup of
+# web_analytics.silver_atomic_events.
+#
+#   python -m common.funnel refresh
+#   python -m common.funnel report --grain week --start 2025-06-01
+#
+#   from common import funnel
+#   df = funnel.counts("month")
+#   df = funnel.evaluate({"focused": "input-focused", "typed": "input-changed",
+#                         "submitted": ["enter", "click-search-icon"]}, grain="week")
+#
+# Each session's events on a day are folded into one int, bit i set when it
+# fired the i-th se_label of the rollup's label vocabulary (the STEPS labels
+# first, then every other label seen, up to MAX_LABELS, in order of first
+# appearance), and stored as
+# FUNNEL_DIR/rollup_v<N>/day=<date>.parquet (day, session hash, mask).
+# refresh() only pulls the days after the watermark (re-pulling the last
+# LOOKBACK_DAYS for late events). Because every label has a bit, any funnel
+# over them is evaluated locally as bit operations, without touching the
+# warehouse; a session's days are OR-ed together per period, so a session
+# spanning days is still counted once per week/month.
+import argparse
+import json
+import os
+import shutil
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# ---- CONFIG ----
+FUNNEL_DIR = Path(os.getenv("CMA_FUNNEL_DIR", Path(__file__).resolve().parents[1] / ".cache" / "funnel"))
+ROLLUP_VERSION = 3  # 2: bits for every se_label; 3: STEPS labels always get the first bits
+EVENTS_TABLE = "web_analytics.silver_atomic_events"
+LOOKBACK_DAYS = int(os.getenv("CMA_FUNNEL_LOOKBACK_DAYS", "2"))
+REFRESH_CHUNK_DAYS = 31
+MAX_LABELS = 63  # bits of an int64 mask
+
+# the default funnel: step -> the se_labels that count as it (any of them)
+STEPS = {
+    "focused": ("input-focused",),
+    "typed": ("input-changed",),
+    "saw_suggestions": ("suggestions-revealed",),
+    "submitted": ("enter", "click-search-icon"),
+    "clicked_view_all": ("click-view-all",),
+}
+
+LABELS_SQL = f"""
+    SELECT se_label, COUNT(*) AS events
+    FROM {EVENTS_TABLE}
+    WHERE derived_tstamp >= %s AND derived_tstamp < %s AND se_label IS NOT NULL
+    GROUP BY 1
+    ORDER BY 2 DESC
+"""
+LABELS_SCHEMA = {"se_label": "string", "events": "int64"}
+ROLLUP_SCHEMA = {"day": "date32", "domain_sessionid": "string", "mask": "int64"}
+
+
+def _rollup_sql(labels) -> str:
+    cases = " ".join("WHEN '{}' THEN {}".format(label.replace("'", "''"), 1 << i) for i, label in enumerate(labels))
+    return f"""
+        SELECT derived_tstamp::date AS day, domain_sessionid,
+               COALESCE(BIT_OR(CASE se_label {cases} END), 0) AS mask
+        FROM {EVENTS_TABLE}
+        WHERE derived_tstamp >= %s AND derived_tstamp < %s
+        GROUP BY 1, 2
+    """
+
+
+def _root() -> Path:
+    return FUNNEL_DIR / f"rollup_v{ROLLUP_VERSION}"
+
+
+def _day_path(day: date) -> Path:
+    return _root() / f"day={day:%Y-%m-%d}.parquet"
+
+
+def meta() -> dict:
+    """{"last_day": ..., "labels": [...]} of the local rollup, or {} before the first refresh; bit i is labels[i]."""
+    path = _root() / "_meta.json"
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _save_meta(last_day: date, labels: list):
+    tmp = _root() / "_meta.json.tmp"
+    tmp.write_text(json.dumps({"last_day": last_day.isoformat(), "labels": labels}))
+    os.replace(tmp, _root() / "_meta.json")
+
+
+def session_hash(ids) -> np.ndarray:
+    """domain_sessionid -> uint64, so the rollup stores 8 bytes per session instead of a UUID string."""
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+
+def _first_day(conn) -> date:
+    from common import warehouse
+
+    df = warehouse.read_frame(conn, f"SELECT MIN(derived_tstamp)::date AS day FROM {EVENTS_TABLE}",
+                              schema={"day": "date32"})
+    return pd.Timestamp(df["day"].iloc[0]).date()
+
+
+def _extend(labels: list, seen) -> list:
+    """Appends newly seen labels (most frequent first) while bits are left; existing bits never move."""
+    new = [label for label in seen if label not in labels]
+    room = MAX_LABELS - len(labels)
+    if len(new) > room:
+        print(f"Funnel rollup: {len(new) - room} labels not tracked, all {MAX_LABELS} bits used: {new[room:][:10]}")
+    return labels + new[:room]
+
+
+def _write_day(day: date, df: pd.DataFrame):
+    tmp = _day_path(day).with_suffix(".tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, _day_path(day))
+
+
+def refresh(conn=None, until=None) -> list:
+    """
+    Pulls the complete days after the watermark (up to but excluding `until`,
+    default today) and returns them. The watermark advances after every
+    chunk, so an interrupted refresh resumes where it stopped.
+    """
+    from common import warehouse
+
+    m = meta()
+    until = until or date.today()
+
+    def pull(c):
+        # the default funnel's labels always get a bit, however rare they are site-wide
+        labels = _extend(list(m.get("labels", [])), step_labels(STEPS))
+        if m:
+            lo = date.fromisoformat(m["last_day"]) - timedelta(days=LOOKBACK_DAYS - 1)
+        else:
+            lo = _first_day(c)
+        days = []
+        _root().mkdir(parents=True, exist_ok=True)
+        while lo < until:
+            hi = min(lo + timedelta(days=REFRESH_CHUNK_DAYS), until)
+            print(f"Funnel rollup {lo} to (excl) {hi}")
+            # a label first seen in this chunk can't have fired earlier, so older days need no backfill
+            seen = warehouse.read_frame(c, LABELS_SQL, (lo, hi), schema=LABELS_SCHEMA)["se_label"]
+            labels = _extend(labels, seen)
+            df = warehouse.read_frame(c, _rollup_sql(labels), (lo, hi), schema=ROLLUP_SCHEMA)
+            rollup = pd.DataFrame({
+                "day": pd.to_datetime(df["day"]).dt.date,
+                "session": session_hash(df["domain_sessionid"]),
+                "mask": df["mask"].to_numpy("int64"),
+            })
+            parts = dict(tuple(rollup.groupby("day")))
+            for i in range((hi - lo).days):
+                day = lo + timedelta(days=i)
+                _write_day(day, parts.get(day, rollup.iloc[0:0]).reset_index(drop=True))
+                days.append(day)
+            _save_meta(hi - timedelta(days=1), labels)
+            lo = hi
+        return days
+
+    if conn is not None:
+        return pull(conn)
+    with warehouse.connection() as c:
+        return pull(c)
+
+
+def rebuild(conn=None, until=None) -> list:
+    """Drops the local rollup and pulls everything again."""
+    shutil.rmtree(_root(), ignore_errors=True)
+    return refresh(conn, until)
+
+
+def load(start=None, end_excl=None) -> pd.DataFrame:
+    """(day, session, mask) rows of the local rollup with start <= day < end_excl."""
+    import pyarrow.dataset as ds
+
+    files = sorted(str(p) for p in _root().glob("day=*.parquet"))
+    if not files:
+        return pd.DataFrame({"day": pd.Series(dtype="datetime64[ns]"), "session": pd.Series(dtype="uint64"),
+                             "mask": pd.Series(dtype="int64")})
+    where = None
+    if start is not None:
+        where = ds.field("day") >= pd.Timestamp(start).date()
+    if end_excl is not None:
+        cond = ds.field("day") < pd.Timestamp(end_excl).date()
+        where = cond if where is None else where & cond
+    df = ds.dataset(files, format="parquet").to_table(filter=where).to_pandas()
+    df["day"] = pd.to_datetime(df["day"])
+    return df
+
+
+def period_start(days: pd.Series, grain: str) -> pd.Series:
+    """First day of each day's day/week (Monday)/month."""
+    if grain == "day":
+        return days
+    if grain == "week":
+        return days - pd.to_timedelta(days.dt.weekday, unit="D")
+    if grain == "month":
+        return days.dt.to_period("M").dt.start_time
+    raise ValueError(f"grain must be day, week or month, not {grain!r}")
+
+
+def sessions(rollup: pd.DataFrame, grain="month") -> pd.DataFrame:
+    """One (period, session, mask) row per session and period, its days' masks OR-ed together."""
+    period = period_start(rollup["day"], grain).to_numpy()
+    session = rollup["session"].to_numpy()
+    order = np.lexsort((session, period))
+    period, session, mask = period[order], session[order], rollup["mask"].to_numpy()[order]
+    if not len(order):
+        return pd.DataFrame({"period": period, "session": session, "mask": mask})
+    starts = np.flatnonzero(np.r_[True, (period[1:] != period[:-1]) | (session[1:] != session[:-1])])
+    return pd.DataFrame({"period": period[starts], "session": session[starts],
+                         "mask": np.bitwise_or.reduceat(mask, starts)})
+
+
+def _steps(steps) -> dict:
+    """{name: [labels]} from {name: label or [labels]} or a list of labels."""
+    if not isinstance(steps, dict):
+        steps = {label: label for label in steps}
+    return {name: [labels] if isinstance(labels, str) else list(labels) for name, labels in steps.items()}
+
+
+def step_labels(steps) -> list:
+    """Every label the steps use, in step order."""
+    return list(dict.fromkeys(label for labels in _steps(steps).values() for label in labels))
+
+
+def step_bits(steps, labels, unknown="raise") -> np.ndarray:
+    """
+    One int64 mask per step. `steps` is {name: label or [labels]} (a session
+    reaches a step with any of its labels) or a list of labels. A label the
+    rollup has no bit for raises, or with unknown="zero" contributes nothing
+    (a step with no known label is never reached).
+    """
+    bits = []
+    for name, labels_ in _steps(steps).items():
+        missing = [label for label in labels_ if label not in labels]
+        if missing and unknown == "raise":
+            raise ValueError(f"Step {name!r}: labels {missing} not in the rollup; known: {labels}")
+        bits.append(sum(1 << labels.index(label) for label in labels_ if label in labels))
+    return np.array(bits, dtype="int64")
+
+
+def evaluate(steps=STEPS, grain="month", start=None, end_excl=None, ordered=True, unknown="raise") -> pd.DataFrame:
+    """
+    Funnel over the local rollup, one row per period: total sessions, the
+    sessions reaching each step and its rate from the step before (the
+    first step's from total). With ordered=True a session reaches a step
+    only if it also reached every earlier one; otherwise steps are counted
+    independently. Steps can be any labels in the rollup, no query needed;
+    see step_bits for `unknown`.
+    """
+    names = list(_steps(steps))
+    bits = step_bits(steps, meta().get("labels", []), unknown=unknown)
+    s = sessions(load(start, end_excl), grain)
+
+    hits = (s["mask"].to_numpy()[:, None] & bits[None, :]) != 0  # sessions x steps
+    if ordered:
+        hits = np.logical_and.accumulate(hits, axis=1)
+    # sessions() output is sorted by period, so each period is one contiguous run
+    period = s["period"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, period[1:] != period[:-1]]) if len(period) else np.array([], dtype=int)
+    reached = np.add.reduceat(hits.astype("int64"), starts, axis=0) if len(starts) else np.zeros((0, len(names)))
+    total = np.diff(np.r_[starts, len(period)])
+
+    out = pd.DataFrame({"period": period[starts], "sessions": total})
+    prev = total
+    for i, name in enumerate(names):
+        out[name] = reached[:, i].astype("int64")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[f"{name}_rate"] = np.round(np.where(prev > 0, reached[:, i] / prev, np.nan), 4)
+        prev = reached[:, i]
+    return out
+
+
+def counts(grain="month", start=None, end_excl=None, refresh_first=False) -> pd.DataFrame:
+    """
+    Sessions per period and how many reached each of STEPS (independently),
+    the columns of the old all-table query in test.py. A step whose labels
+    never fired counts 0.
+    """
+    if refresh_first:
+        refresh()
+    df = evaluate(STEPS, grain, start, end_excl, ordered=False, unknown="zero")
+    out = df[["period", "sessions"] + list(STEPS)]
+    return out.rename(columns={"period": "event_date", "sessions": "total_sessions",
+                               **{name: f"sessions_{name}" for name in STEPS}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search funnel rollup.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("refresh", help="pull the days after the watermark")
+    sub.add_parser("rebuild", help="drop the rollup and pull everything")
+    r = sub.add_parser("report", help="funnel counts from the local rollup")
+    r.add_argument("--grain", choices=["day", "week", "month"], default="month")
+    r.add_argument("--start", type=date.fromisoformat)
+    r.add_argument("--end", type=date.fromisoformat, help="exclusive")
+    r.add_argument("--refresh", action="store_true", help="refresh first")
+    r.add_argument("--steps", nargs="+", metavar="LABEL[+LABEL]",
+                   help="ordered funnel steps, e.g. input-focused input-changed enter+click-search-icon")
+    sub.add_parser("labels", help="the se_labels the rollup tracks")
+    args = parser.parse_args()
+
+    if args.cmd == "refresh":
+        days = refresh()
+        print(f"Refreshed {len(days)} days; watermark {meta().get('last_day')}")
+    elif args.cmd == "rebuild":
+        days = rebuild()
+        print(f"Rebuilt {len(days)} days; watermark {meta().get('last_day')}")
+    elif args.cmd == "labels":
+        print("\n".join(meta().get("labels", [])))
+    elif args.steps:
+        if args.refresh:
+            refresh()
+        steps = {step: step.split("+") for step in args.steps}
+        print(evaluate(steps, args.grain, args.start, args.end).to_string(index=False))
+    else:
+        print(counts(args.grain, args.start, args.end, refresh_first=args.refresh).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
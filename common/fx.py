@@ -0,0 +1,203 @@
+# Daily FX rates as a dense (currency x day) array, with vectorised conversion.
+#
+#   from common import fx
+#   gbp = fx.convert(df["amount"], df["currency"], df["order_date"], to="GBP")
+#
+# Two sources:
+#   ecb    - the ECB history bundled with currency_converter, expanded to every
+#            day (gaps interpolated/carried) once per package version and
+#            cached as .npz under FX_CACHE_DIR
+#   orders - our own checkout rates, avg(local_price / revenue_inc_vat) per
+#            day and currency from shop.orders (what Drivethru.sql's pub_curr
+#            computes), pulled month by month through common/cache.py so a
+#            closed month is only scanned once
+#
+# Rates are stored as units of currency per 1 BASE_CURRENCY. Unknown
+# currencies and dates outside the table's days give NaN (the latter with a
+# warning, e.g. when the ECB bundle is behind); a currency converted to
+# itself is always the amount unchanged.
+import os
+from dataclasses import dataclass
+from datetime import date
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# ---- CONFIG ----
+FX_CACHE_DIR = Path(os.getenv("CMA_FX_CACHE_DIR", Path(__file__).resolve().parents[1] / ".cache" / "fx"))
+BASE_CURRENCY = "GBP"
+ECB_START = date(2015, 1, 1)
+
+ORDERS_RATES_SQL = """
+    SELECT order_date::date AS day, currency, AVG(local_price / NULLIF(revenue_inc_vat, 0)) AS rate
+    FROM shop.orders
+    WHERE order_date >= %s AND order_date < %s
+    GROUP BY 1, 2
+"""
+ORDERS_RATES_SCHEMA = {"day": "date32", "currency": "string", "rate": "float64"}
+
+
+def _norm(codes) -> pd.Index:
+    return pd.Index(pd.Series(codes, dtype=object).astype(str).str.strip().str.upper())
+
+
+@dataclass(frozen=True)
+class RateTable:
+    """rates[i, d]: units of currencies[i] per 1 BASE_CURRENCY on start + d days."""
+    currencies: tuple
+    start: date
+    rates: np.ndarray
+    source: str = ""
+
+    @property
+    def end(self) -> date:
+        return self.start + relativedelta(days=self.rates.shape[1] - 1)
+
+    def _rows(self, currency) -> np.ndarray:
+        s = currency if isinstance(currency, pd.Series) else pd.Series(np.atleast_1d(currency))
+        index = pd.Index(self.currencies)
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            # look up each category once, then broadcast through the codes
+            per_cat = np.append(index.get_indexer(_norm(s.cat.categories)), -1)
+            return per_cat[s.cat.codes.to_numpy()]
+        return index.get_indexer(_norm(s.to_numpy()))
+
+    def _cols(self, dates, warn=True):
+        d = pd.to_datetime(pd.Series(np.atleast_1d(dates) if np.ndim(dates) == 0 else dates), errors="coerce")
+        days = (d.to_numpy().astype("datetime64[D]") - np.datetime64(self.start, "D")).astype("int64")
+        n_days = self.rates.shape[1]
+        outside = ((days < 0) | (days >= n_days)) & d.notna().to_numpy()
+        if warn and outside.any():
+            print(f"WARNING: {outside.sum()} dates outside the {self.source or 'FX'} rates "
+                  f"({self.start} to {self.end}), e.g. {d[outside].iloc[0].date()}; converted as NaN")
+        return np.clip(days, 0, n_days - 1), d.isna().to_numpy() | outside
+
+    def rate(self, currency, dates, warn=True) -> np.ndarray:
+        """Units of `currency` per 1 BASE_CURRENCY on each date (NaN when unknown or out of range)."""
+        rows = self._rows(currency)
+        cols, missing = self._cols(dates, warn)
+        if len(cols) == 1 and len(rows) > 1:
+            cols, missing = np.repeat(cols, len(rows)), np.repeat(missing, len(rows))
+        if len(rows) == 1 and len(cols) > 1:
+            rows = np.repeat(rows, len(cols))
+        out = self.rates[np.maximum(rows, 0), cols]
+        out[(rows < 0) | missing] = np.nan
+        return out
+
+    def convert(self, amount, currency, dates, to=BASE_CURRENCY) -> np.ndarray:
+        """amount (in `currency`, per row) converted to `to` at each row's date."""
+        amount = np.asarray(amount, dtype="float64")
+        factor = self.rate(to, dates, warn=False) / self.rate(currency, dates)
+        same = np.asarray(_norm(np.atleast_1d(currency)) == _norm([to])[0])
+        return amount * np.where(same, 1.0, factor)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez_compressed(tmp, currencies=np.array(self.currencies), start=np.datetime64(self.start, "D"),
+                            rates=self.rates, source=np.array(self.source))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as z:
+            return cls(tuple(z["currencies"].tolist()), z["start"].astype("datetime64[D]").item(),
+                       z["rates"], str(z["source"]))
+
+
+def _fill(rates: np.ndarray) -> np.ndarray:
+    # carry each currency's last rate forward over gaps, then its first rate backward
+    df = pd.DataFrame(rates.T).ffill().bfill()
+    return df.to_numpy().T.copy()
+
+
+def from_long(df: pd.DataFrame, source="", base=BASE_CURRENCY, start=None, end=None) -> RateTable:
+    """
+    RateTable from (day, currency, rate) rows; the base currency is 1.0
+    throughout. The table covers at least [start, end] when given (days
+    without rows carry the nearest rate). With no usable rows it only knows
+    the base currency (every other currency gives NaN).
+    """
+    df = df.dropna(subset=["day", "currency", "rate"])
+    df = df[df["rate"] > 0]
+    days = pd.to_datetime(df["day"]).to_numpy().astype("datetime64[D]")
+    span = ([days.min(), days.max()] if len(days) else []) + [np.datetime64(b, "D") for b in (start, end) if b]
+    start = min(span, default=np.datetime64(date.today(), "D"))
+    n_days = int((max(span, default=start) - start).astype("int64")) + 1
+    if df.empty:
+        print(f"WARNING: no {source or 'FX'} rates found; only {base} can be converted")
+        return RateTable((base,), start.item(), np.ones((1, n_days)), source)
+    currencies = tuple(sorted(set(_norm(df["currency"])) | {base}))
+    rates = np.full((len(currencies), n_days), np.nan)
+    rows = pd.Index(currencies).get_indexer(_norm(df["currency"]))
+    rates[rows, (days - start).astype("int64")] = df["rate"].to_numpy(float)
+    rates[currencies.index(base)] = 1.0
+    return RateTable(currencies, start.item(), _fill(rates), source)
+
+
+def _ecb_version():
+    try:
+        return version("CurrencyConverter")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def ecb_table(refresh=False) -> RateTable:
+    """Daily table from currency_converter's bundled ECB data, cached per package version."""
+    path = FX_CACHE_DIR / f"ecb_{_ecb_version()}_{BASE_CURRENCY}.npz"
+    if path.exists() and not refresh:
+        return RateTable.load(path)
+
+    from currency_converter import CurrencyConverter
+
+    print("Building daily ECB rate table (one-off)...")
+    cc = CurrencyConverter(fallback_on_missing_rate=True, fallback_on_wrong_date=True)
+    last = max(b.last_date for b in cc.bounds.values())
+    days = pd.date_range(ECB_START, last, freq="D").date
+    currencies = tuple(sorted(cc.currencies))
+    rates = np.full((len(currencies), len(days)), np.nan)
+    for i, c in enumerate(currencies):
+        first_c, last_c = cc.bounds[c]
+        for d, day in enumerate(days):
+            if first_c <= day <= last_c:
+                rates[i, d] = cc.convert(1, BASE_CURRENCY, c, date=day)
+    table = RateTable(currencies, days[0], _fill(rates), "ecb")
+    table.save(path)
+    return table
+
+
+def orders_table(first, last_excl, conn=None) -> RateTable:
+    """Daily checkout rates from shop.orders for [first, last_excl), one cached query per month."""
+    from common import cache, warehouse
+
+    def pull(c):
+        parts, lo = [], first.replace(day=1)
+        while lo < last_excl:
+            hi = lo + relativedelta(months=1)
+            parts.append(cache.cached_read_sql(c, ORDERS_RATES_SQL, [lo, hi], end_excl=hi,
+                                               label=f"fx_orders_{lo:%Y%m}", schema=ORDERS_RATES_SCHEMA))
+            lo = hi
+        return pd.concat(parts, ignore_index=True)
+
+    if conn is not None:
+        return from_long(pull(conn), source="orders", start=first, end=last_excl - relativedelta(days=1))
+    with warehouse.connection() as c:
+        return from_long(pull(c), source="orders", start=first, end=last_excl - relativedelta(days=1))
+
+
+_tables = {}
+
+
+def rate_table() -> RateTable:
+    """The ECB table, loaded once per process."""
+    if "ecb" not in _tables:
+        _tables["ecb"] = ecb_table()
+    return _tables["ecb"]
+
+
+def convert(amount, currency, dates, to=BASE_CURRENCY, table=None) -> np.ndarray:
+    """Vectorised conversion of whole columns; `table` defaults to the ECB table."""
+    return (table or rate_table()).convert(amount, currency, dates, to=to)
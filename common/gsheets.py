@@ -0,0 +1,198 @@
+# Batched Google Sheets writer.
+#
+# The worksheet is sized once, values go up in row-chunked batch_update calls
+# with exponential backoff on quota/5xx errors, and with diff=True only the
+# row ranges that changed since the last push from this machine are rewritten.
+# Every API call goes through one rate limiter (REQUESTS_PER_MINUTE) shared
+# by all threads and processes on this machine via a locked slot file, so
+# parallel jobs uploading at once stay under the per-user Sheets quota
+# instead of all backing off together.
+# Works with anything shaped like a gspread client (open_by_key -> worksheet).
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limit then only holds within one process
+    fcntl = None
+
+import gspread
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+# ----------------- CONFIG -----------------
+GSHEETS_STATE_DIR = Path(os.getenv("CMA_GSHEETS_STATE_DIR", Path(__file__).resolve().parents[1] / ".cache" / "gsheets"))
+CHUNK_ROWS = 5_000
+MAX_RETRIES = 6
+RETRY_STATUS = {429, 500, 502, 503}
+REQUESTS_PER_MINUTE = int(os.getenv("CMA_SHEETS_REQUESTS_PER_MINUTE", "55"))  # quota is 60/min per user; 0 = no limit
+# ------------------------------------------
+
+
+def df_to_gspread_values(df: pd.DataFrame):
+    """Formats a DataFrame for writing to Google Sheets, column by column."""
+    cols = []
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            s = s.dt.strftime('%Y-%m-%d')
+        mask = s.isna().to_numpy()
+        values = s.tolist()  # numpy scalars -> Python
+        if mask.any():
+            # Replace NaN/NaT with empty strings for Google Sheets
+            values = ["" if m else v for v, m in zip(values, mask)]
+        cols.append(values)
+    header = [str(c) for c in df.columns]
+    return [header] + [list(r) for r in zip(*cols)]
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 60 / per_minute seconds apart. With a `path` the
+    next free slot is kept in that file under an exclusive lock, so every
+    process using the same path shares one budget; without, only this
+    process's threads do.
+    """
+
+    def __init__(self, per_minute, path=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.path = Path(path) if path and fcntl is not None else None
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self, now):
+        """Takes the next slot at or after `now` and returns its time."""
+        if self.path is None:
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+            return at
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    next_at = float(f.read() or 0)
+                except ValueError:
+                    next_at = 0.0
+                at = max(now, next_at)
+                f.seek(0)
+                f.truncate()
+                f.write(repr(at + self.interval))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return at
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            at = self._reserve(now)
+        if at > now:
+            time.sleep(at - now)
+
+
+limiter = RateLimiter(REQUESTS_PER_MINUTE, path=GSHEETS_STATE_DIR / "rate_limit")
+
+
+def with_backoff(fn, *args, **kwargs):
+    """Calls fn, retrying quota and transient server errors with jittered exponential backoff."""
+    for attempt in range(MAX_RETRIES):
+        limiter.wait()
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status not in RETRY_STATUS or attempt == MAX_RETRIES - 1:
+                raise
+            wait = min(2 ** attempt, 64) + random.random()
+            print(f"  Sheets API {status}, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+
+def _row_digests(values):
+    return [hashlib.sha1(json.dumps(r, default=str).encode()).hexdigest() for r in values]
+
+
+def _state_path(sheet_id, title):
+    key = hashlib.sha1(f"{sheet_id}/{title}".encode()).hexdigest()[:16]
+    return GSHEETS_STATE_DIR / f"{key}.json"
+
+
+def _changed_runs(old, new, n_cols_changed):
+    """[start, end) row runs where new differs from old (all rows if the width changed)."""
+    if n_cols_changed:
+        return [(0, len(new))] if new else []
+    runs, start = [], None
+    for i, d in enumerate(new):
+        changed = i >= len(old) or old[i] != d
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(new)))
+    return runs
+
+
+def write_frame(client, sheet_id, worksheet_title, df, diff=False, chunk_rows=CHUNK_ROWS):
+    """
+    Writes df (with header) to the worksheet starting at A1.
+
+    Returns the number of rows uploaded.
+    """
+    sh = with_backoff(client.open_by_key, sheet_id)
+    values = df_to_gspread_values(df)
+    n_rows, n_cols = len(values), max(len(values[0]), 1)
+
+    created = False
+    try:
+        ws = with_backoff(sh.worksheet, worksheet_title)
+    except gspread.WorksheetNotFound:
+        ws = with_backoff(sh.add_worksheet, title=worksheet_title, rows=n_rows, cols=n_cols)
+        created = True
+
+    state_path = _state_path(sheet_id, worksheet_title)
+    digests = _row_digests(values)
+    old = {}
+    if diff and not created and state_path.exists():
+        old = json.loads(state_path.read_text())
+        # the tab was resized (or recreated) by hand since our last push: the digests no longer describe it
+        if (getattr(ws, "row_count", old.get("rows")), getattr(ws, "col_count", old.get("cols"))) != \
+                (old.get("rows"), old.get("cols")):
+            old = {}
+
+    if old and old.get("rows") == n_rows and old.get("cols") == n_cols:
+        runs = _changed_runs(old["digests"], digests, n_cols_changed=False)
+    else:
+        # size the sheet once; this also drops any rows/cols left from a larger push
+        with_backoff(ws.resize, rows=n_rows, cols=n_cols)
+        runs = _changed_runs(old.get("digests", []), digests, n_cols_changed=old.get("cols") != n_cols)
+
+    # split runs into batch_update requests of at most chunk_rows rows
+    pending, pending_rows, uploaded = [], 0, 0
+    for start, end in runs:
+        for lo in range(start, end, chunk_rows):
+            hi = min(lo + chunk_rows, end)
+            if pending_rows + (hi - lo) > chunk_rows and pending:
+                with_backoff(ws.batch_update, pending, value_input_option='USER_ENTERED')
+                pending, pending_rows = [], 0
+            rng = f"{rowcol_to_a1(lo + 1, 1)}:{rowcol_to_a1(hi, n_cols)}"
+            pending.append({"range": rng, "values": values[lo:hi]})
+            pending_rows += hi - lo
+            uploaded += hi - lo
+    if pending:
+        with_backoff(ws.batch_update, pending, value_input_option='USER_ENTERED')
+
+    GSHEETS_STATE_DIR.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps({"rows": n_rows, "cols": n_cols, "digests": digests}))
+    print(f"Uploaded {uploaded} of {n_rows} rows to '{worksheet_title}' in {len(runs)} range(s)")
+    return uploaded
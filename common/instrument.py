@@ -0,0 +1,254 @@
+# Per-stage instrumentation for the reconciliation pipelines.
+#
+#   with instrument.run("genba-202508"):
+#       with instrument.stage("fetch", rows_in=genba_df) as st:
+#           fan_df = fetch(...)
+#           st.rows_out = len(fan_df)
+#       raw = instrument.timed("compute_raw")(compute_raw)(genba_df, fan_df)
+#
+# Every stage records wall time, CPU time, rows in/out and resident memory
+# (at start, peak while it ran, at end). Warehouse queries are recorded the
+# same way as kind="query" (common/warehouse.py). Each finished stage is
+# printed as one line (CMA_LOG_FORMAT=json for JSON instead) and, inside a
+# run(), appended to RUN_LOG_DIR/<run_id>.jsonl; run() also writes
+# RUN_LOG_DIR/<run_id>.json with the whole run's summary.
+#
+# CPU time is the process's, so concurrent stages (run_concurrent) see each
+# other's CPU. Peak memory is sampled every RSS_SAMPLE_SECONDS.
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:  # optional; /proc or getrusage otherwise
+    psutil = None
+
+# ---- CONFIG ----
+RUN_LOG_DIR = Path(os.getenv("CMA_RUN_LOG_DIR", Path(__file__).resolve().parents[1] / "logs"))
+LOG_FORMAT = os.getenv("CMA_LOG_FORMAT", "text")  # "text" or "json"
+RSS_SAMPLE_SECONDS = float(os.getenv("CMA_RSS_SAMPLE_SECONDS", "0.05"))
+
+_MB = 2 ** 20
+_local = threading.local()
+_lock = threading.Lock()
+_run = None  # the active run: {"id", "name", "started", "records", "log"}
+
+
+# ---------------- memory ----------------
+
+def max_rss_bytes():
+    """Peak resident set size of this process so far."""
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r * 1024  # bytes on macOS, KiB on Linux
+
+
+def rss_bytes():
+    """Current resident set size."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return max_rss_bytes()
+
+
+class _Sampler(threading.Thread):
+    """Background thread raising every open stage's peak to the current RSS."""
+
+    def __init__(self):
+        super().__init__(daemon=True, name="cma-rss-sampler")
+        self.pid = os.getpid()
+        self.watching = set()
+
+    def run(self):
+        while True:
+            time.sleep(RSS_SAMPLE_SECONDS)
+            rss = rss_bytes()
+            for st in list(self.watching):
+                st.peak_rss = max(st.peak_rss, rss)
+
+
+_sampler = None
+
+
+def _watch(st):
+    global _sampler
+    with _lock:
+        # a forked worker inherits the object but not the thread
+        if _sampler is None or _sampler.pid != os.getpid():
+            _sampler = _Sampler()
+            _sampler.start()
+        _sampler.watching.add(st)
+
+
+# ---------------- stages ----------------
+
+def rows(x):
+    """Row count of a frame/array/sequence, None for anything else."""
+    shape = getattr(x, "shape", None)
+    if shape:
+        return int(shape[0])
+    if isinstance(x, (list, set, dict)):
+        return len(x)
+    return None
+
+
+class Stage:
+    """An open stage; set rows_out (or add_rows() for streamed output) before it closes."""
+
+    def __init__(self, name, kind, rows_in, fields):
+        stack = _stack()
+        self.name = name
+        self.path = f"{stack[-1].path}/{name}" if stack else name
+        self.kind = kind
+        self.rows_in = rows_in if rows_in is None or isinstance(rows_in, int) else rows(rows_in)
+        self.rows_out = None
+        self.fields = fields
+        self.start_rss = self.peak_rss = rss_bytes()
+
+    def add_rows(self, n):
+        self.rows_out = (self.rows_out or 0) + n
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def stage(name, rows_in=None, kind="stage", **fields):
+    """Records one stage; `rows_in` is a count or anything rows() understands."""
+    st = Stage(name, kind, rows_in, fields)
+    stack = _stack()
+    stack.append(st)
+    _watch(st)
+    t0, c0 = time.perf_counter(), time.process_time()
+    status = "ok"
+    try:
+        yield st
+    except BaseException as e:
+        status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+        _sampler.watching.discard(st)
+        end_rss = rss_bytes()
+        # by identity: a generator's stage can close while the consumer's is on top
+        if st in stack:
+            stack.remove(st)
+        _emit({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "run_id": _run["id"] if _run else None,
+            "stage": st.path,
+            "kind": kind,
+            "status": status,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "rows_in": st.rows_in,
+            "rows_out": st.rows_out,
+            "rss_start_mb": round(st.start_rss / _MB, 1),
+            "rss_peak_mb": round(max(st.peak_rss, end_rss) / _MB, 1),
+            "rss_end_mb": round(end_rss / _MB, 1),
+            **st.fields,
+        })
+
+
+def timed(name=None, kind="stage"):
+    """
+    Decorator form of stage(): rows_in is the first argument that is a frame,
+    rows_out the result's row count.
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            frames = [a for a in args if rows(a) is not None and hasattr(a, "shape")]
+            with stage(name or fn.__name__, rows_in=frames[0] if frames else None, kind=kind) as st:
+                out = fn(*args, **kwargs)
+                st.rows_out = rows(out)
+                return out
+        return wrapper
+    return deco
+
+
+def query_label(sql, width=80):
+    """One-line summary of a SQL statement for the logs."""
+    return " ".join(sql.split())[:width]
+
+
+# ---------------- output ----------------
+
+def _emit(rec):
+    with _lock:
+        if _run is not None:
+            _run["records"].append(rec)
+            with open(_run["log"], "a") as f:
+                f.write(json.dumps(rec, default=str) + "\n")
+    if LOG_FORMAT == "json":
+        print(json.dumps(rec, default=str), flush=True)
+    else:
+        print(_format(rec), flush=True)
+
+
+def _format(rec):
+    rows_part = ""
+    if rec["rows_in"] is not None or rec["rows_out"] is not None:
+        fmt = lambda n: "-" if n is None else f"{n:,}"
+        rows_part = f"  rows {fmt(rec['rows_in'])} -> {fmt(rec['rows_out'])}"
+    what = rec.get("sql", "") if rec["kind"] == "query" else ""
+    flag = "" if rec["status"] == "ok" else f"  [{rec['status']}]"
+    return (f"[{rec['kind']}] {rec['stage']}  {rec['wall_s']:.2f}s (cpu {rec['cpu_s']:.2f}s){rows_part}"
+            f"  rss {rec['rss_end_mb']:,.0f} MB (peak {rec['rss_peak_mb']:,.0f}){flag}"
+            + (f"  {what}" if what else ""))
+
+
+@contextmanager
+def run(name):
+    """
+    Groups the stages of one pipeline run and writes its summary on exit.
+    Runs don't nest: inside an active run this just yields it.
+    """
+    global _run
+    if _run is not None:
+        yield _run
+        return
+    RUN_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    run_id = f"{name}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    _run = {"id": run_id, "name": name, "started": datetime.now(), "records": [],
+            "log": RUN_LOG_DIR / f"{run_id}.jsonl"}
+    t0, c0 = time.perf_counter(), time.process_time()
+    status = "ok"
+    try:
+        yield _run
+    except BaseException as e:
+        status = f"error: {type(e).__name__}: {e}"
+        raise
+    finally:
+        current, _run = _run, None
+        summary = {
+            "run_id": run_id,
+            "name": name,
+            "started": current["started"].isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "status": status,
+            "wall_s": round(time.perf_counter() - t0, 3),
+            "cpu_s": round(time.process_time() - c0, 3),
+            "max_rss_mb": round(max_rss_bytes() / _MB, 1),
+            "queries": sum(r["kind"] == "query" for r in current["records"]),
+            "query_s": round(sum(r["wall_s"] for r in current["records"] if r["kind"] == "query"), 3),
+            "slowest": sorted(({"stage": r["stage"], "wall_s": r["wall_s"]} for r in current["records"]),
+                              key=lambda r: -r["wall_s"])[:5],
+            "stages": current["records"],
+        }
+        path = RUN_LOG_DIR / f"{run_id}.json"
+        path.write_text(json.dumps(summary, indent=2, default=str))
+        print(f"Run {run_id}: {summary['wall_s']:.1f}s, peak RSS {summary['max_rss_mb']:,.0f} MB -> {path}")
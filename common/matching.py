@@ -0,0 +1,177 @@
+# Fuzzy name matching between distributor reports and shop.suppliers.
+#
+# Scores are computed with rapidfuzz.process.cdist (one C call, multi-threaded
+# via `workers`) instead of one extractOne per row. For large candidate lists
+# an optional token or character n-gram blocking index restricts each query to
+# candidates that share at least one key with it.
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+from unidecode import unidecode
+
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9\s]')
+# common business suffixes
+_SUFFIX_RE = re.compile(r'\b(ltd|limited|inc|corp|corporation|co|company|gmbh|ag|plc|llc|llp|pte|pty|bv|nv|sas|sl|sa|sp\s*z\s*o\s*o|oy|oyj|ab)\b')
+_SPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=65_536)
+def _normalize(s: str) -> str:
+    s = unidecode(s).lower()
+    s = s.replace('&', ' and ')
+    s = _NON_ALNUM_RE.sub(' ', s)
+    s = _SUFFIX_RE.sub(' ', s)
+    return _SPACE_RE.sub(' ', s).strip()
+
+
+def normalize_name(s):
+    """Cleans and standardizes a supplier name for matching."""
+    if pd.isna(s):
+        return ''
+    return _normalize(str(s))
+
+
+def block_keys(s, block="token", ngram=3):
+    """Blocking keys for a normalised name: its words, or its character n-grams."""
+    if not s:
+        return set()
+    if block == "token":
+        return {t for t in s.split() if len(t) > 1}
+    if block == "ngram":
+        s = s.replace(" ", "")
+        return {s[i:i + ngram] for i in range(max(len(s) - ngram + 1, 1))}
+    raise ValueError(f"Unknown block type: {block}")
+
+
+class FuzzyMatcher:
+    """
+    Top-k fuzzy matcher over a fixed list of (already normalised) choices.
+
+        m = FuzzyMatcher(suppliers_norm, block="token")
+        m.match(publishers_norm, k=3, threshold=80)
+
+    block:     None scores every query against every choice; "token"/"ngram"
+               only score pairs sharing a word / character n-gram.
+    max_df:    keys found in more than this fraction of choices (e.g. "games")
+               are too common to be useful and are ignored for blocking.
+    fallback:  queries left with no candidate block are scored against "all"
+               choices or get "none"; either way the count is reported.
+    """
+
+    def __init__(self, choices, scorer=fuzz.token_set_ratio, workers=-1,
+                 block=None, ngram=3, max_df=0.05, fallback="all", batch_size=2_000):
+        self.choices = list(choices)
+        self.scorer = scorer
+        self.workers = workers
+        self.block = block
+        self.ngram = ngram
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.index = {}
+        if block:
+            index = defaultdict(list)
+            for j, c in enumerate(self.choices):
+                for key in block_keys(c, block, ngram):
+                    index[key].append(j)
+            limit = max(1, int(max_df * len(self.choices)))
+            self.index = {k: np.array(v) for k, v in index.items() if len(v) <= limit}
+
+    def _cdist(self, queries, choices):
+        # float scores, compared to the threshold unrounded as extractOne does
+        # (uint8 would round 89.6 up to 90 and tie distinct scores)
+        return process.cdist(queries, choices, scorer=self.scorer, workers=self.workers, dtype=np.float64)
+
+    def _pairs_full(self, q_pos, queries, threshold):
+        """(query_pos, choice_pos, score) for every pair above threshold, in batches."""
+        out = []
+        for b in range(0, len(q_pos), self.batch_size):
+            scores = self._cdist([queries[i] for i in q_pos[b:b + self.batch_size]], self.choices)
+            qi, cj = np.nonzero(scores >= threshold)
+            out.append((np.asarray(q_pos[b:b + self.batch_size])[qi], cj, scores[qi, cj]))
+        return out
+
+    def _pairs_blocked(self, queries, threshold):
+        by_key = defaultdict(list)
+        orphans = []
+        for i, s in enumerate(queries):
+            if not s:
+                continue
+            keys = [k for k in block_keys(s, self.block, self.ngram) if k in self.index]
+            if not keys:
+                orphans.append(i)
+            for k in keys:
+                by_key[k].append(i)
+
+        out = []
+        for k, q_pos in by_key.items():
+            cand = self.index[k]
+            scores = self._cdist([queries[i] for i in q_pos], [self.choices[j] for j in cand])
+            qi, cj = np.nonzero(scores >= threshold)
+            out.append((np.asarray(q_pos)[qi], cand[cj], scores[qi, cj]))
+
+        if orphans:
+            print(f"{len(orphans)} of {len(queries)} names share no blocking key "
+                  f"with the candidates (fallback: {self.fallback})")
+            if self.fallback == "all":
+                out += self._pairs_full(orphans, queries, threshold)
+        return out
+
+    def match(self, queries, k=1, threshold=0) -> pd.DataFrame:
+        """
+        Best `k` choices per query with score >= threshold.
+
+        Returns columns query_pos, choice_pos, score, rank (1 = best); ties go to
+        the earlier choice, as with extractOne. Empty queries never match.
+        """
+        queries = list(queries)
+        if not queries or not self.choices:
+            parts = []
+        elif self.block:
+            parts = self._pairs_blocked(queries, threshold)
+        else:
+            non_empty = [i for i, s in enumerate(queries) if s]
+            parts = self._pairs_full(non_empty, queries, threshold)
+
+        cols = ["query_pos", "choice_pos", "score", "rank"]
+        if not parts:
+            return pd.DataFrame(columns=cols)
+        pairs = pd.DataFrame({
+            "query_pos": np.concatenate([p[0] for p in parts]),
+            "choice_pos": np.concatenate([p[1] for p in parts]),
+            "score": np.concatenate([p[2] for p in parts]),
+        })
+        # blocks overlap, so the same pair can be scored more than once
+        pairs = pairs.drop_duplicates(["query_pos", "choice_pos"])
+        pairs = pairs.sort_values(["query_pos", "score", "choice_pos"], ascending=[True, False, True])
+        pairs["rank"] = pairs.groupby("query_pos").cumcount() + 1
+        return pairs[pairs["rank"] <= k].reset_index(drop=True)[cols]
+
+
+def fuzzy_merge(df_left, df_right, left_key, right_key, threshold=90, block=None, workers=-1):
+    """
+    Merges two DataFrames based on a fuzzy match of string columns.
+    """
+    L = df_left.copy()
+    R = df_right.copy()
+    L['_name_norm'] = L[left_key].map(normalize_name)
+    R['_name_norm'] = R[right_key].map(normalize_name)
+
+    matcher = FuzzyMatcher(R['_name_norm'], block=block, workers=workers)
+    M = matcher.match(L['_name_norm'], k=1, threshold=threshold)
+    M = pd.DataFrame({
+        'left_idx': L.index[M['query_pos'].to_numpy(dtype=int)],
+        'right_idx': R.index[M['choice_pos'].to_numpy(dtype=int)],
+        'match_score': M['score'].to_numpy(),
+    })
+
+    # Merge based on indices
+    out = L.merge(M, left_index=True, right_on='left_idx', how='left')
+    out = out.merge(R, left_on='right_idx', right_index=True, how='left', suffixes=('_left', '_right'))
+
+    out = out.drop(columns=[c for c in ['_name_norm_left', '_name_norm_right', 'left_idx', 'right_idx', 'match_score'] if c in out.columns])
+    return out
@@ -0,0 +1,222 @@
+# Per-month order line snapshots shared by the royalty and analytics jobs.
+#
+# Each closed month of shop.order_details (joined to products, suppliers and
+# the FantasyVerse collection flag) is extracted once into a partitioned
+# Parquet dataset:
+#
+#   SNAPSHOT_DIR/order_lines_v<SNAPSHOT_VERSION>/month=2025-08/part-0.parquet
+#
+# and every later read is a local scan. The open month is never written
+# there; it is queried through common/cache.py with its usual TTL.
+#
+#   python -m common.snapshots build 2024-11 2025-08
+#   python -m common.snapshots list
+#
+# A snapshot is the month as it looked when extracted. Later status changes
+# (refunds, chargebacks of old orders) are not picked up; rebuild with
+# --refresh, or query the warehouse for anything driven by refund dates.
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from common import cache
+
+# ---- CONFIG ----
+SNAPSHOT_DIR = Path(os.getenv("CMA_SNAPSHOT_DIR", Path(__file__).resolve().parents[1] / ".cache" / "snapshots"))
+SNAPSHOT_VERSION = 2  # bump when SNAPSHOT_SQL changes; old partitions are then ignored
+
+SNAPSHOT_SQL = """
+    WITH fv AS (
+        SELECT product_id, (SUM(CASE WHEN collection = 'FantasyVerse' THEN 1 ELSE 0 END) > 0) AS is_fv
+        FROM shop.product_collections
+        GROUP BY 1
+    )
+    SELECT od.iid, od.order_id, od.user_id, od.order_date::timestamp AS order_ts,
+           od.order_date::date AS order_date, od.status,
+           od.product_id, od.product_name, p.product_type, fv.is_fv,
+           p.supplier_id, s.supplier_name, od.supplier_name AS od_supplier_name,
+           s.vaultn, od.drivethrurpg,
+           od.promo_name, od.bundle_name, od.currency, od.units,
+           od.royalty / 100.0 AS royalty, od.royalty_percentage,
+           od.revenue_ex_vat / 100.0 AS revenue_ex_vat,
+           od.revenue_ex_vat_pf / 100.0 AS revenue_ex_vat_pf,
+           od.margin / 100.0 AS margin,
+           od.transaction_fee / 100.0 AS transaction_fee,
+           od.affiliate_commission, od.affiliate_fee,
+           od.exclusivity_fee / 100.0 AS exclusivity_fee,
+           od.first_refund, od.first_fraud, od.first_chargeback
+    FROM shop.order_details od
+    LEFT JOIN shop.products p ON p.product_id = od.product_id
+    LEFT JOIN shop.suppliers s ON s.supplier_id = p.supplier_id
+    LEFT JOIN fv ON fv.product_id = od.product_id
+    WHERE od.order_date >= %s AND od.order_date < %s
+"""
+SNAPSHOT_SCHEMA = {
+    "iid": "string", "order_id": "int64", "user_id": "int64", "order_ts": "timestamp",
+    "order_date": "date32", "status": "string",
+    "product_id": "int64", "product_name": "string", "product_type": "string", "is_fv": "bool",
+    "supplier_id": "int64", "supplier_name": "string", "od_supplier_name": "string",
+    "vaultn": "bool", "drivethrurpg": "bool",
+    "promo_name": "string", "bundle_name": "string", "currency": "string", "units": "int32",
+    "royalty": "float64", "royalty_percentage": "float64", "revenue_ex_vat": "float64",
+    "revenue_ex_vat_pf": "float64", "margin": "float64", "transaction_fee": "float64",
+    "affiliate_commission": "float64", "affiliate_fee": "float64", "exclusivity_fee": "float64",
+    "first_refund": "timestamp", "first_fraud": "timestamp", "first_chargeback": "timestamp",
+}
+
+
+def _month_start(d) -> date:
+    d = pd.Timestamp(d).date()
+    return d.replace(day=1)
+
+
+def _months(first, last_excl) -> list:
+    m, out = _month_start(first), []
+    while m < last_excl:
+        out.append(m)
+        m += relativedelta(months=1)
+    return out
+
+
+def _root() -> Path:
+    return SNAPSHOT_DIR / f"order_lines_v{SNAPSHOT_VERSION}"
+
+
+def _partition(month: date) -> Path:
+    return _root() / f"month={month:%Y-%m}"
+
+
+def is_built(month: date) -> bool:
+    return (_partition(month) / "_manifest.json").exists()
+
+
+def _write(month: date, df: pd.DataFrame):
+    part = _partition(month)
+    tmp = part.with_name(part.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    df.to_parquet(tmp / "part-0.parquet", index=False)
+    (tmp / "_manifest.json").write_text(json.dumps({
+        "month": f"{month:%Y-%m}", "rows": len(df), "version": SNAPSHOT_VERSION, "built": time.time(),
+    }))
+    shutil.rmtree(part, ignore_errors=True)
+    os.replace(tmp, part)
+    print(f"Snapshot {month:%Y-%m}: {len(df)} order lines")
+
+
+def build(months, conn=None, refresh=False) -> list:
+    """
+    Extracts the closed months not yet snapshotted, with ONE query spanning
+    all of them, split by month in memory. Returns the months written.
+    """
+    todo = sorted({_month_start(m) for m in months})
+    todo = [m for m in todo if cache.is_closed_window(m + relativedelta(months=1)) and (refresh or not is_built(m))]
+    if not todo:
+        return []
+    from common import warehouse
+
+    lo, hi = todo[0], todo[-1] + relativedelta(months=1)
+    print(f"Extracting order lines {lo} to (excl) {hi} for {len(todo)} snapshot months")
+    if conn is not None:
+        lines = warehouse.read_frame(conn, SNAPSHOT_SQL, (lo, hi), schema=SNAPSHOT_SCHEMA)
+    else:
+        with warehouse.connection() as c:
+            lines = warehouse.read_frame(c, SNAPSHOT_SQL, (lo, hi), schema=SNAPSHOT_SCHEMA)
+
+    month_of = pd.to_datetime(lines["order_date"]).dt.to_period("M").dt.start_time.dt.date
+    parts = dict(tuple(lines.groupby(month_of)))
+    for m in todo:
+        _write(m, parts.get(m, lines.iloc[0:0]).reset_index(drop=True))
+    return todo
+
+
+def _open_month(month: date, conn=None) -> pd.DataFrame:
+    end = month + relativedelta(months=1)
+
+    def pull(c):
+        return cache.cached_read_sql(c, SNAPSHOT_SQL, [month, end], end_excl=end,
+                                     label=f"order_lines_open_{month:%Y%m}", schema=SNAPSHOT_SCHEMA)
+
+    if conn is not None:
+        return pull(conn)
+    from common import warehouse
+
+    with warehouse.connection() as c:
+        return pull(c)
+
+
+def read(first, last_excl, columns=None, where=None, conn=None) -> pd.DataFrame:
+    """
+    Order lines with first <= order_date < last_excl. Missing closed months
+    are built first; `columns` and `where` (a pyarrow.dataset expression,
+    e.g. ds.field("vaultn") == True) are pushed into the Parquet scan.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    first, last_excl = pd.Timestamp(first).date(), pd.Timestamp(last_excl).date()
+    months = _months(first, last_excl)
+    build(months, conn=conn)
+    closed = [m for m in months if is_built(m)]
+    cols = None if columns is None else list(dict.fromkeys(list(columns) + ["order_date"]))
+
+    frames = []
+    if closed:
+        files = [str(_partition(m) / "part-0.parquet") for m in closed]
+        table = ds.dataset(files, format="parquet").to_table(columns=cols, filter=where)
+        frames.append(table.to_pandas())
+    for m in months:
+        if m not in closed:
+            df = _open_month(m, conn)
+            if where is not None:
+                df = ds.dataset(pa.Table.from_pandas(df, preserve_index=False)).to_table(filter=where).to_pandas()
+            frames.append(df if cols is None else df[cols])
+
+    if not frames:
+        return pd.DataFrame(columns=cols or list(SNAPSHOT_SCHEMA))
+    df = pd.concat(frames, ignore_index=True)
+    d = pd.to_datetime(df["order_date"]).dt.date
+    df = df[(d >= first) & (d < last_excl)].reset_index(drop=True)
+    return df if columns is None or "order_date" in columns else df.drop(columns="order_date")
+
+
+def read_month(month, columns=None, where=None, conn=None) -> pd.DataFrame:
+    """One calendar month of order lines."""
+    m = _month_start(month)
+    return read(m, m + relativedelta(months=1), columns=columns, where=where, conn=conn)
+
+
+def manifests() -> pd.DataFrame:
+    rows = [json.loads(p.read_text()) for p in sorted(_root().glob("month=*/_manifest.json"))]
+    return pd.DataFrame(rows, columns=["month", "rows", "version", "built"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-month order line snapshots.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="snapshot the closed months in a range")
+    b.add_argument("first", help="YYYY-MM")
+    b.add_argument("last", help="YYYY-MM (inclusive)")
+    b.add_argument("--refresh", action="store_true", help="re-extract months that already exist")
+    sub.add_parser("list")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        first = date(int(args.first[:4]), int(args.first[5:7]), 1)
+        last = date(int(args.last[:4]), int(args.last[5:7]), 1)
+        build(_months(first, last + relativedelta(months=1)), refresh=args.refresh)
+    else:
+        df = manifests()
+        df["built"] = pd.to_datetime(df["built"], unit="s").dt.strftime("%Y-%m-%d %H:%M")
+        print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
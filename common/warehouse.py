@@ -0,0 +1,229 @@
+# Shared Redshift access for the reconciliation and analytics jobs.
+#
+# One lazily created connection pool per process, server-side (named) cursors
+# for large results, a per-connection statement timeout, helpers to restrict
+# a query to a set of keys (temp table or batched IN lists), and a helper to
+# run independent queries concurrently on separate pooled connections.
+# Point REDSHIFT_* at a local PostgreSQL (REDSHIFT_SSLMODE=disable) to test.
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from common import instrument
+
+load_dotenv()
+
+# ----------------- CONFIG -----------------
+POOL_SIZE = int(os.getenv("REDSHIFT_POOL_SIZE", "4"))
+FETCH_SIZE = int(os.getenv("REDSHIFT_FETCH_SIZE", "200000"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("REDSHIFT_STATEMENT_TIMEOUT_MS", str(30 * 60 * 1000)))
+KEY_BATCH_SIZE = int(os.getenv("REDSHIFT_KEY_BATCH_SIZE", "5000"))
+REQUIRED_ENV = ["REDSHIFT_HOST", "REDSHIFT_DB", "REDSHIFT_USER", "REDSHIFT_PASSWORD"]
+# ------------------------------------------
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def require_env():
+    missing = [k for k in REQUIRED_ENV if not os.getenv(k)]
+    if missing:
+        raise RuntimeError(f"Missing environment variables: {missing}")
+
+
+def connect_kwargs():
+    return dict(
+        host=os.getenv("REDSHIFT_HOST"),
+        port=int(os.getenv("REDSHIFT_PORT", "5439")),
+        dbname=os.getenv("REDSHIFT_DB"),
+        user=os.getenv("REDSHIFT_USER"),
+        password=os.getenv("REDSHIFT_PASSWORD"),
+        sslmode=os.getenv("REDSHIFT_SSLMODE", "require"),
+    )
+
+
+def get_pool():
+    """The process-wide pool; recreated after a fork so workers never share sockets."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            require_env()
+            _pool = ThreadedConnectionPool(1, POOL_SIZE, **connect_kwargs())
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection(statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+    """
+    Borrows a pooled connection for one unit of work.
+
+    Commits on success and rolls back on error, so temp tables and named
+    cursors never leak into the next borrower's transaction.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        set_statement_timeout(conn, statement_timeout_ms)
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+def set_statement_timeout(conn, statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout TO %s", (statement_timeout_ms,))
+
+
+def rollback(conn, statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+    """
+    Rolls back a failed unit of work to retry on the same connection. The
+    SET statement_timeout ran inside the rolled-back transaction, so it is
+    applied again.
+    """
+    conn.rollback()
+    set_statement_timeout(conn, statement_timeout_ms)
+
+
+def iter_frames(conn, sql, params=None, fetch_size=FETCH_SIZE, schema=None):
+    """
+    Yields DataFrames of up to fetch_size rows from a server-side cursor.
+
+    With a `schema` ({column: "float64"/"string"/"date32"/...}) rows are built
+    into typed Arrow columns instead (see common/arrow_fetch.py). The query is
+    recorded as one instrument stage, open until the last chunk is consumed.
+    """
+    with instrument.stage("sql", kind="query", sql=instrument.query_label(sql)) as st:
+        for frame in _iter_frames(conn, sql, params, fetch_size, schema):
+            st.add_rows(len(frame))
+            yield frame
+
+
+def _iter_frames(conn, sql, params, fetch_size, schema):
+    if schema is not None:
+        from common.arrow_fetch import iter_typed_frames
+
+        yield from iter_typed_frames(conn, sql, params, schema, fetch_size)
+        return
+    with conn.cursor(name=f"cma_{uuid.uuid4().hex[:12]}") as cur:
+        cur.itersize = fetch_size
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=[d[0] for d in cur.description])
+
+
+def read_frame(conn, sql, params=None, fetch_size=FETCH_SIZE, schema=None) -> pd.DataFrame:
+    """Whole result of a query, fetched through a server-side cursor."""
+    with instrument.stage("sql", kind="query", sql=instrument.query_label(sql)) as st:
+        df = _read_frame(conn, sql, params, fetch_size, schema)
+        st.rows_out = len(df)
+        return df
+
+
+def _read_frame(conn, sql, params, fetch_size, schema):
+    if schema is not None:
+        from common.arrow_fetch import read_typed_frame
+
+        return read_typed_frame(conn, sql, params, schema, fetch_size)
+    parts = list(_iter_frames(conn, sql, params, fetch_size, None))
+    if parts:
+        return pd.concat(parts, ignore_index=True)
+    with conn.cursor() as cur:
+        # empty result: still return the right columns
+        cur.execute(f"SELECT * FROM ({sql.rstrip().rstrip(';')}) q LIMIT 0", params)
+        return pd.DataFrame(columns=[d[0] for d in cur.description])
+
+
+def temp_table(conn, name, columns, rows, page_size=KEY_BATCH_SIZE) -> int:
+    """
+    (Re)creates the session temp table `name` with `columns` ({column: sql
+    type}) and inserts `rows` (tuples in column order). Returns the row count.
+    """
+    with instrument.stage("upload", rows_in=len(rows), kind="query", sql=f"temp table {name}"):
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {name}")
+            cur.execute(f"CREATE TEMP TABLE {name} ({', '.join(f'{c} {t}' for c, t in columns.items())})")
+            if rows:
+                execute_values(cur, f"INSERT INTO {name} ({', '.join(columns)}) VALUES %s", rows, page_size=page_size)
+    return len(rows)
+
+
+def read_for_keys(conn, sql, keys, params=(), mode="temp_table", table="cma_keys", key_type="varchar(64)",
+                  batch_size=KEY_BATCH_SIZE, schema=None) -> pd.DataFrame:
+    """
+    Runs `sql` for only the given keys. `sql` has one `{keys}` placeholder
+    standing for the parenthesised key set, e.g. "WHERE od.iid IN {keys}":
+
+      temp_table - upload the distinct keys to session temp table `table`
+                   and use (SELECT key FROM table); one query
+      in_list    - one query per batch_size keys with an IN %s list
+
+    `params` are the query's other %s parameters, in order. A typed fetch
+    through a backend that can't see session temp tables uses in_list.
+    """
+    keys = sorted({str(k) for k in keys if pd.notna(k) and str(k)})
+    params = tuple(params)
+    if mode == "temp_table" and schema is not None:
+        from common.arrow_fetch import sees_temp_tables
+
+        if not sees_temp_tables():
+            mode = "in_list"
+    if mode == "temp_table":
+        temp_table(conn, table, {"key": key_type}, [(k,) for k in keys])
+        return read_frame(conn, sql.format(keys=f"(SELECT key FROM {table})"), params, schema=schema)
+    if mode != "in_list":
+        raise ValueError(f"Unknown key mode: {mode}")
+    n_before = sql[:sql.index("{keys}")].count("%s")
+    batch_sql = sql.format(keys="%s")
+    parts = [
+        read_frame(conn, batch_sql, params[:n_before] + (tuple(keys[b:b + batch_size]),) + params[n_before:],
+                   schema=schema)
+        for b in range(0, len(keys), batch_size)
+    ]
+    if parts:
+        return pd.concat(parts, ignore_index=True)
+    # no keys: an empty frame with the query's columns
+    return read_frame(conn, sql.format(keys="(NULL)"), params, schema=schema)
+
+
+def run_concurrent(jobs, max_workers=None):
+    """
+    Runs independent jobs at the same time, each on its own pooled connection.
+
+    jobs: {name: fn(conn) -> result}. Returns {name: result}.
+    """
+    def run(fn):
+        with connection() as conn:
+            return fn(conn)
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(jobs), POOL_SIZE)) as ex:
+        futures = {name: ex.submit(run, fn) for name, fn in jobs.items()}
+        return {name: f.result() for name, f in futures.items()}
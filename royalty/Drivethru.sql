@@ -1,3 +1,6 @@
+-- Superseded by royalty/drivethru/drivethru.py (python royalty/drivethru/drivethru.py --month YYYY-MM);
+-- kept for reference.
+
 --complete query
 
 with pub_curr as (
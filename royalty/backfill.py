@@ -0,0 +1,34 @@
+# Re-run reconciliations over a range of closed months:
+#
+#   python royalty/backfill.py 2024-09 2025-08
+#   python royalty/backfill.py 2025-01 2025-06 -d vaultn --workers 6
+#
+# Each distributor pulls its warehouse data for the whole range in a single
+# window-bounded extract, split per month in memory, and the months then run
+# in parallel writing one pivot/report per month. Per-month report files are
+# found via GENBA_EXCEL_TEMPLATE / VAULTN_EXCEL_TEMPLATE (use {yyyymm} when
+# the range spans more than a year).
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from royalty.framework import PLUGIN_MODULES, run_backfill
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill distributor reconciliations for a month range.")
+    parser.add_argument("first", help="first month, YYYY-MM")
+    parser.add_argument("last", help="last month (inclusive), YYYY-MM")
+    parser.add_argument("-d", "--distributors", nargs="+", default=list(PLUGIN_MODULES), choices=list(PLUGIN_MODULES))
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    summary = run_backfill(args.distributors, args.first, args.last, max_workers=args.workers)
+    print(summary.to_string(index=False))
+    if "error" in summary.columns and summary["error"].notna().any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
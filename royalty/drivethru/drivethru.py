@@ -0,0 +1,198 @@
+# DriveThru royalty statements for a month (replaces the hand-edited
+# royalty/Drivethru.sql):
+#
+#   python royalty/drivethru/drivethru.py                 # last month
+#   python royalty/drivethru/drivethru.py --month 2025-07
+#   python royalty/run_reconciliations.py -d drivethru -m 2025-07
+#
+# One window-bounded query pulls the month's completed DriveThru sales and the
+# refunds/frauds/chargebacks (incl. partial refunds) that happened in the
+# month, cached per month (common/cache.py). USD conversion uses the daily
+# checkout rate table from common/fx.py, pulled per month and cached, instead
+# of aggregating all of shop.orders on every run. Statements are grouped in
+# pandas and written to drivethru_sales_<yyyymm>.csv / drivethru_refunds_<yyyymm>.csv.
+import argparse
+import sys
+from pathlib import Path
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common import cache, fx, warehouse
+from royalty.framework import Distributor, MonthWindow, register
+
+# ---- CONFIG ----
+DRIVETHRU_PERCENTAGE = 0.05
+PUBLISHER_CURRENCY = "USD"
+REFUND_LOOKBACK_MONTHS = 12  # refunds in the month are searched among orders this far back
+
+DRIVETHRU_SQL = """
+    WITH partial_refund_dates AS (
+        SELECT order_id, MIN(date) AS first_partial_refund
+        FROM shop.notes
+        WHERE note LIKE 'Partial refund of %%' AND date >= %(lookback)s
+        GROUP BY 1
+    )
+    SELECT CASE WHEN od.status = 'COMPLETE' THEN 'sale' ELSE 'refund' END AS kind,
+           od.order_date::date AS order_date,
+           od.supplier_name,
+           p.isbn::text AS isbn,
+           p.sku,
+           od.product_name,
+           od.promo_name,
+           od.bundle_name,
+           od.revenue_ex_vat_pf,
+           od.transaction_fee,
+           od.affiliate_commission,
+           od.affiliate_fee,
+           od.exclusivity_fee,
+           fixed_royalty_currency,
+           od.royalty_percentage
+    FROM shop.order_details od
+    JOIN shop.products p ON p.product_id = od.product_id
+    LEFT JOIN partial_refund_dates prd ON prd.order_id = od.order_id
+    WHERE od.drivethrurpg = TRUE
+      AND (
+            (od.status = 'COMPLETE' AND od.order_date >= %(start)s AND od.order_date < %(end)s)
+         OR (od.status != 'COMPLETE' AND od.order_date >= %(lookback)s
+             AND LEAST(first_refund, first_fraud, first_chargeback, first_partial_refund) >= %(start)s
+             AND LEAST(first_refund, first_fraud, first_chargeback, first_partial_refund) < %(end)s)
+      )
+"""
+DRIVETHRU_SCHEMA = {
+    "kind": "string", "order_date": "date32", "supplier_name": "string", "isbn": "string",
+    "sku": "string", "product_name": "string", "promo_name": "string", "bundle_name": "string",
+    "revenue_ex_vat_pf": "float64", "transaction_fee": "float64", "affiliate_commission": "float64",
+    "affiliate_fee": "float64", "exclusivity_fee": "float64", "fixed_royalty_currency": "string",
+    "royalty_percentage": "float64",
+}
+
+# per-column signs, as Drivethru.sql reported them: refunds negate everything but value
+SALE_SIGNS = {"qty": 1, "value": 1, "deductions": 1, "net": 1, "royalty": 1}
+REFUND_SIGNS = {"qty": -1, "value": 1, "deductions": -1, "net": -1, "royalty": -1}
+
+STATEMENT_COLUMNS = ["supplier_name", "sku", "name", "qty", "value", "deductions", "net",
+                     "royalty_percentage", "royalty", "in_bundle"]
+
+
+def load_lines(month: MonthWindow, conn=None) -> pd.DataFrame:
+    """The month's DriveThru sale and refund lines, from the local cache after the first pull."""
+    params = {"start": month.start, "end": month.end_excl,
+              "lookback": month.start - relativedelta(months=REFUND_LOOKBACK_MONTHS)}
+
+    def pull(c):
+        return cache.cached_read_sql(c, DRIVETHRU_SQL, params, end_excl=month.end_excl,
+                                     label=f"drivethru_{month.yyyymm}", schema=DRIVETHRU_SCHEMA)
+
+    if conn is not None:
+        return pull(conn)
+    with warehouse.connection() as c:
+        return pull(c)
+
+
+def usd_rates(lines: pd.DataFrame, month: MonthWindow) -> fx.RateTable:
+    """Daily checkout rates covering every line's order date."""
+    first = pd.to_datetime(lines["order_date"]).min()
+    first = month.start if pd.isna(first) else min(first.date(), month.start)
+    return fx.orders_table(first, month.end_excl)
+
+
+def line_amounts(lines: pd.DataFrame, rates: fx.RateTable) -> pd.DataFrame:
+    """Per-line publisher-currency amounts and the statement keys (sku, name, in_bundle)."""
+    out = lines.copy()
+    rate = rates.rate(PUBLISHER_CURRENCY, out["order_date"])
+    fees = (out["transaction_fee"].fillna(0) / 100 + out["affiliate_commission"].fillna(0)
+            + out["affiliate_fee"].fillna(0))
+    out["value"] = out["revenue_ex_vat_pf"] * rate / 100
+    out["deductions"] = fees * rate
+    out["royalty"] = out["exclusivity_fee"] * rate / 100
+
+    out["sku"] = out["isbn"].fillna(out["sku"])
+    deal = out["promo_name"].fillna(out["bundle_name"])
+    # '\n' is a literal backslash-n in the SQL string, kept as-is for the statement layout
+    out["name"] = out["product_name"].fillna("") + ("\\n in " + deal).fillna("")
+    out["in_bundle"] = out["bundle_name"].notna()
+    return out
+
+
+def _statement(lines: pd.DataFrame, keys: list, signs: dict) -> pd.DataFrame:
+    g = lines.groupby(keys, dropna=False, sort=False)
+    out = g.agg(qty=("value", "size"), value=("value", "sum"), deductions=("deductions", "sum"),
+                royalty=("royalty", "sum")).reset_index()
+    out["net"] = (out["value"] - out["deductions"]).round(2)
+    for col in ["value", "deductions", "royalty"]:
+        out[col] = out[col].round(2)
+    for col, sign in signs.items():
+        out[col] *= sign
+    out["royalty_percentage"] = DRIVETHRU_PERCENTAGE
+    return out
+
+
+def sales_statement(amounts: pd.DataFrame) -> pd.DataFrame:
+    sales = amounts[amounts["kind"] == "sale"]
+    out = _statement(sales, ["supplier_name", "sku", "promo_name", "bundle_name", "name", "in_bundle"], SALE_SIGNS)
+    out = out.sort_values(["supplier_name", "bundle_name", "promo_name", "name"],
+                          key=lambda s: s.fillna(""), ignore_index=True)
+    return out[STATEMENT_COLUMNS]
+
+
+def refunds_statement(amounts: pd.DataFrame) -> pd.DataFrame:
+    refunds = amounts[amounts["kind"] == "refund"]
+    # fixed-royalty lines always count; bundle lines with a 0% royalty never do
+    keep = refunds["fixed_royalty_currency"].notna() | ~(
+        refunds["bundle_name"].notna() & refunds["royalty_percentage"].eq(0))
+    refunds = refunds[keep]
+    out = _statement(refunds, ["supplier_name", "sku", "name", "in_bundle", "bundle_name", "product_name", "promo_name"], REFUND_SIGNS)
+    out = out.sort_values(["bundle_name", "product_name"], key=lambda s: s.fillna(""), ignore_index=True)
+    return out[STATEMENT_COLUMNS]
+
+
+def write_statements(sales: pd.DataFrame, refunds: pd.DataFrame, month: MonthWindow) -> list:
+    paths = [f"drivethru_sales_{month.yyyymm}.csv", f"drivethru_refunds_{month.yyyymm}.csv"]
+    sales.to_csv(paths[0], index=False)
+    refunds.to_csv(paths[1], index=False)
+    print(f"Wrote {paths[0]} ({len(sales)} rows) and {paths[1]} ({len(refunds)} rows)")
+    return paths
+
+
+@register
+class DriveThruStatements(Distributor):
+    """DriveThru royalty statements; there is no publisher report, the 'report' is our order lines."""
+    name = "drivethru"
+    uses_order_lines = False
+
+    def ingest(self, month):
+        return load_lines(month)
+
+    def fetch(self, agg, month):
+        return usd_rates(agg, month)
+
+    def match(self, agg, fetched, month):
+        return line_amounts(agg, fetched)
+
+    def diff(self, matched, month):
+        return sales_statement(matched), refunds_statement(matched)
+
+    def publish(self, result, month):
+        return write_statements(*result, month)
+
+    def prefetch_range(self, months):
+        with warehouse.connection() as conn:
+            for m in months:
+                load_lines(m, conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DriveThru royalty statements for a month.")
+    parser.add_argument("--month", default=str(MonthWindow.previous()), help="YYYY-MM, default: last month")
+    args = parser.parse_args()
+    warehouse.require_env()
+    try:
+        print(DriveThruStatements().run(MonthWindow.parse(args.month)))
+    finally:
+        warehouse.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# Shared reconciliation framework for distributor royalty reports.
+#
+# Each distributor is a plugin (a Distributor subclass registered under a
+# name) implementing the stages
+#
+#     ingest -> aggregate -> fetch -> match -> diff -> publish
+#
+# and run_jobs() executes any number of (distributor, month) jobs on a process
+# pool. The month's shop.order_details extract is pulled once, snapshotted
+# locally (common/snapshots.py) and read by every plugin that needs it.
+import importlib
+import sys
+from abc import ABC, abstractmethod
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root, for common/
+from common import instrument, snapshots, warehouse
+
+# plugin name -> module that registers it
+PLUGIN_MODULES = {
+    "genba": "royalty.genba.genba_refactor",
+    "vaultn": "royalty.vaultn.vaultn_process_refactor",
+    "drivethru": "royalty.drivethru.drivethru",
+}
+
+# Columns of the shared per-month order lines (common/snapshots.py) that
+# plugins filter/aggregate in pandas.
+ORDER_LINES_COLUMNS = [
+    "iid", "order_id", "order_date", "status", "product_id", "product_name",
+    "supplier_id", "supplier_name", "od_supplier_name", "vaultn",
+    "promo_name", "bundle_name", "royalty", "currency",
+]
+
+
+@dataclass(frozen=True)
+class MonthWindow:
+    """A calendar month as a [start, end_excl) order-date window."""
+    start: date
+
+    @property
+    def end_excl(self) -> date:
+        return self.start + relativedelta(months=1)
+
+    @property
+    def yyyymm(self) -> str:
+        return f"{self.start:%Y%m}"
+
+    @property
+    def abbr(self) -> str:
+        return self.start.strftime("%b")
+
+    @classmethod
+    def parse(cls, s):
+        """'2025-08', '202508' or a date."""
+        if isinstance(s, date):
+            return cls(s.replace(day=1))
+        s = str(s).replace("-", "")
+        return cls(date(int(s[:4]), int(s[4:6]), 1))
+
+    @classmethod
+    def previous(cls, today=None):
+        first_this = (today or date.today()).replace(day=1)
+        return cls(first_this - relativedelta(months=1))
+
+    def __str__(self):
+        return f"{self.start:%Y-%m}"
+
+
+def month_range(first, last) -> list:
+    """Every MonthWindow from first to last inclusive."""
+    m, last = MonthWindow.parse(first), MonthWindow.parse(last)
+    out = []
+    while m.start <= last.start:
+        out.append(m)
+        m = MonthWindow(m.end_excl)
+    return out
+
+
+def order_lines(month: MonthWindow, conn=None) -> pd.DataFrame:
+    """The month's order lines, from its local snapshot once the month is closed."""
+    return snapshots.read_month(month.start, columns=ORDER_LINES_COLUMNS, conn=conn)
+
+
+def prefetch_order_lines(months):
+    """Snapshots every closed month in `months` not built yet, in one extract."""
+    snapshots.build([m.start for m in months])
+
+
+class Distributor(ABC):
+    """
+    Base class for a distributor plugin. Subclasses set `name` and must
+    implement ingest, match and publish (a missing one fails at instantiation,
+    not halfway through a run); aggregate, fetch and diff default to pass-through
+    / the shared order lines. run() chains the stages for one month.
+    """
+    name = ""
+    uses_order_lines = True  # whether fetch() reads the shared order_lines extract
+    statement_key = None     # column per-publisher statements are split by; None = no statements
+
+    @abstractmethod
+    def ingest(self, month: MonthWindow) -> pd.DataFrame:
+        """Loads the publisher's report for the month."""
+
+    def aggregate(self, report: pd.DataFrame, month: MonthWindow) -> pd.DataFrame:
+        """Collapses the report to the grain it is reconciled at (default: as is)."""
+        return report
+
+    def fetch(self, agg: pd.DataFrame, month: MonthWindow) -> pd.DataFrame:
+        """Our side of the reconciliation (default: the shared order lines)."""
+        return order_lines(month)
+
+    @abstractmethod
+    def match(self, agg: pd.DataFrame, fetched: pd.DataFrame, month: MonthWindow) -> pd.DataFrame:
+        """Pairs the report with our side."""
+
+    def diff(self, matched: pd.DataFrame, month: MonthWindow):
+        """Reconciled output(s) for publish() (default: matched as is)."""
+        return matched
+
+    @abstractmethod
+    def publish(self, result, month: MonthWindow) -> list:
+        """Writes the result and returns what was written (paths, sheet tabs, ...)."""
+
+    def statement_frame(self, matched, result) -> pd.DataFrame:
+        """The reconciled rows per-publisher statements are cut from (royalty/statements.py)."""
+        return result
+
+    def prefetch_range(self, months: list):
+        """
+        Backfill hook: warm whatever fetch() reads for all `months` with as few
+        warehouse queries as possible. The default covers the shared extract.
+        """
+        if self.uses_order_lines:
+            prefetch_order_lines(months)
+
+    def run(self, month: MonthWindow, statement_formats=()) -> dict:
+        t0 = time.perf_counter()
+        statement_summary = None
+        # each stage is timed and logged; the run summary goes to logs/ (common/instrument.py)
+        with instrument.run(f"{self.name}-{month.yyyymm}") as r:
+            report = instrument.timed(f"{self.name}.ingest")(self.ingest)(month)
+            agg = instrument.timed(f"{self.name}.aggregate")(self.aggregate)(report, month)
+            fetched = instrument.timed(f"{self.name}.fetch")(self.fetch)(agg, month)
+            matched = instrument.timed(f"{self.name}.match")(self.match)(agg, fetched, month)
+            result = instrument.timed(f"{self.name}.diff")(self.diff)(matched, month)
+            outputs = instrument.timed(f"{self.name}.publish")(self.publish)(result, month)
+            if statement_formats and self.statement_key:
+                from royalty.statements import write_statements
+
+                statement_summary = write_statements(self.statement_frame(matched, result), self.statement_key,
+                                                     f"{self.name}_{month.yyyymm}", statement_formats)
+        return {
+            "run_id": r["id"],
+            "distributor": self.name,
+            "month": str(month),
+            "report_rows": len(report),
+            "fetched_rows": instrument.rows(fetched),
+            "outputs": outputs,
+            "statements": None if statement_summary is None else len(statement_summary),
+            "statement_errors": (None if statement_summary is None
+                                 else int(statement_summary.get("error", pd.Series(dtype=object)).notna().sum())),
+            "seconds": round(time.perf_counter() - t0, 1),
+        }
+
+
+REGISTRY = {}
+
+
+def register(cls):
+    """Class decorator adding a Distributor subclass to the registry."""
+    REGISTRY[cls.name] = cls
+    return cls
+
+
+def get_distributor(name) -> Distributor:
+    if name not in REGISTRY:
+        importlib.import_module(PLUGIN_MODULES[name])
+    return REGISTRY[name]()
+
+
+def run_job(name, month, statement_formats=()) -> dict:
+    """One (distributor, month) job; the process-pool entry point."""
+    month = MonthWindow.parse(month)
+    try:
+        return get_distributor(name).run(month, statement_formats)
+    finally:
+        warehouse.close_pool()
+
+
+def run_backfill(names, first, last, max_workers=4) -> pd.DataFrame:
+    """
+    Re-runs the reconciliations for every month from first to last. Each
+    plugin warms its inputs for the whole range in one extract, then the
+    months run in parallel and read their slice from the local snapshots.
+    """
+    months = month_range(first, last)
+    print(f"Backfilling {', '.join(names)} for {months[0]} .. {months[-1]} ({len(months)} months)")
+    try:
+        for name in names:
+            get_distributor(name).prefetch_range(months)
+    finally:
+        warehouse.close_pool()  # don't hand open sockets to forked workers
+    return run_jobs(names, [str(m) for m in months], max_workers=max_workers)
+
+
+def run_jobs(names, months, max_workers=4, statement_formats=()) -> pd.DataFrame:
+    """
+    Runs every distributor for every month on a process pool and returns one
+    summary row per job. Shared order_lines extracts are pulled (or loaded
+    from the cache) once per month before the jobs start. With
+    statement_formats each job also writes its per-publisher statements.
+    """
+    months = [MonthWindow.parse(m) for m in months]
+    plugins = [get_distributor(n) for n in names]
+    if any(p.uses_order_lines for p in plugins):
+        jobs = {str(m): (lambda conn, m=m: len(order_lines(m, conn))) for m in months}
+        warehouse.run_concurrent(jobs)
+        warehouse.close_pool()  # don't hand open sockets to forked workers
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(run_job, n, str(m), tuple(statement_formats)): (n, m) for n in names for m in months}
+        for f in as_completed(futures):
+            n, m = futures[f]
+            try:
+                rows.append(f.result())
+                print(f"[{n} {m}] done")
+            except Exception as e:
+                print(f"[{n} {m}] failed: {e}")
+                rows.append({"distributor": n, "month": str(m), "error": str(e)})
+    return pd.DataFrame(rows).sort_values(["distributor", "month"], ignore_index=True)
@@ -1,22 +1,30 @@
 # run_genba_local_compare.py
 from pathlib import Path
 import os
+import sys
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
 from dotenv import load_dotenv
 import psycopg2
 import re
 
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common import arrow_fetch, cache, fx, instrument, warehouse
+from common.dtypes import compact, print_memory_report, record
+from common.excel_ingest import read_excel_cached
+from royalty.framework import Distributor, register
+
 # ----------------- CONFIG -----------------
 EXCEL_PATH = Path("genba_aug.xlsx")  # your Excel
 SCHEMA = "royalty"                   # used only for SQL that reads Redshift
 TABLE = "genba_v3_202508"            # only used to infer default month window, not queried
-load_dotenv()
-RH = os.getenv("REDSHIFT_HOST")
-RP = int(os.getenv("REDSHIFT_PORT", "5439"))
-RD = os.getenv("REDSHIFT_DB")
-RU = os.getenv("REDSHIFT_USER")
-RPW = os.getenv("REDSHIFT_PASSWORD")
+load_dotenv()  # before the os.getenv settings below, so .env values apply
+STREAMING = os.getenv("GENBA_STREAMING") == "1"  # fold fetched chunks straight into the pivot
+# per-month report used by the framework runner, e.g. genba_202508.xlsx
+GENBA_EXCEL_TEMPLATE = os.getenv("GENBA_EXCEL_TEMPLATE", "genba_{yyyymm}.xlsx")
+# e.g. "GBP": add both royalties converted to this currency to raw (common/fx.py)
+COMMON_CURRENCY = os.getenv("GENBA_COMMON_CURRENCY", "")
 
 # Excel -> canonical names
 COLMAP = {
@@ -55,29 +63,76 @@ def previous_month_bounds():
     yyyymm = f"{last_prev.year}{last_prev.month:02d}"
     return yyyymm, start, end_excl
 
+DATE_COLS = ["date_of_sale", "original_date_of_sale", "date_fulfilled"]
+NUMERIC_COLS = [
+    "activation_qty",
+    "srp_activation_currency", "wsp_activation_currency",
+    "service_charge_activation_currency", "exchange_rate",
+    "wsp_billing_currency", "wsp_vat",
+    "service_charge_billing_currency", "service_charge_vat",
+    "grand_total"
+]
+TEXT_COLS = [
+    "transaction_guid", "ctid_1", "publisher_name", "product_title", "sku",
+    "genba_product_id", "country_sold", "activation_currency", "billing_currency",
+]
+
+# Compact dtypes (common/dtypes.py). Money that feeds the overcharge totals stays float64.
+GENBA_EXCEL_PLAN = {
+    "publisher_name": "category",
+    "product_title": "category",
+    "country_sold": "category",
+    "activation_currency": "category",
+    "billing_currency": "category",
+    "activation_qty": "Int32",
+    "srp_activation_currency": "float32",
+    "wsp_activation_currency": "float32",
+    "service_charge_activation_currency": "float32",
+    "exchange_rate": "float32",
+    "wsp_vat": "float32",
+    "service_charge_vat": "float32",
+    "grand_total": "float32",
+}
+FANATICAL_PLAN = {
+    "product_name": "category",
+    "status": "category",
+    "fanatical_currency": "category",
+    "supplier_name": "category",
+    "deal": "category",
+    "sales": "Int8",
+    "f_royalty_calc": "float32",
+    "fanatical_assumed_royalty": "float32",
+    "assumed_royalty_rate": "float32",
+    "royalty_percentage": "float32",
+    "genba_service_charge": "float32",
+    "product_discount_self_fund_percent": "float32",
+    "expected_discount": "float32",
+    "vat_rate": "float32",
+    "order_date": "date",
+}
+
 def read_excel_normalise(path: Path) -> pd.DataFrame:
-    df = pd.read_excel(path)
-    missing_src = [src for src in COLMAP.keys() if src not in df.columns]
-    if missing_src:
-        raise ValueError(f"Excel missing columns: {missing_src}")
-    df = df.rename(columns=COLMAP)
-
-    # types
-    for c in ["date_of_sale", "original_date_of_sale", "date_fulfilled"]:
-        df[c] = pd.to_datetime(df[c], errors="coerce")
-    df["activation_qty"] = pd.to_numeric(df["activation_qty"], errors="coerce")
-    for c in [
-        "srp_activation_currency", "wsp_activation_currency",
-        "service_charge_activation_currency", "exchange_rate",
-        "wsp_billing_currency", "wsp_vat",
-        "service_charge_billing_currency", "service_charge_vat",
-        "grand_total"
-    ]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    return df
+    # only the COLMAP columns are parsed, typed by the reader and cached as Parquet
+    src = {v: k for k, v in COLMAP.items()}
+    df = read_excel_cached(
+        path,
+        columns=list(COLMAP.keys()),
+        text=[src[c] for c in TEXT_COLS],
+        numeric=[src[c] for c in NUMERIC_COLS],
+        dates=[src[c] for c in DATE_COLS],
+    )
+    return compact(df.rename(columns=COLMAP), GENBA_EXCEL_PLAN, "genba excel")
 
-def build_genba_cte_from_excel(df: pd.DataFrame) -> pd.DataFrame:
-    """Replicates your SQL 'genba' CTE purely in pandas."""
+GENBA_KEYS = [
+    "ctid_1", "iid", "product_title", "genba_product_id",
+    "original_date_of_sale", "country_sold", "activation_currency"
+]
+
+def genba_group_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The 'genba' CTE's GROUP BY without the HAVING: per-key sums that can be
+    added across Excel drops (see royalty/incremental.py).
+    """
     out = df.copy()
 
     # iid = split_part(ctid_1,'-',1)
@@ -90,17 +145,17 @@ def build_genba_cte_from_excel(df: pd.DataFrame) -> pd.DataFrame:
 
     out["original_date_of_sale"] = pd.to_datetime(out["original_date_of_sale"], errors="coerce").dt.date
 
-    # genba_reported_royalty = sum(wsp_billing_currency) + sum(service_charge_billing_currency)
-    grp_cols = [
-        "ctid_1", "iid", "product_title", "genba_product_id",
-        "original_date_of_sale", "country_sold", "activation_currency"
-    ]
-    agg = out.groupby(grp_cols, dropna=False).agg(
+    # observed=True: only real combinations of the categorical keys
+    return out.groupby(GENBA_KEYS, dropna=False, observed=True).agg(
         activation_qty=("activation_qty", "sum"),
         wsp_sum=("wsp_billing_currency", "sum"),
         svc_sum=("service_charge_billing_currency", "sum"),
     ).reset_index()
 
+def finalise_genba(agg: pd.DataFrame) -> pd.DataFrame:
+    """genba_reported_royalty + HAVING sum(activation_qty) > 0 on genba_group_sums output."""
+    agg = agg.copy()
+    # genba_reported_royalty = sum(wsp_billing_currency) + sum(service_charge_billing_currency)
     agg["genba_reported_royalty"] = (agg["wsp_sum"].fillna(0) + agg["svc_sum"].fillna(0))
     agg = agg.drop(columns=["wsp_sum", "svc_sum"])
 
@@ -114,67 +169,223 @@ def build_genba_cte_from_excel(df: pd.DataFrame) -> pd.DataFrame:
 
     return agg
 
-def fetch_fanatical(conn, start_date, end_excl) -> pd.DataFrame:
-    sql = f"""
-        SELECT iid, product_name
-        , a.product_id
-        , 1 sales
-        , royalty / 100 fanatical_reported_royalty -- this is now genba wsp
-        , (revenue_ex_vat_pf*a.royalty_percentage) / 100 f_royalty_calc -- ignore fees
-        , (revenue_ex_vat_pf/100) * ((1-a.royalty_percentage)*nvl(genba_service_charge/100,0.125) + a.royalty_percentage) fanatical_assumed_royalty 
-        , ((1-a.royalty_percentage)*nvl(genba_service_charge,0.125) + a.royalty_percentage) 
-        , a.royalty_percentage
-        , genba_service_charge
-        , order_date::date
-        , status
-        , order_id
-        , a.currency
-        , supplier_name
-        , case when c.product_id is not null or b.star_deal then 'Star Deal' else nvl(bundle_name,promo_name) end deal
-        , product_discount_self_fund_percent
-        , b.discount_percent - self_funded_percent expected_discount
-        , vat_rate
-        , nvl(case when allows_transaction_fees then transaction_fee/100 end,0) allowable_transaction_fee
-        from shop.order_details a
-        left join shop.products using(product_id)
-        left join shop.suppliers using(supplier_id)
-        left join shop.product_discounts b
-        on a.product_id = b.product_id 
-        AND order_date >= %s
-        AND order_date < %s
-        left join shop.star_deals c
-        on a.product_id = c.product_id
-        AND order_date >= %s
-        AND order_date < %s
-    """
-    # params = {
-    #     "valid_from": start_date,
-    #     "valid_until": end_excl,
-    #     "start_date": start_date,
-    #     "end_date": end_excl,
-    # }
-
-
-    params = (start_date, end_excl, start_date, end_excl)
+def build_genba_cte_from_excel(df: pd.DataFrame) -> pd.DataFrame:
+    """Replicates your SQL 'genba' CTE purely in pandas."""
+    return finalise_genba(genba_group_sums(df))
+
+FANATICAL_SQL = """
+    SELECT a.iid, product_name{extra_select}
+    , a.product_id
+    , 1 sales
+    , royalty / 100 fanatical_reported_royalty -- this is now genba wsp
+    , (revenue_ex_vat_pf*a.royalty_percentage) / 100 f_royalty_calc -- ignore fees
+    , (revenue_ex_vat_pf/100) * ((1-a.royalty_percentage)*nvl(genba_service_charge/100,0.125) + a.royalty_percentage) fanatical_assumed_royalty 
+    , ((1-a.royalty_percentage)*nvl(genba_service_charge,0.125) + a.royalty_percentage) assumed_royalty_rate
+    , a.royalty_percentage
+    , genba_service_charge
+    , order_date::date
+    , status
+    , order_id
+    , a.currency
+    , supplier_name
+    , case when c.product_id is not null or b.star_deal then 'Star Deal' else nvl(bundle_name,promo_name) end deal
+    , product_discount_self_fund_percent
+    , b.discount_percent - self_funded_percent expected_discount
+    , vat_rate
+    , nvl(case when allows_transaction_fees then transaction_fee/100 end,0) allowable_transaction_fee
+    from shop.order_details a
+    {iid_join}
+    left join shop.products using(product_id)
+    left join shop.suppliers using(supplier_id)
+    left join shop.product_discounts b
+    on a.product_id = b.product_id 
+    AND order_date >= {win_lo}
+    AND order_date < {win_hi}
+    left join shop.star_deals c
+    on a.product_id = c.product_id
+    AND order_date >= {win_lo}
+    AND order_date < {win_hi}
+    {where}
+"""
+
+def fanatical_sql(iid_join="", where="", win_lo="%s", win_hi="%s", extra_select=""):
+    """FANATICAL_SQL with its optional pieces filled in (defaults: unfiltered, %s window)."""
+    return FANATICAL_SQL.format(iid_join=iid_join, where=where, win_lo=win_lo, win_hi=win_hi,
+                                extra_select=extra_select)
+
+# column types for the typed fetch (common/arrow_fetch.py); unlisted columns are inferred
+FANATICAL_SCHEMA = {
+    "iid": "string",
+    "product_name": "string",
+    "sales": "int32",
+    "fanatical_reported_royalty": "float64",
+    "f_royalty_calc": "float64",
+    "fanatical_assumed_royalty": "float64",
+    "assumed_royalty_rate": "float64",
+    "royalty_percentage": "float64",
+    "genba_service_charge": "float64",
+    "order_date": "date32",
+    "status": "string",
+    "currency": "string",
+    "supplier_name": "string",
+    "deal": "string",
+    "product_discount_self_fund_percent": "float64",
+    "expected_discount": "float64",
+    "vat_rate": "float64",
+    "allowable_transaction_fee": "float64",
+}
 
+# How fetch_fanatical restricts shop.order_details:
+#   "temp_table" - upload the Genba iids to a session temp table and join on it
+#   "in_list"    - run the query once per batch of iids with an IN (...) filter
+#   "window"     - no iid filter, only scan orders around the Genba sale dates
+FETCH_MODE = "temp_table"
+# statement for Genba rows with no Fanatical line (and so no supplier_name);
+# their whole reported royalty is overcharge
+UNMATCHED_SUPPLIER = "(no Fanatical match)"
+IID_BATCH_SIZE = 5_000
+WINDOW_SLACK_DAYS = 3
+
+def _iter_chunks(conn, sql, params, label=""):
     n_placeholders = len(re.findall(r'%s', sql))
     print("placeholders:", n_placeholders, "params:", len(params))
 
-    # Stream in chunks so it doesn't hang on a huge single fetch
-    parts = []
-    for i, chunk in enumerate(pd.read_sql_query(sql, conn, params=params, chunksize=200_000), 1):
-        print(f"  fetched chunk {i} ({len(chunk)} rows)")
-        parts.append(chunk)
+    # Stream in chunks from a server-side cursor so only one chunk is held client-side
+    for i, chunk in enumerate(warehouse.iter_frames(conn, sql, params, schema=FANATICAL_SCHEMA), 1):
+        print(f"  fetched chunk {i}{label} ({len(chunk)} rows)")
+        yield chunk
+
+def sale_date_window(genba_df: pd.DataFrame, start_date, end_excl):
+    """Order-date window covering every Genba sale, padded by WINDOW_SLACK_DAYS."""
+    dates = pd.to_datetime(genba_df["original_date_of_sale"], errors="coerce").dropna()
+    if dates.empty:
+        return start_date, end_excl
+    slack = timedelta(days=WINDOW_SLACK_DAYS)
+    lo = min(dates.min().date(), start_date) - slack
+    hi = max(dates.max().date() + timedelta(days=1), end_excl) + slack
+    return lo, hi
+
+def iter_fanatical(conn, start_date, end_excl, iids=None, mode=FETCH_MODE, window=None):
+    """
+    Yields the Fanatical side of the reconciliation chunk by chunk.
+
+    With `iids` only the order lines the Genba report refers to are returned
+    (see FETCH_MODE); without them every row of shop.order_details is pulled.
+    `window` is the (start, end_excl) order-date range used by "window" mode.
+    """
+    join_params = (start_date, end_excl, start_date, end_excl)
+    if mode == "temp_table" and not arrow_fetch.sees_temp_tables():
+        # connectorx reads on its own connection, which has no genba_iids
+        mode = "in_list"
+
+    if iids is None:
+        sql = fanatical_sql()
+        chunks = _iter_chunks(conn, sql, join_params)
+    else:
+        iids = sorted({str(i) for i in iids if pd.notna(i) and str(i)})
+        print(f"Filtering order_details to {len(iids)} Genba iids ({mode})")
+        if not iids:
+            chunks = iter(())
+        elif mode == "temp_table":
+            warehouse.temp_table(conn, "genba_iids", {"iid": "varchar(64)"}, [(i,) for i in iids],
+                                 page_size=IID_BATCH_SIZE)
+            sql = fanatical_sql(iid_join="join genba_iids g on g.iid = a.iid")
+            chunks = _iter_chunks(conn, sql, join_params)
+        elif mode == "in_list":
+            sql = fanatical_sql(where="WHERE a.iid IN %s")
+            chunks = (
+                chunk
+                for b in range(0, len(iids), IID_BATCH_SIZE)
+                for chunk in _iter_chunks(conn, sql, join_params + (tuple(iids[b:b + IID_BATCH_SIZE]),),
+                                          label=f" of iid batch {b // IID_BATCH_SIZE + 1}")
+            )
+        elif mode == "window":
+            lo, hi = window or (start_date, end_excl)
+            print(f"Scanning order_details from {lo} to (excl) {hi}")
+            sql = fanatical_sql(where="WHERE a.order_date >= %s AND a.order_date < %s")
+            wanted = set(iids)
+            chunks = (p[p["iid"].astype(str).isin(wanted)] for p in _iter_chunks(conn, sql, join_params + (lo, hi)))
+        else:
+            raise ValueError(f"Unknown fetch mode: {mode}")
+
+    for chunk in chunks:
+        # normalize column names expected by downstream merge
+        yield chunk.rename(columns={
+            # "product_name": "product_title",
+            "currency": "fanatical_currency"
+        })
+
+def fetch_fanatical(conn, start_date, end_excl, iids=None, mode=FETCH_MODE, window=None) -> pd.DataFrame:
+    """All of iter_fanatical as one frame."""
+    parts = list(iter_fanatical(conn, start_date, end_excl, iids=iids, mode=mode, window=window))
     df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
 
     print(f"Fetched {len(df)} rows from Redshift for Fanatical CTE")
+    return compact(df, FANATICAL_PLAN, "fanatical")
 
-    # normalize column names expected by downstream merge
-    df = df.rename(columns={
-        # "product_name": "product_title",
-        "currency": "fanatical_currency"
+def with_window_fallback(genba_df: pd.DataFrame, start_date, end_excl, consume):
+    """
+    consume(conn, iids=..., [mode=, window=]) on a pooled Redshift connection,
+    iid-filtered first and rerun from scratch as a date-bounded window scan if
+    that fails (e.g. no temp-table privileges).
+    """
+    iids = genba_df["iid"].unique()
+    with warehouse.connection() as conn:
+        try:
+            return consume(conn, iids=iids)
+        except psycopg2.Error as e:
+            print(f"iid-filtered fetch failed ({e}); falling back to window scan")
+            warehouse.rollback(conn)
+            return consume(conn, iids=iids, mode="window",
+                           window=sale_date_window(genba_df, start_date, end_excl))
+
+def load_fanatical(genba_df: pd.DataFrame, start_date, end_excl) -> pd.DataFrame:
+    """Fetches the order lines for the Genba iids on a pooled Redshift connection."""
+    return with_window_fallback(genba_df, start_date, end_excl,
+                                lambda conn, **kw: fetch_fanatical(conn, start_date, end_excl, **kw))
+
+def fanatical_cache_key(genba_df: pd.DataFrame, start_date, end_excl):
+    iids = sorted(genba_df["iid"].dropna().astype(str).unique())
+    return [start_date, end_excl, FETCH_MODE, iids]
+
+def cached_fanatical(genba_df: pd.DataFrame, start_date, end_excl, yyyymm) -> pd.DataFrame:
+    """load_fanatical through the local extract cache, keyed on the window and iid set."""
+    return cache.cached_frame(
+        FANATICAL_SQL, fanatical_cache_key(genba_df, start_date, end_excl),
+        lambda: load_fanatical(genba_df, start_date, end_excl),
+        end_excl=end_excl, label=f"genba_fanatical_{yyyymm}",
+    )
+
+def fetch_fanatical_months(conn, genba_by_month: dict) -> dict:
+    """
+    One query for several report months. Each Genba iid is uploaded with its
+    report month, and the discount/star-deal joins use that month's window,
+    so every month's slice matches what fetch_fanatical would return for it.
+    genba_by_month: {MonthWindow: genba_df}. Returns {MonthWindow: fan_df}.
+    """
+    rows = sorted({
+        (str(i), m.start, m.end_excl)
+        for m, g in genba_by_month.items()
+        for i in g["iid"].dropna().astype(str).unique() if i
     })
-    return df
+    print(f"Uploading {len(rows)} (iid, month) pairs for {len(genba_by_month)} months")
+    warehouse.temp_table(conn, "genba_iid_months", {"iid": "varchar(64)", "month_start": "date", "month_end": "date"},
+                         rows, page_size=IID_BATCH_SIZE)
+    sql = fanatical_sql(iid_join="join genba_iid_months g on g.iid = a.iid",
+                        win_lo="g.month_start", win_hi="g.month_end",
+                        extra_select=", g.month_start AS report_month")
+
+    by_start = {m.start: m for m in genba_by_month}
+    parts = {m: [] for m in genba_by_month}
+    for chunk in _iter_chunks(conn, sql, ()):
+        chunk = chunk.rename(columns={"currency": "fanatical_currency"})
+        report_month = pd.to_datetime(chunk.pop("report_month")).dt.date
+        for start, part in chunk.groupby(report_month):
+            parts[by_start[start]].append(part)
+    return {
+        m: compact(pd.concat(p, ignore_index=True) if p else pd.DataFrame(), FANATICAL_PLAN, f"fanatical {m}")
+        for m, p in parts.items()
+    }
 
 def compute_raw(genba_df: pd.DataFrame, fan_df: pd.DataFrame) -> pd.DataFrame:
     raw = genba_df.merge(fan_df, on=["iid"], how="left", suffixes=("", "_fan"))
@@ -193,7 +404,8 @@ def compute_raw(genba_df: pd.DataFrame, fan_df: pd.DataFrame) -> pd.DataFrame:
     denom = raw["fanatical_reported_royalty"].replace({0: pd.NA})
     raw["overcharge_perc"] = ((raw["genba_reported_royalty"] - raw["fanatical_reported_royalty"]) / denom) * 100
     raw["missing_discount"] = 1 - (raw["fanatical_reported_royalty"] / raw["genba_reported_royalty"].replace({0: pd.NA}))
-    raw["currency_match"] = (raw["fanatical_currency"] == raw["genba_currency"])
+    # object compare: the two sides are categoricals with different categories
+    raw["currency_match"] = (raw["fanatical_currency"].astype(object) == raw["genba_currency"].astype(object))
     print("calculated derived fields")
 
     # optional flags (placeholders if you don't have genba_requests handy)
@@ -210,46 +422,186 @@ def compute_raw(genba_df: pd.DataFrame, fan_df: pd.DataFrame) -> pd.DataFrame:
     ]
     cols = preferred + [c for c in raw.columns if c not in preferred]
     raw = raw[cols]
+    if COMMON_CURRENCY:
+        raw = add_common_currency(raw, COMMON_CURRENCY)
+    return raw
+
+def add_common_currency(raw: pd.DataFrame, to="GBP") -> pd.DataFrame:
+    """
+    Genba and Fanatical royalties converted to one currency at daily ECB rates
+    (Genba at the original sale date, Fanatical at the order date), so rows
+    whose currencies don't match can still be compared. A missing fee or
+    Fanatical royalty counts as 0, but an amount that can't be converted
+    (unknown currency or date) leaves the row's overcharge NaN.
+    """
+    suffix = to.lower()
+    genba = fx.convert(raw["genba_reported_royalty"], raw["genba_currency"], raw["original_date_of_sale"], to=to)
+    fan = fx.convert(raw["fanatical_reported_royalty"], raw["fanatical_currency"], raw["order_date"], to=to)
+    fee = fx.convert(raw["allowable_transaction_fee"], raw["fanatical_currency"], raw["order_date"], to=to)
+    no_fan = raw["fanatical_reported_royalty"].isna().to_numpy()
+    fee = np.where(raw["allowable_transaction_fee"].isna().to_numpy(), 0.0, fee)
+    unconvertible = ((np.isnan(genba) & raw["genba_reported_royalty"].notna().to_numpy())
+                     | (np.isnan(fan) & ~no_fan) | np.isnan(fee))
+    if unconvertible.any():
+        seen = raw.loc[unconvertible, ["genba_currency", "fanatical_currency"]].astype(str).stack().unique()
+        print(f"WARNING: {unconvertible.sum()} rows can't be converted to {to} "
+              f"(currencies: {', '.join(sorted(seen))}); their {to} overcharge is left empty")
+    raw[f"genba_reported_royalty_{suffix}"] = genba
+    raw[f"fanatical_reported_royalty_{suffix}"] = fan
+    raw[f"overcharge_after_transaction_fee_handling_{suffix}"] = genba - fee - np.where(no_fan, 0.0, fan)
     return raw
 
+def pivot_overcharge(raw: pd.DataFrame, by=("product_title",)) -> pd.DataFrame:
+    """Total overcharge_after_transaction_fee_handling per Product Title (or `by` columns), largest first."""
+    pivot_df = (
+        raw.pivot_table(index=list(by),
+                        values="overcharge_after_transaction_fee_handling",
+                        aggfunc="sum", fill_value=0, observed=True)
+           .reset_index()
+           .rename(columns={"overcharge_after_transaction_fee_handling": "Total Overcharge"})
+    )
+    return pivot_df.sort_values("Total Overcharge", ascending=False, ignore_index=True)
+
+def stream_pivot(genba_df: pd.DataFrame, chunks) -> pd.DataFrame:
+    """
+    Same result as pivot_overcharge(compute_raw(genba_df, fan_df)) without
+    materialising fan_df or raw: each fetched chunk is joined to the small
+    Genba frame and folded into running per-product totals. Genba rows that
+    never match a chunk are added at the end, as the left join would keep them.
+    """
+    g = genba_df[["iid", "product_title", "genba_reported_royalty"]].reset_index(drop=True)
+    g["_row"] = np.arange(len(g))
+    matched = np.zeros(len(g), dtype=bool)
+    totals = pd.Series(dtype="float64")
+
+    for chunk in chunks:
+        m = g.merge(chunk[["iid", "fanatical_reported_royalty", "allowable_transaction_fee"]],
+                    on="iid", how="inner")
+        if m.empty:
+            continue
+        matched[m["_row"].to_numpy()] = True
+        overcharge = (
+            m["genba_reported_royalty"]
+            - m["allowable_transaction_fee"].fillna(0)
+            - m["fanatical_reported_royalty"].fillna(0)
+        )
+        totals = totals.add(overcharge.groupby(m["product_title"], observed=True).sum(), fill_value=0)
+
+    unmatched = g[~matched]
+    totals = totals.add(unmatched["genba_reported_royalty"].groupby(unmatched["product_title"], observed=True).sum(), fill_value=0)
+    print(f"streamed pivot: {matched.sum()} of {len(g)} Genba rows matched")
+
+    pivot_df = (
+        totals.astype("float64").sort_index()
+              .rename_axis("product_title").rename("Total Overcharge")
+              .reset_index()
+    )
+    return pivot_df.sort_values("Total Overcharge", ascending=False, ignore_index=True)
+
+def stream_fanatical_pivot(genba_df: pd.DataFrame, start_date, end_excl) -> pd.DataFrame:
+    """stream_pivot over a live fetch (bypasses the extract cache), with load_fanatical's fallback."""
+    return with_window_fallback(
+        genba_df, start_date, end_excl,
+        lambda conn, **kw: stream_pivot(genba_df, iter_fanatical(conn, start_date, end_excl, **kw)))
+
+@register
+class GenbaReconciliation(Distributor):
+    """Genba as a royalty/framework.py plugin."""
+    name = "genba"
+    # Genba orders can predate the month and need the discount joins, so this
+    # plugin fetches its own iid-filtered extract instead of the shared one
+    uses_order_lines = False
+    statement_key = "supplier_name"
+
+    def ingest(self, month):
+        path = Path(GENBA_EXCEL_TEMPLATE.format(yyyymm=month.yyyymm, abbr=month.abbr.lower()))
+        if not path.exists():
+            raise FileNotFoundError(path)
+        return read_excel_normalise(path)
+
+    def aggregate(self, report, month):
+        return build_genba_cte_from_excel(report)
+
+    def fetch(self, agg, month):
+        return cached_fanatical(agg, month.start, month.end_excl, month.yyyymm)
+
+    def prefetch_range(self, months):
+        # seed the per-month cached_fanatical entries from one month-tagged query
+        genba_by_month = {}
+        for m in months:
+            try:
+                genba_by_month[m] = self.aggregate(self.ingest(m), m)
+            except FileNotFoundError as e:
+                print(f"[genba {m}] no report ({e}); skipping")
+        todo = {
+            m: g for m, g in genba_by_month.items()
+            if not cache.is_cached(FANATICAL_SQL, fanatical_cache_key(g, m.start, m.end_excl))
+        }
+        if not todo:
+            return
+        try:
+            with warehouse.connection() as conn:
+                fetched = fetch_fanatical_months(conn, todo)
+        except psycopg2.Error as e:
+            # months not seeded here are fetched one by one by their jobs
+            print(f"Combined Genba fetch failed ({e}); falling back to per-month fetches")
+            return
+        for m, fan_df in fetched.items():
+            cache.store(FANATICAL_SQL, fanatical_cache_key(todo[m], m.start, m.end_excl), fan_df,
+                        end_excl=m.end_excl, label=f"genba_fanatical_{m.yyyymm}")
+
+    def match(self, agg, fetched, month):
+        return compute_raw(agg, fetched)
+
+    def diff(self, matched, month):
+        return pivot_overcharge(matched)
+
+    def statement_frame(self, matched, result):
+        # the pivot has no supplier column; cut the statements from raw instead.
+        # pivot_table drops NaN keys, so unmatched rows get a supplier of their own
+        raw = matched.assign(supplier_name=matched["supplier_name"].astype(object).fillna(UNMATCHED_SUPPLIER))
+        return pivot_overcharge(raw, by=("supplier_name", "product_title"))
+
+    def publish(self, result, month):
+        pivot_out = f"pivot_{month.yyyymm}.csv"
+        result.to_csv(pivot_out, index=False)
+        return [pivot_out]
+
 def main():
     if not EXCEL_PATH.exists():
         raise FileNotFoundError(EXCEL_PATH)
-    if not all([RH, RD, RU, RPW]):
-        raise RuntimeError("Missing REDSHIFT_* environment variables.")
+    warehouse.require_env()
 
     # month window (previous full month by default)
     yyyymm, start_date, end_excl = previous_month_bounds()
     print(f"Window: {start_date} to (excl) {end_excl} [{yyyymm}]")
 
-    # 1) Excel -> pandas "genba" CTE
-    excel_df = read_excel_normalise(EXCEL_PATH)
-    genba_df = build_genba_cte_from_excel(excel_df)
+    with instrument.run(f"genba-{yyyymm}"):
+        # 1) Excel -> pandas "genba" CTE
+        excel_df = instrument.timed("read_excel_normalise")(read_excel_normalise)(EXCEL_PATH)
+        genba_df = instrument.timed("build_genba_cte_from_excel")(build_genba_cte_from_excel)(excel_df)
 
-    # 2) Redshift -> pandas "fanatical" CTE
-    conn = psycopg2.connect(host=RH, port=RP, dbname=RD, user=RU, password=RPW)
-    try:
-        fan_df = fetch_fanatical(conn, start_date, end_excl)
-    finally:
-        conn.close()
+        if STREAMING:
+            # 2-4) fetch, merge and pivot chunk by chunk; raw is never built
+            with instrument.stage("stream_fanatical_pivot", rows_in=genba_df) as st:
+                pivot_df = stream_fanatical_pivot(genba_df, start_date, end_excl)
+                st.rows_out = len(pivot_df)
+        else:
+            # 2) Redshift -> pandas "fanatical" CTE (cached locally, see common/cache.py)
+            fan_df = instrument.timed("fetch_fanatical")(cached_fanatical)(genba_df, start_date, end_excl, yyyymm)
 
-    # 3) Merge + derived fields (replicate raw SQL)
-    raw = compute_raw(genba_df, fan_df)
+            # 3) Merge + derived fields (replicate raw SQL)
+            raw = instrument.timed("compute_raw")(compute_raw)(genba_df, fan_df)
+            record(raw, "raw (merged)")
 
-    # 4) Pivot by Product Title summing overcharge_after_transaction_fee_handling
-    pivot_df = (
-        raw.pivot_table(index="product_title",
-                        values="overcharge_after_transaction_fee_handling",
-                        aggfunc="sum", fill_value=0)
-           .reset_index()
-           .rename(columns={"overcharge_after_transaction_fee_handling": "Total Overcharge"})
-    )
-    pivot_df = pivot_df.sort_values("Total Overcharge", ascending=False, ignore_index=True)
+            # 4) Pivot by Product Title summing overcharge_after_transaction_fee_handling
+            pivot_df = instrument.timed("pivot_overcharge")(pivot_overcharge)(raw)
 
     # 5) Save locally (or push to Google Sheets if desired)
     pivot_out = f"pivot_{yyyymm}.csv"
     # raw_out = f"raw_{yyyymm}.csv"
     pivot_df.to_csv(pivot_out, index=False)
+    print_memory_report()
     # raw.to_csv(raw_out, index=False)
     # print(f"Wrote {pivot_out} and {raw_out}")
 
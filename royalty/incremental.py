@@ -0,0 +1,250 @@
+# Month-to-date reconciliation that folds each new report drop into
+# persisted state instead of recomputing the month from scratch:
+#
+#   python royalty/incremental.py genba genba_drop_0912.xlsx
+#   python royalty/incremental.py vaultn Vaultn_Sep.xlsx --month 2025-09
+#
+# State lives in STATE_DIR/<distributor>/<yyyymm>/ (one json meta file plus a
+# parquet file per frame). A drop whose content was already applied is skipped,
+# and only rows not seen in earlier drops are added, so cumulative drops (each
+# one a superset of the last) are fine. On the warehouse side Genba only
+# queries iids that are new or still unmatched (over the whole join window,
+# since a late-arriving line can carry any order date), and VaultN only the
+# days from the stored watermark on. Delete the month's directory to start over.
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from common import warehouse
+from common.excel_ingest import file_digest
+from royalty.framework import MonthWindow
+
+# ---- CONFIG ----
+STATE_DIR = Path(os.getenv("CMA_STATE_DIR", Path(__file__).resolve().parents[1] / "state"))
+IID_BATCH_SIZE = 5_000
+
+
+class MonthState:
+    """Persisted month-to-date state for one distributor and month."""
+
+    def __init__(self, distributor, month: MonthWindow):
+        self.dir = STATE_DIR / distributor / month.yyyymm
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.meta_path = self.dir / "meta.json"
+        try:
+            self.meta = json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            self.meta = {"drops": [], "watermark": None}
+        self.pending = {}
+
+    def frame(self, name, columns=()):
+        path = self.dir / f"{name}.parquet"
+        if path.exists():
+            return pd.read_parquet(path)
+        return pd.DataFrame(columns=list(columns))
+
+    def save_frame(self, name, df):
+        """Queues a frame; nothing is written until save()."""
+        self.pending[name] = df
+
+    def save(self):
+        for name, df in self.pending.items():
+            tmp = self.dir / f"{name}.parquet.tmp"
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, self.dir / f"{name}.parquet")
+        self.pending = {}
+        # meta last: a drop only counts as applied once its frames are on disk
+        self.meta["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.meta, indent=2, default=str))
+        os.replace(tmp, self.meta_path)
+
+
+def new_rows(df, state: MonthState, columns=None):
+    """
+    Rows of df not seen in earlier drops, keyed by a hash of the row values.
+    Identical rows are told apart by their occurrence number, so a drop that
+    repeats a row twice after earlier drops had it once adds one copy.
+    """
+    h = pd.util.hash_pandas_object(df[columns] if columns else df, index=False).to_numpy()
+    keys = pd.DataFrame({"row_hash": h})
+    keys["occurrence"] = keys.groupby("row_hash").cumcount()
+    seen = state.frame("seen_rows", ["row_hash", "occurrence"]).astype({"row_hash": "uint64", "occurrence": "int64"})
+    fresh = keys.merge(seen.assign(_seen=1), on=["row_hash", "occurrence"], how="left")["_seen"].isna().to_numpy()
+    state.save_frame("seen_rows", pd.concat([seen, keys[fresh]], ignore_index=True))
+    return df[fresh]
+
+
+def _plain_keys(df, keys):
+    # categoricals from different drops carry different categories; fold as object
+    return df.astype({k: object for k in keys if isinstance(df[k].dtype, pd.CategoricalDtype)})
+
+
+# ---------------- Genba ----------------
+
+def _genba_fan_delta(conn, month, fresh_iids, pending_iids):
+    """
+    Fanatical lines for the delta: every line, over the whole join window, of
+    iids first seen in this drop and of iids that had no match yet. Pending
+    iids have no lines in the state, so pulling them in full can't double
+    count, and a line that lands in the warehouse late is found whatever its
+    order date (an order_date watermark would miss back-dated lines).
+    """
+    from royalty.genba.genba_refactor import _iter_chunks, fanatical_sql
+
+    rows = [(i,) for i in sorted(set(fresh_iids) | set(pending_iids))]
+    cols = ["iid", "order_date", "fanatical_reported_royalty", "allowable_transaction_fee"]
+    if not rows:
+        return pd.DataFrame(columns=cols)
+    warehouse.temp_table(conn, "genba_iids_delta", {"iid": "varchar(64)"}, rows, page_size=IID_BATCH_SIZE)
+    sql = fanatical_sql(iid_join="join genba_iids_delta g on g.iid = a.iid")
+    params = (month.start, month.end_excl, month.start, month.end_excl)
+    chunks = [c[cols] for c in _iter_chunks(conn, sql, params, label=" (delta)")]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=cols)
+
+
+def genba_overcharge(sums: pd.DataFrame, fan: pd.DataFrame) -> pd.DataFrame:
+    """
+    The Genba pivot from keyed state. Each Genba row joins the n Fanatical lines
+    of its iid, so its overcharge is n * royalty - sum(fan royalty + fee), or
+    the royalty itself when nothing matched; equal to pivot_overcharge(compute_raw(...)).
+    """
+    from royalty.genba.genba_refactor import finalise_genba
+
+    g = finalise_genba(sums)
+    f = fan.set_index("iid")
+    n = g["iid"].astype(str).map(f["n_lines"]).fillna(0).to_numpy(float)
+    total = g["iid"].astype(str).map(f["fan_total"]).fillna(0).to_numpy(float)
+    royalty = g["genba_reported_royalty"].to_numpy(float)
+    overcharge = pd.Series(np.where(n > 0, n * royalty - total, royalty), index=g.index)
+    totals = overcharge.groupby(g["product_title"], observed=True).sum()
+    pivot_df = totals.rename_axis("product_title").rename("Total Overcharge").reset_index()
+    return pivot_df.sort_values("Total Overcharge", ascending=False, ignore_index=True)
+
+
+def update_genba(drop: Path, month: MonthWindow) -> pd.DataFrame:
+    from royalty.genba.genba_refactor import GENBA_KEYS, genba_group_sums, read_excel_normalise
+
+    state = MonthState("genba", month)
+    sums = state.frame("genba_sums", GENBA_KEYS + ["activation_qty", "wsp_sum", "svc_sum"])
+    fan = state.frame("fan_by_iid", ["iid", "n_lines", "fan_total"])
+    fetched = state.frame("fetched_iids", ["iid"])
+
+    digest = file_digest(drop)
+    if digest in state.meta["drops"]:
+        print(f"{drop} already applied to {month}, refreshing warehouse side only")
+    else:
+        excel = new_rows(read_excel_normalise(drop), state)
+        print(f"{len(excel)} new Genba rows in {drop}")
+        if len(excel):
+            both = pd.concat([_plain_keys(sums, GENBA_KEYS), _plain_keys(genba_group_sums(excel), GENBA_KEYS)],
+                             ignore_index=True)
+            sums = both.groupby(GENBA_KEYS, dropna=False).sum().reset_index()
+        state.meta["drops"].append(digest)
+
+    iids = set(sums["iid"].dropna().astype(str))
+    known = set(fetched["iid"].astype(str))
+    fresh = sorted(iids - known)
+    pending = sorted(known - set(fan["iid"].astype(str)))
+    print(f"Fanatical delta: {len(fresh)} new iids, {len(pending)} still unmatched")
+
+    with warehouse.connection() as conn:
+        delta = _genba_fan_delta(conn, month, fresh, pending)
+
+    if len(delta):
+        delta["iid"] = delta["iid"].astype(str)
+        delta["fan_total"] = delta["fanatical_reported_royalty"].fillna(0) + delta["allowable_transaction_fee"].fillna(0)
+        add = delta.groupby("iid").agg(n_lines=("iid", "size"), fan_total=("fan_total", "sum")).reset_index()
+        fan = pd.concat([fan, add], ignore_index=True).groupby("iid", as_index=False)[["n_lines", "fan_total"]].sum()
+
+    state.save_frame("genba_sums", sums)
+    state.save_frame("fan_by_iid", fan)
+    state.save_frame("fetched_iids", pd.DataFrame({"iid": sorted(known | set(fresh))}))
+    state.save()
+    return genba_overcharge(sums, fan)
+
+
+# ---------------- VaultN ----------------
+
+VAULTN_DAILY_SQL = """
+    SELECT s.supplier_id, s.supplier_name, od.order_date::date AS order_day, SUM(od.royalty) / 100.0 AS "royalties"
+    FROM shop.order_details od
+    JOIN shop.products p ON p.product_id = od.product_id
+    JOIN shop.suppliers s ON s.supplier_id = p.supplier_id
+    WHERE od.order_date >= %s AND od.order_date < %s
+      AND od.status IN ('COMPLETE', 'REFUNDED')
+      AND s.vaultn = TRUE
+    GROUP BY 1, 2, 3;
+"""
+VAULTN_DAILY_SCHEMA = {"supplier_id": "int64", "supplier_name": "string", "order_day": "date32", "royalties": "float64"}
+VAULTN_KEYS = ['Publisher Name', 'Invoicing Currency']
+
+
+def update_vaultn(drop: Path, month: MonthWindow) -> pd.DataFrame:
+    from common.excel_ingest import read_excel_cached
+    from royalty.vaultn.vaultn_process_refactor import (
+        VAULTN_NUMERIC_COLS, VAULTN_TEXT_COLS, compare, convert_to_gbp,
+    )
+
+    state = MonthState("vaultn", month)
+    totals = state.frame("publisher_totals", VAULTN_KEYS + ['Purchase Price In Invoicing Currency'])
+    daily = state.frame("supplier_days", list(VAULTN_DAILY_SCHEMA))
+
+    digest = file_digest(drop)
+    if digest in state.meta["drops"]:
+        print(f"{drop} already applied to {month}, refreshing warehouse side only")
+    else:
+        report = read_excel_cached(drop, text=VAULTN_TEXT_COLS, numeric=VAULTN_NUMERIC_COLS)
+        report = new_rows(report, state)
+        print(f"{len(report)} new VaultN rows in {drop}")
+        if len(report):
+            add = report.groupby(VAULTN_KEYS, observed=True)['Purchase Price In Invoicing Currency'].sum().reset_index()
+            both = pd.concat([_plain_keys(totals, VAULTN_KEYS), _plain_keys(add, VAULTN_KEYS)], ignore_index=True)
+            totals = both.groupby(VAULTN_KEYS, as_index=False)['Purchase Price In Invoicing Currency'].sum()
+        state.meta["drops"].append(digest)
+
+    # the watermark day may have been partial when fetched, so it is refetched and replaced
+    since = date.fromisoformat(state.meta["watermark"]) if state.meta["watermark"] else month.start
+    with warehouse.connection() as conn:
+        fresh = warehouse.read_frame(conn, VAULTN_DAILY_SQL, (since, month.end_excl), schema=VAULTN_DAILY_SCHEMA)
+    print(f"Fetched {len(fresh)} supplier-days from {since}")
+    if len(daily):
+        daily = daily[pd.to_datetime(daily["order_day"]).dt.date < since]
+    daily = pd.concat([daily, fresh], ignore_index=True)
+    if len(fresh):
+        state.meta["watermark"] = str(pd.to_datetime(fresh["order_day"]).max().date())
+
+    state.save_frame("publisher_totals", totals)
+    state.save_frame("supplier_days", daily)
+    state.save()
+
+    results = daily.groupby(["supplier_id", "supplier_name"], as_index=False)["royalties"].sum()
+    return compare(convert_to_gbp(totals, month.start), results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold a report drop into the month-to-date reconciliation.")
+    parser.add_argument("distributor", choices=["genba", "vaultn"])
+    parser.add_argument("drop", type=Path, help="the publisher's (possibly partial) report for the month")
+    parser.add_argument("--month", help="YYYY-MM, default: the current month")
+    args = parser.parse_args()
+
+    warehouse.require_env()
+    month = MonthWindow.parse(args.month) if args.month else MonthWindow(date.today().replace(day=1))
+    if args.distributor == "genba":
+        out, df = f"mtd_pivot_{month.yyyymm}.csv", update_genba(args.drop, month)
+    else:
+        out, df = f"mtd_comparison_{month.yyyymm}.csv", update_vaultn(args.drop, month)
+    df.to_csv(out, index=False)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# Month-end close in one command:
+#
+#   python royalty/run_reconciliations.py                      # all distributors, last month
+#   python royalty/run_reconciliations.py -d genba -m 2025-07 2025-08 --workers 4
+#   python royalty/run_reconciliations.py -d vaultn --statements csv xlsx   # + per-publisher statements
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root
+from royalty.framework import PLUGIN_MODULES, MonthWindow, run_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run distributor reconciliations in parallel.")
+    parser.add_argument("-d", "--distributors", nargs="+", default=list(PLUGIN_MODULES), choices=list(PLUGIN_MODULES))
+    parser.add_argument("-m", "--months", nargs="+", default=[str(MonthWindow.previous())], help="YYYY-MM")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--statements", nargs="+", default=[], choices=["csv", "xlsx", "sheets"],
+                        help="also write per-publisher statements (see royalty/statements.py)")
+    args = parser.parse_args()
+
+    summary = run_jobs(args.distributors, args.months, max_workers=args.workers, statement_formats=args.statements)
+    print(summary.to_string(index=False))
+    if "error" in summary.columns and summary["error"].notna().any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Per-publisher statements cut from a reconciled frame.
+#
+#   python royalty/run_reconciliations.py -d vaultn genba --statements csv xlsx sheets
+#
+#   from royalty import statements
+#   summary = statements.write_statements(frame, "Publisher Name", "vaultn_202508", ["csv", "xlsx"])
+#
+# The frame is split once by publisher/supplier and every (publisher, format)
+# output is rendered concurrently: CSV files and Sheets tabs on a thread pool
+# (they wait on disk and the network), XLSX workbooks on a process pool
+# (openpyxl is CPU bound). Sheets calls also go through the shared rate limiter
+# in common/gsheets.py. One failed statement doesn't stop the others; the
+# summary has an error column instead.
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repo root, for common/
+from common import instrument
+
+# ---- CONFIG ----
+STATEMENTS_DIR = Path(os.getenv("CMA_STATEMENTS_DIR", Path(__file__).resolve().parents[1] / "statements"))
+STATEMENT_WORKERS = int(os.getenv("CMA_STATEMENT_WORKERS", "8"))  # threads for CSV and Sheets
+XLSX_WORKERS = int(os.getenv("CMA_XLSX_WORKERS", str(min(4, os.cpu_count() or 1))))
+STATEMENTS_SHEET_ID = os.getenv("CMA_STATEMENTS_SHEET_ID", "")
+GSHEETS_CREDS_FILE = os.getenv("CMA_GSHEETS_CREDS_FILE", "")
+GSHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+FORMATS = ("csv", "xlsx", "sheets")
+MAX_SLUG = 80
+MAX_SHEET_TITLE = 100  # Sheets' limit on tab names
+
+
+def slug(name) -> str:
+    """File-system safe version of a publisher name."""
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(name)).strip("_")[:MAX_SLUG] or "unknown"
+
+
+def unique_names(names, render, limit) -> dict:
+    """
+    {name: render(name)}, cut to `limit` characters. Two names that render
+    the same (case-insensitively, as file systems and Sheets tabs compare
+    them), such as "A&B" and "A-B", both get a short hash of the original
+    name appended, so no statement overwrites another.
+    """
+    out = {name: render(name)[:limit] for name in names}
+    seen = {}
+    for name, text in out.items():
+        seen.setdefault(text.casefold(), []).append(name)
+    for clash in seen.values():
+        if len(clash) > 1:
+            for name in clash:
+                tag = "_" + hashlib.sha1(str(name).encode()).hexdigest()[:6]
+                out[name] = out[name][:limit - len(tag)] + tag
+    return out
+
+
+def partition(frame: pd.DataFrame, key) -> dict:
+    """{publisher: its rows}, from one groupby rather than a filter per publisher."""
+    return {name: part.reset_index(drop=True)
+            for name, part in frame.groupby(key, sort=True, observed=True, dropna=False)}
+
+
+def _write_csv(path, df):
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def _write_xlsx(path, df):
+    # process-pool entry point: must stay a module-level function
+    df.to_excel(path, index=False, engine="openpyxl")
+    return str(path)
+
+
+_clients = threading.local()
+
+
+def _sheets_client():
+    """One gspread client per thread."""
+    if not hasattr(_clients, "client"):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        creds = Credentials.from_service_account_file(GSHEETS_CREDS_FILE, scopes=GSHEETS_SCOPES)
+        _clients.client = gspread.authorize(creds)
+    return _clients.client
+
+
+def _write_sheet(sheet_id, title, df):
+    from common.gsheets import write_frame
+
+    write_frame(_sheets_client(), sheet_id, title, df, diff=True)
+    return f"{sheet_id}:{title}"
+
+
+def write_statements(frame: pd.DataFrame, key, prefix, formats=("csv",), out_dir=None, sheet_id=None,
+                     workers=STATEMENT_WORKERS, xlsx_workers=XLSX_WORKERS) -> pd.DataFrame:
+    """
+    Writes one statement per value of `key` in every format
+    (csv / xlsx -> out_dir/<prefix>/<publisher>.<ext>, sheets -> a
+    "<prefix> <publisher>" tab of sheet_id). Returns one summary row per
+    output, with the file or tab actually written.
+    """
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown statement formats {sorted(unknown)}; choose from {FORMATS}")
+    sheet_id = sheet_id or STATEMENTS_SHEET_ID
+    if "sheets" in formats and not (sheet_id and GSHEETS_CREDS_FILE):
+        raise ValueError("sheets statements need CMA_STATEMENTS_SHEET_ID and CMA_GSHEETS_CREDS_FILE")
+
+    parts = partition(frame, key)
+    stems = unique_names(parts, slug, MAX_SLUG)
+    titles = unique_names(parts, lambda name: f"{prefix} {name}", MAX_SHEET_TITLE)
+    out_dir = Path(out_dir or STATEMENTS_DIR) / prefix
+    if {"csv", "xlsx"} & set(formats):
+        out_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Writing {len(parts)} statements x {len(formats)} formats ({', '.join(formats)})")
+
+    rows = []
+    with instrument.stage("statements", rows_in=frame, publishers=len(parts)) as st, \
+            ThreadPoolExecutor(max_workers=workers) as threads, \
+            ProcessPoolExecutor(max_workers=xlsx_workers) if "xlsx" in formats else _NoPool() as procs:
+        futures = {}
+        for name, df in parts.items():
+            for fmt in formats:
+                if fmt == "csv":
+                    f = threads.submit(_write_csv, out_dir / f"{stems[name]}.csv", df)
+                elif fmt == "xlsx":
+                    f = procs.submit(_write_xlsx, out_dir / f"{stems[name]}.xlsx", df)
+                else:
+                    f = threads.submit(_write_sheet, sheet_id, titles[name], df)
+                futures[f] = (name, fmt, len(df), time.perf_counter())
+        for f in as_completed(futures):
+            name, fmt, n_rows, t0 = futures[f]
+            row = {key if isinstance(key, str) else "publisher": name, "format": fmt, "rows": n_rows}
+            try:
+                row["output"] = f.result()
+            except Exception as e:
+                row["error"] = f"{type(e).__name__}: {e}"
+                print(f"[statement {name} {fmt}] failed: {row['error']}")
+            row["done_after_s"] = round(time.perf_counter() - t0, 1)
+            rows.append(row)
+        st.rows_out = len(rows)
+
+    summary = pd.DataFrame(rows)
+    failed = summary["error"].notna().sum() if "error" in summary.columns else 0
+    print(f"Statements: {len(summary) - failed} written, {failed} failed")
+    return summary
+
+
+class _NoPool:
+    """Stands in for the process pool when no XLSX is requested, so none is started."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
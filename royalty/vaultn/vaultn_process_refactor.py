@@ -1,17 +1,21 @@
 import os
-import re
+import sys
 from datetime import date
-import pandas as pd
+from pathlib import Path
 import numpy as np
+import pandas as pd
 import gspread
-import psycopg2
 from dotenv import load_dotenv
-from currency_converter import CurrencyConverter
-from rapidfuzz import process, fuzz
-from unidecode import unidecode
 from dateutil.relativedelta import relativedelta
 from google.oauth2.service_account import Credentials
 
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common import fx, instrument, warehouse
+from common.excel_ingest import read_excel_cached
+from common.gsheets import write_frame
+from common.aliases import alias_merge
+from royalty.framework import Distributor, MonthWindow, order_lines, register
+
 # --- CONFIGURATION ---
 # Load environment variables from .env file
 load_dotenv()
@@ -29,7 +33,39 @@ GSHEETS_SCOPES = [
 GSHEETS_CREDS_FILE = "/Users/ruqizheng/Documents/Analytics/ruqi-automation-credentials.json"
 DOWNLOADS_FOLDER = "/Users/ruqizheng/Downloads"
 GSHEETS_SHEET_ID = "1fFFLHVBTR1qesp9IStTNC-Y5SMxVAsLLhGulx78j6kU"
-
+# workbook name used by the framework runner/backfill; {abbr} = "Aug", {yyyymm} = "202508"
+VAULTN_EXCEL_TEMPLATE = os.getenv("VAULTN_EXCEL_TEMPLATE", "Vaultn_{abbr}.xlsx")
+
+# Publishers whose workbook rows are re-priced order by order against our own
+# lines: a case-insensitive substring of 'Publisher Name' -> the supplier_name
+# their order_details rows carry. A row the workbook shows with a promotion
+# that our line doesn't have is replaced by our royalty (see adjust_promos).
+PROMO_ADJUSTMENTS = {
+    "Bethesda": "Bethesda Softworks (VaultN)",
+}
+# Where the per-order promo data comes from:
+#   "iids"  - look up only the workbook's order references of those publishers
+#   "lines" - group the whole month's order lines of those suppliers
+PROMO_LOOKUP = os.getenv("VAULTN_PROMO_LOOKUP", "iids")
+PROMO_KEY_MODE = os.getenv("VAULTN_PROMO_KEY_MODE", "temp_table")  # or "in_list", see warehouse.read_for_keys
+
+PROMO_SQL = """
+    SELECT od.iid, od.status, od.promo_name, od.bundle_name, od.supplier_name AS od_supplier_name,
+           SUM(od.royalty) / 100.0 AS royalties
+    FROM shop.order_details od
+    WHERE od.iid IN {keys}
+      AND od.order_date >= %s AND od.order_date < %s
+      AND od.supplier_name IN %s
+      AND od.status IS NOT NULL AND od.status NOT IN ('CANCELLED', 'INITIALISED')
+    GROUP BY 1, 2, 3, 4, 5
+"""
+PROMO_SCHEMA = {"iid": "string", "status": "string", "promo_name": "string", "bundle_name": "string",
+                "od_supplier_name": "string", "royalties": "float64"}
+
+# VaultN workbook columns typed at read time. All columns are still loaded
+# because the promo detail tab republishes the full rows.
+VAULTN_TEXT_COLS = ['Publisher Name', 'Invoicing Currency', 'Client Order Reference']
+VAULTN_NUMERIC_COLS = ['Purchase Price In Invoicing Currency']
 
 # --- HELPER FUNCTIONS ---
 
@@ -46,94 +82,199 @@ def get_previous_month_dates():
     month_abbr = start_date.strftime('%b')
     return start_date, end_date, month_abbr
 
-def get_redshift_connection():
-    """Establishes and returns a connection to Redshift."""
-    conn = psycopg2.connect(
-        host=os.getenv("REDSHIFT_HOST"),
-        port=os.getenv("REDSHIFT_PORT", "5439"),
-        dbname=os.getenv("REDSHIFT_DB"),
-        user=os.getenv("REDSHIFT_USER"),
-        password=os.getenv("REDSHIFT_PASSWORD"),
-        sslmode='require'
-    )
-    return conn
-
-def normalize_name(s):
-    """Cleans and standardizes a supplier name for matching."""
-    if pd.isna(s):
-        return ''
-    s = unidecode(str(s)).lower()
-    s = s.replace('&', ' and ')
-    s = re.sub(r'[^a-z0-9\s]', ' ', s)
-    # Remove common business suffixes
-    s = re.sub(r'\b(ltd|limited|inc|corp|corporation|co|company|gmbh|ag|plc|llc|llp|pte|pty|bv|nv|sas|sl|sa|sp\s*z\s*o\s*o|oy|oyj|ab)\b', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
-def fuzzy_merge(df_left, df_right, left_key, right_key, threshold=90):
-    """
-    Merges two DataFrames based on a fuzzy match of string columns.
-    """
-    L = df_left.copy()
-    R = df_right.copy()
-    L['_name_norm'] = L[left_key].map(normalize_name)
-    R['_name_norm'] = R[right_key].map(normalize_name)
-
-    matches = []
-    # Use a simplified matching approach for clarity
-    choices = dict(zip(R.index, R['_name_norm']))
-    for i, s in L['_name_norm'].items():
-        if not s:
-            matches.append((i, np.nan, 0))
-            continue
-        
-        # extractOne returns (choice, score, key)
-        result = process.extractOne(s, choices, scorer=fuzz.token_set_ratio)
-        if result and result[1] >= threshold:
-            # result[2] is the index from the right DataFrame
-            matches.append((i, result[2], result[1]))
-        else:
-            matches.append((i, np.nan, 0))
-
-    M = pd.DataFrame(matches, columns=['left_idx', 'right_idx', 'match_score'])
-    M = M.dropna(subset=['right_idx'])
-    M['right_idx'] = M['right_idx'].astype(int)
-
-    # Merge based on indices
-    out = L.merge(M, left_index=True, right_on='left_idx', how='left')
-    out = out.merge(R, left_on='right_idx', right_index=True, how='left', suffixes=('_left', '_right'))
-    
-    out = out.drop(columns=[c for c in ['_name_norm_left', '_name_norm_right', 'left_idx', 'right_idx', 'match_score'] if c in out.columns])
-    return out
-
-def df_to_gspread_values(df: pd.DataFrame):
-    """Formats a DataFrame for writing to Google Sheets."""
-    df_copy = df.copy()
-    for col in df_copy.columns:
-        if pd.api.types.is_datetime64_any_dtype(df_copy[col]):
-            df_copy[col] = df_copy[col].dt.strftime('%Y-%m-%d')
-    
-    # Replace NaN/NaT with empty strings for Google Sheets
-    df_copy = df_copy.astype(object).where(pd.notnull(df_copy), "")
-    return [df_copy.columns.tolist()] + df_copy.values.tolist()
-
-def write_to_gsheet(client, sheet_id, worksheet_title, df):
+def write_to_gsheet(client, sheet_id, worksheet_title, df, diff=False):
     """Writes a DataFrame to a specified worksheet in a Google Sheet."""
     try:
-        sh = client.open_by_key(sheet_id)
-        try:
-            ws = sh.worksheet(worksheet_title)
-            ws.clear()
-        except gspread.WorksheetNotFound:
-            ws = sh.add_worksheet(title=worksheet_title, rows=1, cols=1)
-        
         print(f"Writing data to worksheet: '{worksheet_title}'...")
-        values = df_to_gspread_values(df)
-        ws.update("A1", values, value_input_option='USER_ENTERED')
+        write_frame(client, sheet_id, worksheet_title, df, diff=diff)
         print("Successfully updated Google Sheet.")
     except Exception as e:
         print(f"An error occurred while writing to Google Sheets: {e}")
 
+def aggregate_report(df, start_date):
+    """Publisher/currency totals from the VaultN workbook, converted to GBP at the month-start rate."""
+    grouped = df.groupby(['Publisher Name', 'Invoicing Currency'])['Purchase Price In Invoicing Currency'].sum().reset_index()
+    return convert_to_gbp(grouped, start_date)
+
+def convert_to_gbp(grouped, start_date):
+    """Adds 'Converted to GBP' to publisher/currency totals at the month-start rate."""
+    print("Converting currencies to GBP...")
+    grouped['Invoicing Currency'] = grouped['Invoicing Currency'].astype(str).str.strip().str.upper()
+    grouped['Converted to GBP'] = fx.convert(
+        grouped['Purchase Price In Invoicing Currency'], grouped['Invoicing Currency'], start_date, to='GBP'
+    ).round(2)
+    return grouped
+
+def supplier_royalties(lines):
+    """Supplier royalties (COMPLETE/REFUNDED lines of VaultN suppliers) from the shared month extract (the old query1)."""
+    q1 = lines[lines['status'].isin(['COMPLETE', 'REFUNDED']) & lines['vaultn'].eq(True) & lines['supplier_id'].notna()]
+    return q1.groupby(['supplier_id', 'supplier_name'], as_index=False)['royalty'].sum().rename(columns={'royalty': 'royalties'})
+
+def promo_from_order_lines(lines):
+    """Per-order promo royalties of the PROMO_ADJUSTMENTS suppliers from the whole month extract (the old query2)."""
+    q2 = lines[lines['status'].notna() & ~lines['status'].isin(['CANCELLED', 'INITIALISED'])
+               & lines['od_supplier_name'].isin(list(PROMO_ADJUSTMENTS.values()))]
+    keys = ['od_supplier_name', 'iid', 'status', 'promo_name', 'bundle_name']
+    return (q2.groupby(keys, dropna=False, as_index=False)['royalty'].sum()
+              .rename(columns={'royalty': 'royalties'}))
+
+def promo_suppliers(df):
+    """
+    Per workbook row, the supplier_name its PROMO_ADJUSTMENTS rule maps to
+    (NaN for other publishers), matched once per distinct publisher name.
+    """
+    names = pd.Series(df['Publisher Name'].dropna().unique())
+    rule = pd.Series(None, index=names, dtype=object)
+    for pattern, supplier in PROMO_ADJUSTMENTS.items():
+        rule[rule.isna() & names.str.contains(pattern, case=False, regex=False).to_numpy()] = supplier
+    return df['Publisher Name'].map(rule)
+
+def promo_rows(df):
+    """The workbook rows of PROMO_ADJUSTMENTS publishers."""
+    return df[promo_suppliers(df).notna().to_numpy()]
+
+def lookup_promo_data(conn, df, start_date, end_excl, mode=PROMO_KEY_MODE):
+    """
+    Per-order promo royalties for only the order references the workbook
+    lists under PROMO_ADJUSTMENTS publishers, instead of grouping every line
+    of those suppliers for the month.
+    """
+    refs = promo_rows(df)['Client Order Reference'].dropna().unique()
+    print(f"Looking up {len(refs)} promo order references ({mode})")
+    suppliers = tuple(PROMO_ADJUSTMENTS.values())
+    return warehouse.read_for_keys(conn, PROMO_SQL, refs, params=(start_date, end_excl, suppliers),
+                                   mode=mode, table="vaultn_refs", schema=PROMO_SCHEMA)
+
+def promo_data_for(df, start_date, end_excl, lines=None):
+    """Per-order promo data the way PROMO_LOOKUP says (lines is the month extract, for "lines")."""
+    if PROMO_LOOKUP == "lines":
+        return promo_from_order_lines(lines if lines is not None else order_lines(MonthWindow(start_date)))
+    with warehouse.connection() as conn:
+        return lookup_promo_data(conn, df, start_date, end_excl)
+
+def compare(grouped, results):
+    """Matches publishers to suppliers (alias table first, fuzzy for new names) and diffs the totals."""
+    print("Matching Excel publishers to Redshift suppliers...")
+    comparison = alias_merge(grouped, results, left_key=LEFT_COL, right_key=RIGHT_COL, source="vaultn", threshold=90)
+    comparison = comparison[['Publisher Name', 'Invoicing Currency', 'Purchase Price In Invoicing Currency', 'Converted to GBP', 'royalties']]
+    comparison['Difference'] = (comparison['Converted to GBP'] - comparison['royalties']).round(2)
+    return comparison
+
+def promo_index(promo_data):
+    """
+    Our per-order promo data keyed by (od_supplier_name, iid), one row per
+    supplier's order reference: royalties summed over its status/bundle
+    groups, promo_name the non-empty one if any. Keyed by supplier too, so
+    with several PROMO_ADJUSTMENTS suppliers one publisher's rows never pick
+    up another supplier's lines of the same order.
+    """
+    per_iid = (promo_data.assign(promo_name=promo_data['promo_name'].fillna(''))
+                         .groupby(['od_supplier_name', 'iid'], sort=False)
+                         .agg(promo_name=('promo_name', 'max'), royalties=('royalties', 'sum')))
+    return per_iid
+
+def adjust_promos(df, promo_data, comparison, start_date):
+    """
+    Per-order promo adjustment for every PROMO_ADJUSTMENTS publisher in one
+    pass; returns (final_adjusted_df, promo_adjusted_report).
+
+    Workbook rows are looked up in a hash index of our lines by (the
+    supplier their rule maps to, 'Client Order Reference' = iid). Where the
+    workbook has a promotion and our line has none, the row's price becomes
+    our royalty. The publisher totals are then moved by the sum of those
+    changes, not re-grouped.
+    """
+    print(f"Performing per-order promo adjustment for {', '.join(PROMO_ADJUSTMENTS)}...")
+    suppliers = promo_suppliers(df)
+    report = df[suppliers.notna().to_numpy()].copy()
+
+    index = promo_index(promo_data)
+    pos = index.index.get_indexer(pd.MultiIndex.from_arrays(
+        [suppliers[suppliers.notna()].to_numpy(), report['Client Order Reference'].to_numpy()]))
+    found = pos >= 0
+    our_promo = np.where(found, index['promo_name'].to_numpy()[np.maximum(pos, 0)], '')
+    our_royalties = np.where(found, index['royalties'].to_numpy()[np.maximum(pos, 0)], np.nan)
+
+    # If the original report had a promo, but our internal data doesn't, use internal royalties
+    their_promo = report['Promotion Name']
+    condition = (their_promo.notna() & their_promo.ne('')).to_numpy() & (our_promo == '')
+
+    price = report['Purchase Price In Invoicing Currency'].to_numpy(dtype='float64')
+    new_price = np.where(condition, our_royalties, price)
+    report['Purchase Price In Invoicing Currency'] = new_price
+    report.loc[condition, 'Status'] = 'Adjusted'
+
+    # totals move by the per-row change; NaN royalties (order not in our data) count as 0, as sum() did
+    delta = (report.assign(delta=np.nan_to_num(new_price) - np.nan_to_num(price))
+                   .groupby(['Publisher Name', 'Invoicing Currency'])['delta'].sum().reset_index())
+    delta['Invoicing Currency'] = delta['Invoicing Currency'].astype(str).str.strip().str.upper()
+
+    final_adjusted_df = pd.merge(comparison, delta, on=['Publisher Name', 'Invoicing Currency'], how='left')
+    adjusted = final_adjusted_df['delta'].notna()
+    final_adjusted_df['Adjusted Purchase Price In Invoicing Currency'] = (
+        final_adjusted_df['Purchase Price In Invoicing Currency'] + final_adjusted_df['delta']
+    ).where(adjusted)
+    final_adjusted_df['Adjusted Converted to GBP'] = pd.Series(fx.convert(
+        final_adjusted_df['Adjusted Purchase Price In Invoicing Currency'], final_adjusted_df['Invoicing Currency'],
+        start_date, to='GBP'
+    ), index=final_adjusted_df.index).round(2).where(adjusted)
+    final_adjusted_df = final_adjusted_df.drop(columns='delta')
+
+    # Calculate final difference, using adjusted price where available, otherwise original
+    final_adjusted_df['adjusted_difference'] = (
+        final_adjusted_df['Adjusted Converted to GBP'].fillna(final_adjusted_df['Converted to GBP']) - final_adjusted_df['royalties']
+    ).round(2)
+    return final_adjusted_df, report
+
+def publish_to_sheets(final_adjusted_df, promo_adjusted_report, tab_suffix=""):
+    """Writes both reports to Google Sheets and returns the tab names."""
+    print("Authorizing with Google Sheets...")
+    creds = Credentials.from_service_account_file(GSHEETS_CREDS_FILE, scopes=GSHEETS_SCOPES)
+    gspread_client = gspread.authorize(creds)
+
+    tabs = [f"Overall Comparison{tab_suffix}", f"Promo Adjusted Detail{tab_suffix}"]
+    # Write the main comparison report
+    write_to_gsheet(gspread_client, GSHEETS_SHEET_ID, tabs[0], final_adjusted_df)
+
+    # Write the detailed promo adjusted report
+    write_to_gsheet(gspread_client, GSHEETS_SHEET_ID, tabs[1], promo_adjusted_report, diff=True)
+    return tabs
+
+@register
+class VaultNReconciliation(Distributor):
+    """VaultN as a royalty/framework.py plugin, reading the shared month extract."""
+    name = "vaultn"
+    statement_key = "Publisher Name"
+
+    def ingest(self, month):
+        excel_file = os.path.join(DOWNLOADS_FOLDER, VAULTN_EXCEL_TEMPLATE.format(abbr=month.abbr, yyyymm=month.yyyymm))
+        return read_excel_cached(excel_file, text=VAULTN_TEXT_COLS, numeric=VAULTN_NUMERIC_COLS)
+
+    def aggregate(self, report, month):
+        return report, aggregate_report(report, month.start)
+
+    def match(self, agg, fetched, month):
+        report, grouped = agg
+        results = supplier_royalties(fetched)
+        promo_data = promo_data_for(report, month.start, month.end_excl, lines=fetched)
+        return report, promo_data, compare(grouped, results)
+
+    def diff(self, matched, month):
+        report, promo_data, comparison = matched
+        return adjust_promos(report, promo_data, comparison, month.start)
+
+    def statement_frame(self, matched, result):
+        # every workbook row, with the promo-adjusted rows in place of the originals
+        report = matched[0]
+        adjusted = result[1]
+        return pd.concat([report.drop(index=adjusted.index), adjusted]).sort_index()
+
+    def publish(self, result, month):
+        final_adjusted_df, promo_adjusted_report = result
+        csv_out = f"promo_adjusted_report_{month.yyyymm}.csv"
+        promo_adjusted_report.to_csv(csv_out, index=False)
+        return [csv_out] + publish_to_sheets(final_adjusted_df, promo_adjusted_report, tab_suffix=f" {month}")
+
 # --- MAIN SCRIPT LOGIC ---
 
 def main():
@@ -146,107 +287,48 @@ def main():
     print(f"Processing data for the period: {start_date} to {end_date}")
     print(f"Expecting input file: {excel_file}")
 
+    with instrument.run(f"vaultn-{start_date:%Y%m}"):
+        run_pipeline(excel_file, start_date, end_date)
+
+def run_pipeline(excel_file, start_date, end_date):
+    """Steps 2-7 of main(); each step is recorded as an instrument stage."""
     # 2. Load and Process Excel Data
     try:
-        df = pd.read_excel(excel_file)
-        df.columns = df.columns.str.strip()
+        df = instrument.timed("read_excel")(read_excel_cached)(excel_file, text=VAULTN_TEXT_COLS, numeric=VAULTN_NUMERIC_COLS)
     except FileNotFoundError:
         print(f"ERROR: The file {excel_file} was not found. Please check the file name and location.")
         return
 
-    grouped = df.groupby(['Publisher Name', 'Invoicing Currency'])['Purchase Price In Invoicing Currency'].sum().reset_index()
+    # 3. Totals per publisher/currency, converted to GBP
+    grouped = instrument.timed("aggregate_report")(aggregate_report)(df, start_date)
 
-    # 3. Currency Conversion
-    print("Converting currencies to GBP...")
-    cc = CurrencyConverter()
-    grouped['Invoicing Currency'] = grouped['Invoicing Currency'].astype(str).str.strip().str.upper()
-    unique_currencies = grouped['Invoicing Currency'].dropna().unique()
-    rate_map = {c: (1.0 if c == 'GBP' else cc.convert(1, c, 'GBP', date=start_date)) for c in unique_currencies}
-    grouped['Converted to GBP'] = (grouped['Purchase Price In Invoicing Currency'] * grouped['Invoicing Currency'].map(rate_map)).round(2)
-
-    conn = None
     try:
-        # 4. Fetch Data from Redshift
-        conn = get_redshift_connection()
-        print("Successfully connected to Redshift.")
-
-        # Query for overall supplier royalties
-        query1 = """
-            SELECT s.supplier_name, SUM(od.royalty) / 100.0 AS "royalties"
-            FROM shop.order_details od
-            JOIN shop.products p ON p.product_id = od.product_id
-            JOIN shop.suppliers s ON s.supplier_id = p.supplier_id
-            WHERE od.order_date >= %s AND od.order_date < %s
-              AND od.status IN ('COMPLETE', 'REFUNDED')
-              AND s.vaultn = TRUE
-            GROUP BY 1;
-        """
-        results = pd.read_sql(query1, conn, params=[start_date, end_date])
-
-        # 5. Perform Fuzzy Merge and Comparison
-        print("Performing fuzzy match between Excel data and Redshift data...")
-        # Manual correction before merging
-        grouped.loc[grouped['Publisher Name'] == 'THUNDERFUL PUBLISHING', 'Publisher Name'] = 'THUNDERFUL'
-
-        comparison = fuzzy_merge(grouped, results, left_key=LEFT_COL, right_key=RIGHT_COL, threshold=90)
-        comparison = comparison[['Publisher Name', 'Invoicing Currency', 'Purchase Price In Invoicing Currency', 'Converted to GBP', 'royalties']]
-        comparison['Difference'] = (comparison['Converted to GBP'] - comparison['royalties']).round(2)
-
-        # 6. Special Handling for Bethesda
-        print("Performing special adjustment for Bethesda...")
-        bethesda_df = df[df['Publisher Name'].str.contains('Bethesda', case=False, na=False)].copy()
-
-        query2 = """
-            SELECT od.iid, od.status, od.promo_name, od.bundle_name, SUM(od.royalty) / 100.0 AS "royalties"
-            FROM shop.order_details od
-            WHERE od.order_date >= %s AND od.order_date < %s
-              AND od.status NOT IN ('CANCELLED', 'INITIALISED')
-              AND od.supplier_name = 'Bethesda Softworks (VaultN)'
-            GROUP BY 1, 2, 3, 4;
-        """
-        promo_data = pd.read_sql(query2, conn, params=[start_date, end_date])
-        
-        merged_bethesda = pd.merge(bethesda_df, promo_data[['iid', 'promo_name', 'royalties']], how='left', left_on='Client Order Reference', right_on='iid')
-        
-        # If the original report had a promo, but our internal data doesn't, use internal royalties
-        condition = merged_bethesda['Promotion Name'].notna() & merged_bethesda['Promotion Name'].ne('') & \
-                    (merged_bethesda['promo_name'].isna() | merged_bethesda['promo_name'].eq(''))
-        
-        merged_bethesda.loc[condition, 'Purchase Price In Invoicing Currency'] = merged_bethesda.loc[condition, 'royalties']
-        merged_bethesda.loc[condition, 'Status'] = 'Adjusted'
-        bethesda_adjusted_report = merged_bethesda.drop(columns=['iid', 'promo_name', 'royalties'])
-        bethesda_adjusted_report.to_csv('bethesda_adjusted_report.csv', index=False)
-        
-        # Recalculate the sum for Bethesda and create the final adjusted comparison
-        merged_sum = bethesda_adjusted_report.groupby(['Publisher Name', 'Invoicing Currency'])['Purchase Price In Invoicing Currency'].sum().reset_index()
-        merged_sum.rename(columns={'Purchase Price In Invoicing Currency': 'Adjusted Purchase Price In Invoicing Currency'}, inplace=True)
-
-        final_adjusted_df = pd.merge(comparison, merged_sum, on=['Publisher Name', 'Invoicing Currency'], how='left')
-        
-        # Calculate final difference, using adjusted price where available, otherwise original
-        final_adjusted_df['adjusted_difference'] = (
-            final_adjusted_df['Adjusted Purchase Price In Invoicing Currency'].fillna(final_adjusted_df['Converted to GBP']) - final_adjusted_df['royalties']
-        ).round(2)
+        # 4. Supplier royalties and per-order promo data from the month's order lines
+        # (a local snapshot once the month is closed, see common/snapshots.py)
+        lines = instrument.timed("order_lines")(order_lines)(MonthWindow(start_date))
+        results = supplier_royalties(lines)
+        promo_data = instrument.timed("promo_data")(promo_data_for)(df, start_date, end_date, lines=lines)
+        print(f"Computed supplier royalties from the order lines and promo data ({PROMO_LOOKUP}).")
 
-        # 7. Write Results to Google Sheets
-        print("Authorizing with Google Sheets...")
-        creds = Credentials.from_service_account_file(GSHEETS_CREDS_FILE, scopes=GSHEETS_SCOPES)
-        gspread_client = gspread.authorize(creds)
+        # 5. Match publishers to suppliers and compare
+        comparison = instrument.timed("compare")(compare)(grouped, results)
 
-        # Write the main comparison report
-        write_to_gsheet(gspread_client, GSHEETS_SHEET_ID, "Overall Comparison", final_adjusted_df)
+        # 6. Per-order promo adjustment (Bethesda and any other PROMO_ADJUSTMENTS publisher)
+        with instrument.stage("adjust_promos", rows_in=promo_data):
+            final_adjusted_df, promo_adjusted_report = adjust_promos(df, promo_data, comparison, start_date)
+        promo_adjusted_report.to_csv('promo_adjusted_report.csv', index=False)
 
-        # Write the detailed Bethesda adjusted report
-        write_to_gsheet(gspread_client, GSHEETS_SHEET_ID, "Bethesda Adjusted Detail", bethesda_adjusted_report)
+        # 7. Write Results to Google Sheets
+        with instrument.stage("publish_to_sheets", rows_in=final_adjusted_df):
+            publish_to_sheets(final_adjusted_df, promo_adjusted_report)
 
         print("Process completed successfully!")
 
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     finally:
-        if conn:
-            conn.close()
-            print("Redshift connection closed.")
+        warehouse.close_pool()
+        print("Redshift connections closed.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
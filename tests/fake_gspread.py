@@ -0,0 +1,62 @@
+# In-memory stand-in for the parts of a gspread client that common/gsheets.py uses.
+import gspread
+from gspread.utils import a1_to_rowcol
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows, cols):
+        self.title = title
+        self.cells = [["" for _ in range(cols)] for _ in range(rows)]
+        self.calls = []
+
+    @property
+    def row_count(self):
+        return len(self.cells)
+
+    @property
+    def col_count(self):
+        return len(self.cells[0]) if self.cells else 0
+
+    def resize(self, rows=None, cols=None):
+        self.calls.append(("resize", rows, cols))
+        rows = self.row_count if rows is None else rows
+        cols = self.col_count if cols is None else cols
+        self.cells = [(r + [""] * cols)[:cols] for r in self.cells[:rows]]
+        self.cells += [["" for _ in range(cols)] for _ in range(rows - len(self.cells))]
+
+    def batch_update(self, data, value_input_option=None):
+        self.calls.append(("batch_update", [d["range"] for d in data]))
+        for d in data:
+            top_left = d["range"].split(":")[0]
+            r0, c0 = a1_to_rowcol(top_left)
+            for i, row in enumerate(d["values"]):
+                for j, v in enumerate(row):
+                    self.cells[r0 - 1 + i][c0 - 1 + j] = v
+
+    def get_all_values(self):
+        return [list(r) for r in self.cells]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.sheets = {}
+
+    def worksheet(self, title):
+        if title not in self.sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.sheets[title] = FakeWorksheet(title, rows, cols)
+        return self.sheets[title]
+
+    def del_worksheet(self, ws):
+        del self.sheets[ws.title]
+
+
+class FakeClient:
+    def __init__(self):
+        self.spreadsheets = {}
+
+    def open_by_key(self, key):
+        return self.spreadsheets.setdefault(key, FakeSpreadsheet())
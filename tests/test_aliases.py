@@ -0,0 +1,56 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from common import aliases
+
+
+@pytest.fixture
+def store(tmp_path):
+    return aliases.AliasStore("test", path=tmp_path / "aliases.sqlite")
+
+
+REPORT = pd.DataFrame({"Publisher Name": ["Acme Games Ltd"], "sales": [10.0]})
+SUPPLIERS = pd.DataFrame({"supplier_id": [1, 2], "supplier_name": ["Acme Games Ltd.", "Zeta Interactive"]})
+
+
+def _merge(store):
+    return aliases.alias_merge(REPORT, SUPPLIERS, "Publisher Name", "supplier_name", "test", store=store)
+
+
+def test_connections_are_closed(store, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(aliases.sqlite3, "connect", lambda *a, **k: opened.append(connect(*a, **k)) or opened[-1])
+
+    store.lookup(["acme games ltd"])
+    store.upsert(pd.DataFrame({"publisher_name": ["X"], "supplier_id": [1], "supplier_name": ["X"],
+                               "match_score": [100.0]}))
+    assert len(opened) == 2
+    for db in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            db.execute("SELECT 1")
+
+
+def test_fuzzy_hits_are_saved_unconfirmed_and_can_be_rejected(store):
+    assert _merge(store)["supplier_id"].tolist() == [1]
+    assert store.entries(unconfirmed=True)["publisher_name"].tolist() == ["Acme Games Ltd"]
+
+    assert store.review("Acme Games Ltd", "rejected")
+    out = _merge(store)
+    assert out["supplier_id"].isna().all()
+    # the rejection sticks: the fuzzy hit isn't written back over it
+    assert store.entries()["confirmed_by"].tolist() == ["rejected"]
+
+    store.upsert(pd.DataFrame({"publisher_name": ["Acme Games Ltd"], "supplier_id": [2],
+                               "supplier_name": ["Zeta Interactive"], "match_score": [100.0]}),
+                 confirmed_by="manual")
+    assert _merge(store)["supplier_id"].tolist() == [2]
+
+
+def test_confirm_marks_alias_manual(store):
+    _merge(store)
+    assert store.review("acme games ltd", "manual")
+    assert store.entries(unconfirmed=True).empty
+    assert not store.review("Unknown Publisher", "manual")
@@ -0,0 +1,35 @@
+from urllib.parse import unquote, urlsplit
+
+import pandas as pd
+
+from common import arrow_fetch, warehouse
+
+
+class _Conn:
+    def __init__(self, **dsn):
+        self.dsn = dsn
+
+    def get_dsn_parameters(self):
+        return self.dsn
+
+
+def test_connectorx_uri_quotes_credentials_and_keeps_sslmode(monkeypatch):
+    monkeypatch.setenv("REDSHIFT_PASSWORD", "p@ss:w/rd#1")
+    conn = _Conn(user="etl user", host="db.example", port="5439", dbname="dw", sslmode="verify-full")
+
+    uri = urlsplit(arrow_fetch.connectorx_uri(conn))
+    assert unquote(uri.password) == "p@ss:w/rd#1"
+    assert unquote(uri.username) == "etl user"
+    assert (uri.hostname, uri.port, uri.path) == ("db.example", 5439, "/dw")
+    assert uri.query == "sslmode=verify-full"
+
+
+def test_read_for_keys_avoids_temp_tables_under_connectorx(monkeypatch):
+    monkeypatch.setattr(arrow_fetch, "FETCH_BACKEND", "connectorx")
+    calls = []
+    monkeypatch.setattr(warehouse, "temp_table", lambda *a, **k: calls.append("temp_table"))
+    monkeypatch.setattr(warehouse, "read_frame",
+                        lambda conn, sql, params, schema=None: calls.append(params) or pd.DataFrame())
+
+    warehouse.read_for_keys(None, "SELECT 1 WHERE k IN {keys}", ["b", "a"], schema={"k": "string"})
+    assert calls == [(("a", "b"),)]
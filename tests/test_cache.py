@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from common import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+def test_store_replaces_entry_without_leftover_temp_files(cache_dir):
+    cache.store("SELECT 1", [1], pd.DataFrame({"a": [1]}), label="one")
+    cache.store("SELECT 1", [1], pd.DataFrame({"a": [1, 2]}), label="one")
+
+    assert sorted(p.suffix for p in cache_dir.iterdir()) == [".json", ".parquet"]
+    assert cache.cached_frame("SELECT 1", [1], lambda: pytest.fail("should be a hit"))["a"].tolist() == [1, 2]
+
+
+def test_failed_write_keeps_no_partial_file(cache_dir):
+    class Unwritable(pd.DataFrame):
+        def to_parquet(self, *a, **k):
+            raise OSError("disk full")
+
+    cache.store("SELECT 2", [], Unwritable({"a": [1]}))
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_entries_skip_files_removed_mid_listing(cache_dir, monkeypatch):
+    cache.store("SELECT 3", [], pd.DataFrame({"a": [1]}))
+    glob = type(cache_dir).glob
+
+    def glob_then_evict(self, pattern):
+        found = list(glob(self, pattern))
+        for p in found:
+            p.unlink()  # another process evicts between glob and stat
+        return found
+
+    monkeypatch.setattr(type(cache_dir), "glob", glob_then_evict)
+    assert cache.entries().empty
+
+
+def test_entry_evicted_before_read_is_reloaded(monkeypatch):
+    cache.store("SELECT 4", [], pd.DataFrame({"a": [1]}))
+    monkeypatch.setattr(cache.pd, "read_parquet", lambda path: (_ for _ in ()).throw(FileNotFoundError(path)))
+    monkeypatch.setattr(cache, "store", lambda *a, **k: None)
+
+    assert cache.cached_frame("SELECT 4", [], lambda: pd.DataFrame({"a": [9]}))["a"].tolist() == [9]
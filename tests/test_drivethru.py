@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import fx
+from royalty.drivethru import drivethru
+
+COLUMNS = ["kind", "order_date", "supplier_name", "isbn", "sku", "product_name", "promo_name", "bundle_name",
+           "revenue_ex_vat_pf", "transaction_fee", "affiliate_commission", "affiliate_fee", "exclusivity_fee",
+           "fixed_royalty_currency", "royalty_percentage"]
+
+
+def _lines():
+    rows = [
+        # a plain sale: isbn wins over sku
+        ("sale", "2025-07-03", "Pub", "978", "S1", "Book A", None, None, 1000.0, 40.0, 0.4, None, 100.0, None, 0.5),
+        # refunds: fixed royalty in a 0% bundle is kept ...
+        ("refund", "2025-07-04", "Pub", None, "S2", "Book B", None, "Bundle X", 800.0, 0.0, 0.4, 0.0, 80.0, "USD", 0.0),
+        # ... a 0% bundle line without one is dropped ...
+        ("refund", "2025-07-04", "Pub", None, "S3", "Book C", None, "Bundle X", 500.0, 0.0, 0.0, 0.0, 50.0, None, 0.0),
+        # ... and a 0% line outside a bundle is kept
+        ("refund", "2025-07-05", "Pub", "979", "S4", "Book D", "Summer", None, 400.0, 40.0, 0.0, 0.0, 40.0, None, 0.0),
+    ]
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def _rates():
+    usd = pd.DataFrame({"day": ["2025-07-01"], "currency": ["USD"], "rate": [1.25]})
+    return fx.from_long(usd, source="test", start=pd.Timestamp("2025-07-01").date(),
+                        end=pd.Timestamp("2025-07-31").date())
+
+
+def test_line_amounts_converts_and_names():
+    out = drivethru.line_amounts(_lines(), _rates())
+
+    np.testing.assert_allclose(out["value"], [12.5, 10.0, 6.25, 5.0])
+    np.testing.assert_allclose(out["deductions"], [1.0, 0.5, 0.0, 0.5])
+    np.testing.assert_allclose(out["royalty"], [1.25, 1.0, 0.625, 0.5])
+    assert out["sku"].tolist() == ["978", "S2", "S3", "979"]
+    assert out["name"].tolist() == ["Book A", "Book B\\n in Bundle X", "Book C\\n in Bundle X", "Book D\\n in Summer"]
+    assert out["in_bundle"].tolist() == [False, True, True, False]
+
+
+def test_sales_statement():
+    out = drivethru.sales_statement(drivethru.line_amounts(_lines(), _rates()))
+
+    assert out.to_dict("records") == [{
+        "supplier_name": "Pub", "sku": "978", "name": "Book A", "qty": 1, "value": 12.5, "deductions": 1.0,
+        "net": 11.5, "royalty_percentage": 0.05, "royalty": 1.25, "in_bundle": False,
+    }]
+
+
+def test_refunds_statement_matches_the_sql():
+    out = drivethru.refunds_statement(drivethru.line_amounts(_lines(), _rates()))
+
+    # Drivethru.sql's refunds query: qty, deductions, net and royalty negated, value left positive
+    assert out["sku"].tolist() == ["979", "S2"]
+    assert out["name"].tolist() == ["Book D\\n in Summer", "Book B\\n in Bundle X"]
+    assert out["qty"].tolist() == [-1, -1]
+    assert out["value"].tolist() == pytest.approx([5.0, 10.0])
+    assert out["deductions"].tolist() == pytest.approx([-0.5, -0.5])
+    assert out["net"].tolist() == pytest.approx([-4.5, -9.5])
+    assert out["royalty"].tolist() == pytest.approx([-0.5, -1.0])
+    assert out["in_bundle"].tolist() == [False, True]
@@ -0,0 +1,26 @@
+import pytest
+
+from royalty import framework
+
+
+def _stub(*stages):
+    return type("Stub", (framework.Distributor,), {"name": "stub", **{s: lambda self, *a: None for s in stages}})
+
+
+def test_distributor_needs_ingest_match_and_publish():
+    assert isinstance(_stub("ingest", "match", "publish")(), framework.Distributor)
+    for missing in ["ingest", "match", "publish"]:
+        with pytest.raises(TypeError, match="abstract"):
+            _stub(*{"ingest", "match", "publish"} - {missing})()
+
+
+def test_distributor_stage_defaults():
+    d = _stub("ingest", "match", "publish")()
+    report = object()
+    assert d.aggregate(report, None) is report
+    assert d.diff(report, None) is report
+
+
+@pytest.mark.parametrize("name", ["genba", "vaultn", "drivethru"])
+def test_registered_plugins_implement_every_stage(name):
+    assert isinstance(framework.get_distributor(name), framework.Distributor)
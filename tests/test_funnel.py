@@ -0,0 +1,81 @@
+import re
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from common import funnel, warehouse
+
+
+@pytest.fixture(autouse=True)
+def local_rollup(tmp_path, monkeypatch):
+    monkeypatch.setattr(funnel, "FUNNEL_DIR", tmp_path)
+
+
+def fake_warehouse(monkeypatch, popular, events):
+    """read_frame answering the funnel's queries from (day, session, label) `events`."""
+    def read_frame(conn, sql, params=None, schema=None, **kwargs):
+        if "MIN(derived_tstamp)" in sql:
+            return pd.DataFrame({"day": [min(e[0] for e in events)]})
+        if "COUNT(*) AS events" in sql:
+            return pd.DataFrame({"se_label": popular, "events": range(len(popular), 0, -1)})
+        # the rollup query: bit i is the i-th label of its CASE
+        labels = [m.replace("''", "'") for m in re.findall(r"WHEN '((?:[^']|'')*)' THEN", sql)]
+        lo, hi = params
+        masks = {}
+        for day, session, label in events:
+            if lo <= day < hi:
+                bit = 1 << labels.index(label) if label in labels else 0
+                masks[(day, session)] = masks.get((day, session), 0) | bit
+        return pd.DataFrame({"day": [k[0] for k in masks], "domain_sessionid": [k[1] for k in masks],
+                             "mask": list(masks.values())})
+
+    monkeypatch.setattr(warehouse, "read_frame", read_frame)
+
+
+def test_steps_labels_get_bits_even_when_rare(monkeypatch):
+    popular = [f"label-{i}" for i in range(100)]  # more than MAX_LABELS, none of them a STEPS label
+    events = [(date(2025, 1, 2), "s1", "input-focused"), (date(2025, 1, 2), "s1", "enter"),
+              (date(2025, 1, 3), "s2", "label-0")]
+    fake_warehouse(monkeypatch, popular, events)
+
+    funnel.refresh(conn=object(), until=date(2025, 1, 5))
+    labels = funnel.meta()["labels"]
+    assert labels[:6] == funnel.step_labels(funnel.STEPS)
+    assert len(labels) == funnel.MAX_LABELS
+
+    df = funnel.counts("month")
+    assert df.loc[0, "total_sessions"] == 2
+    assert df.loc[0, "sessions_focused"] == 1
+    assert df.loc[0, "sessions_submitted"] == 1
+    assert df.loc[0, "sessions_clicked_view_all"] == 0
+
+
+def test_counts_report_zero_for_labels_without_a_bit(monkeypatch):
+    # a rollup whose vocabulary lacks every STEPS label
+    root = funnel._root()
+    root.mkdir(parents=True)
+    funnel._save_meta(date(2025, 1, 1), ["other"])
+    funnel._write_day(date(2025, 1, 1), pd.DataFrame({"day": [date(2025, 1, 1)] * 2,
+                                                      "session": pd.array([1, 2], dtype="uint64"),
+                                                      "mask": [1, 0]}))
+    df = funnel.counts("day")
+    assert df.loc[0, "total_sessions"] == 2
+    assert (df[[f"sessions_{s}" for s in funnel.STEPS]] == 0).all().all()
+    with pytest.raises(ValueError):
+        funnel.evaluate(["input-focused"])
+
+
+def test_ordered_funnel_needs_every_earlier_step(monkeypatch):
+    root = funnel._root()
+    root.mkdir(parents=True)
+    funnel._save_meta(date(2025, 1, 1), ["a", "b", "c"])
+    day = date(2025, 1, 1)
+    # s1: a b c, s2: a c (skips b), s3: b
+    funnel._write_day(day, pd.DataFrame({"day": [day] * 3, "session": pd.array([1, 2, 3], dtype="uint64"),
+                                         "mask": [0b111, 0b101, 0b010]}))
+    df = funnel.evaluate({"a": "a", "b": "b", "c": "c"}, grain="day")
+    assert df.loc[0, ["sessions", "a", "b", "c"]].tolist() == [3, 2, 1, 1]
+    assert df.loc[0, "b_rate"] == 0.5
+    loose = funnel.evaluate({"a": "a", "b": "b", "c": "c"}, grain="day", ordered=False)
+    assert loose.loc[0, ["a", "b", "c"]].tolist() == [2, 2, 2]
@@ -0,0 +1,52 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from common import cache
+from FantasyVerse import fv_cohorts
+
+
+@pytest.fixture
+def builds(monkeypatch, tmp_path):
+    """Counts _build calls; each build stamps its orders with the call number."""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(fv_cohorts, "_histories", {})
+    calls = []
+
+    def fake_build(start, end_excl, statuses, positive_only):
+        calls.append(statuses)
+        orders = pd.DataFrame({"order_id": [1, 2], "user_id": [10, 10], "build": len(calls)})
+        products = pd.DataFrame({"order_id": [1, 2], "product_id": [7, 8], "product_name": ["a", "b"]})
+        return orders, products
+
+    monkeypatch.setattr(fv_cohorts, "_build", fake_build)
+    return calls
+
+
+def test_list_statuses_are_accepted_and_memoised(builds):
+    a = fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1), statuses=["REFUNDED", "COMPLETE"])
+    b = fv_cohorts.history("2025-01-01", "2025-02-01", statuses=("COMPLETE", "REFUNDED"))
+
+    assert a is b
+    assert builds == [("COMPLETE", "REFUNDED")]
+
+
+def test_refresh_replaces_the_memoised_history(builds):
+    fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1))
+    fresh = fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1), refresh=True)
+
+    assert fresh.orders["build"].iat[0] == 2
+    assert fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1)) is fresh
+
+
+def test_evicted_half_is_rebuilt_with_its_pair(builds, tmp_path):
+    fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1))
+    fv_cohorts._histories.clear()
+    assert cache.invalidate(label="fv_history_20250101_20250201_products") == 1
+
+    h = fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1))
+    assert len(builds) == 2 and h.orders["build"].iat[0] == 2
+    fv_cohorts._histories.clear()
+    assert fv_cohorts.history(date(2025, 1, 1), date(2025, 2, 1)).orders["build"].iat[0] == 2
+    assert len(builds) == 2
@@ -0,0 +1,64 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from common import fx
+
+
+def test_from_long_builds_daily_table():
+    df = pd.DataFrame({"day": ["2025-08-01", "2025-08-03"], "currency": ["usd", "USD"], "rate": [1.25, 1.35]})
+    table = fx.from_long(df, source="orders")
+
+    assert table.currencies == ("GBP", "USD")
+    assert table.start == date(2025, 8, 1)
+    np.testing.assert_allclose(table.rate("USD", ["2025-08-01", "2025-08-02", "2025-08-03"]), [1.25, 1.25, 1.35])
+
+
+def test_from_long_without_rows_only_knows_the_base():
+    empty = pd.DataFrame({"day": pd.Series(dtype="datetime64[ns]"), "currency": pd.Series(dtype=str),
+                          "rate": pd.Series(dtype=float)})
+    table = fx.from_long(empty, source="orders", start=date(2025, 8, 1))
+
+    assert table.currencies == ("GBP",) and table.start == date(2025, 8, 1)
+    assert np.isnan(table.rate("USD", "2025-08-15")).all()
+    np.testing.assert_allclose(table.convert([10.0], "GBP", "2025-08-15", to="GBP"), [10.0])
+
+
+def test_genba_common_currency_leaves_unconvertible_rows_empty(monkeypatch, capsys):
+    from royalty.genba import genba_refactor as genba
+
+    rates = pd.DataFrame({"day": ["2025-08-01"], "currency": ["EUR"], "rate": [1.2]})
+    monkeypatch.setitem(fx._tables, "ecb", fx.from_long(rates, source="test"))
+    raw = pd.DataFrame({
+        "genba_reported_royalty": [12.0, 12.0, 12.0],
+        "genba_currency": ["EUR", "EUR", "EUR"],
+        "original_date_of_sale": pd.to_datetime(["2025-08-01"] * 3),
+        "fanatical_reported_royalty": [6.0, np.nan, 6.0],
+        "allowable_transaction_fee": [np.nan, np.nan, 1.0],
+        "fanatical_currency": ["EUR", "EUR", "XYZ"],
+        "order_date": pd.to_datetime(["2025-08-01"] * 3),
+    })
+    out = genba.add_common_currency(raw, "GBP")
+
+    np.testing.assert_allclose(out["overcharge_after_transaction_fee_handling_gbp"], [5.0, 10.0, np.nan])
+    assert "1 rows can't be converted to GBP" in capsys.readouterr().out
+
+
+def test_dates_outside_the_table_are_nan_not_clamped(capsys):
+    df = pd.DataFrame({"day": ["2025-08-01", "2025-08-31"], "currency": ["USD", "USD"], "rate": [1.25, 1.35]})
+    table = fx.from_long(df, source="orders")
+
+    out = table.convert([10.0, 10.0, 10.0], "USD", ["2025-07-31", "2025-08-15", "2025-09-01"], to="GBP")
+    assert np.isnan(out[[0, 2]]).all() and out[1] == 10.0 / 1.25
+    assert "2 dates outside the orders rates" in capsys.readouterr().out
+    # the same currency needs no rate
+    np.testing.assert_allclose(table.convert([5.0], "GBP", "2030-01-01", to="GBP"), [5.0])
+
+
+def test_from_long_covers_the_requested_window():
+    df = pd.DataFrame({"day": ["2025-08-02"], "currency": ["USD"], "rate": [1.3]})
+    table = fx.from_long(df, start=date(2025, 8, 1), end=date(2025, 8, 31))
+
+    assert (table.start, table.end) == (date(2025, 8, 1), date(2025, 8, 31))
+    np.testing.assert_allclose(table.rate("USD", ["2025-08-01", "2025-08-31"]), [1.3, 1.3])
@@ -0,0 +1,54 @@
+import contextlib
+from datetime import date
+
+import pandas as pd
+import psycopg2
+
+from royalty.genba import genba_refactor as genba
+
+
+def _genba_df():
+    return pd.DataFrame({
+        "ctid_1": ["m1-1", "u1-1"], "iid": ["m1", "u1"], "product_title": ["Game A", "Game B"],
+        "genba_product_id": ["g1", "g2"], "original_date_of_sale": pd.to_datetime(["2025-08-03", "2025-08-04"]),
+        "country_sold": ["GB", "GB"], "genba_currency": ["GBP", "GBP"], "activation_qty": [1, 1],
+        "genba_reported_royalty": [10.0, 8.0],
+    })
+
+
+def _fan_df():
+    return pd.DataFrame({
+        "iid": ["m1"], "product_id": [1], "order_id": [100], "order_date": pd.to_datetime(["2025-08-03"]),
+        "status": ["COMPLETE"], "fanatical_currency": ["GBP"], "deal": [None], "supplier_name": ["Pub One"],
+        "fanatical_reported_royalty": [7.0], "allowable_transaction_fee": [1.0],
+    })
+
+
+def test_unmatched_overcharge_reaches_a_statement():
+    raw = genba.compute_raw(_genba_df(), _fan_df())
+    frame = genba.GenbaReconciliation().statement_frame(raw, None)
+
+    rows = frame.set_index(["supplier_name", "product_title"])["Total Overcharge"]
+    assert rows[("Pub One", "Game A")] == 2.0
+    assert rows[(genba.UNMATCHED_SUPPLIER, "Game B")] == 8.0
+    assert frame["Total Overcharge"].sum() == genba.pivot_overcharge(raw)["Total Overcharge"].sum()
+
+
+def test_streaming_falls_back_to_a_window_scan(monkeypatch):
+    calls = []
+
+    def fake_iter(conn, start_date, end_excl, iids=None, mode=genba.FETCH_MODE, window=None):
+        calls.append(mode)
+        yield _fan_df()
+        if mode != "window":
+            raise psycopg2.Error("permission denied to create temporary tables")
+
+    monkeypatch.setattr(genba, "iter_fanatical", fake_iter)
+    monkeypatch.setattr(genba.warehouse, "connection", lambda: contextlib.nullcontext(object()))
+    monkeypatch.setattr(genba.warehouse, "rollback", lambda conn: None)
+
+    pivot = genba.stream_fanatical_pivot(_genba_df(), date(2025, 8, 1), date(2025, 9, 1))
+
+    assert calls == [genba.FETCH_MODE, "window"]
+    expected = genba.pivot_overcharge(genba.compute_raw(_genba_df(), _fan_df()))
+    assert pivot["Total Overcharge"].sum() == expected["Total Overcharge"].sum()
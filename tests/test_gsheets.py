@@ -0,0 +1,113 @@
+import pandas as pd
+import pytest
+
+from common import gsheets
+from tests.fake_gspread import FakeClient
+
+
+@pytest.fixture(autouse=True)
+def local_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(gsheets, "GSHEETS_STATE_DIR", tmp_path)
+    monkeypatch.setattr(gsheets, "limiter", gsheets.RateLimiter(0))
+
+
+def frame(n, offset=0):
+    return pd.DataFrame({"publisher": [f"p{i}" for i in range(n)], "amount": [i + offset for i in range(n)]})
+
+
+def as_values(df):
+    return gsheets.df_to_gspread_values(df)
+
+
+def test_first_write_creates_and_fills_the_tab():
+    client = FakeClient()
+    assert gsheets.write_frame(client, "sheet", "tab", frame(5), diff=True) == 6
+    assert client.open_by_key("sheet").worksheet("tab").get_all_values() == as_values(frame(5))
+
+
+def test_diff_uploads_only_changed_rows():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(10), diff=True)
+    changed = frame(10)
+    changed.loc[3, "amount"] = 99
+    ws = client.open_by_key("sheet").worksheet("tab")
+    ws.calls.clear()
+
+    assert gsheets.write_frame(client, "sheet", "tab", changed, diff=True) == 1
+    assert ws.calls == [("batch_update", ["A5:B5"])]
+    assert ws.get_all_values() == as_values(changed)
+
+
+def test_unchanged_frame_uploads_nothing():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(4), diff=True)
+    assert gsheets.write_frame(client, "sheet", "tab", frame(4), diff=True) == 0
+
+
+def test_shrinking_resizes_and_drops_old_rows():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(10), diff=True)
+    gsheets.write_frame(client, "sheet", "tab", frame(3), diff=True)
+    ws = client.open_by_key("sheet").worksheet("tab")
+    assert (ws.row_count, ws.col_count) == (4, 2)
+    assert ws.get_all_values() == as_values(frame(3))
+
+
+def test_wider_frame_rewrites_every_row():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(3), diff=True)
+    wider = frame(3).assign(currency="GBP")
+    assert gsheets.write_frame(client, "sheet", "tab", wider, diff=True) == 4
+    assert client.open_by_key("sheet").worksheet("tab").get_all_values() == as_values(wider)
+
+
+def test_recreated_tab_is_written_in_full():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(5), diff=True)
+    sh = client.open_by_key("sheet")
+    sh.del_worksheet(sh.worksheet("tab"))  # deleted by hand; the local digests remain
+
+    changed = frame(5)
+    changed.loc[0, "amount"] = 42
+    assert gsheets.write_frame(client, "sheet", "tab", changed, diff=True) == 6
+    assert sh.worksheet("tab").get_all_values() == as_values(changed)
+
+
+def test_tab_resized_by_hand_is_written_in_full():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(5), diff=True)
+    ws = client.open_by_key("sheet").worksheet("tab")
+    ws.resize(rows=2)  # someone trimmed it in the UI
+
+    assert gsheets.write_frame(client, "sheet", "tab", frame(5), diff=True) == 6
+    assert ws.get_all_values() == as_values(frame(5))
+
+
+def test_chunks_are_bounded():
+    client = FakeClient()
+    gsheets.write_frame(client, "sheet", "tab", frame(25), chunk_rows=10)
+    ws = client.open_by_key("sheet").worksheet("tab")
+    updates = [c for c in ws.calls if c[0] == "batch_update"]
+    assert len(updates) == 3
+    assert ws.get_all_values() == as_values(frame(25))
+
+
+def _take_slots(path, per_minute, n):
+    limiter = gsheets.RateLimiter(per_minute, path=path)
+    for _ in range(n):
+        limiter.wait()
+
+
+def test_rate_limit_is_shared_across_processes(tmp_path):
+    import multiprocessing
+    import time
+
+    # 1200/min = one call every 50 ms; 3 processes x 4 calls need >= 11 intervals in total
+    t0 = time.time()
+    procs = [multiprocessing.Process(target=_take_slots, args=(tmp_path / "slots", 1200, 4)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    assert time.time() - t0 >= 11 * 0.05
@@ -0,0 +1,30 @@
+from datetime import date
+
+import pandas as pd
+
+from royalty import incremental
+from royalty.framework import MonthWindow
+from royalty.genba import genba_refactor
+
+
+def test_pending_iids_are_pulled_over_the_whole_window(monkeypatch):
+    """A back-dated line that lands late for a still-unmatched iid is found."""
+    lines = pd.DataFrame({
+        "iid": ["new", "pending", "pending", "other"],
+        "order_date": pd.to_datetime(["2025-09-20", "2025-09-02", "2025-09-25", "2025-09-03"]),
+        "fanatical_reported_royalty": [1.0, 2.0, 3.0, 4.0],
+        "allowable_transaction_fee": [0.0, 0.0, 0.0, 0.0],
+    })
+    uploaded = {}
+    monkeypatch.setattr(incremental.warehouse, "temp_table",
+                        lambda conn, name, columns, rows, page_size: uploaded.update(iids={r[0] for r in rows}))
+
+    def fake_chunks(conn, sql, params, label=""):
+        assert "a.order_date > %s" not in sql  # no watermark filter
+        yield lines[lines["iid"].isin(uploaded["iids"])]
+
+    monkeypatch.setattr(genba_refactor, "_iter_chunks", fake_chunks)
+    delta = incremental._genba_fan_delta(None, MonthWindow(date(2025, 9, 1)), ["new"], ["pending"])
+
+    assert sorted(delta["iid"]) == ["new", "pending", "pending"]
+    assert delta["order_date"].min() == pd.Timestamp("2025-09-02")
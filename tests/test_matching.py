@@ -0,0 +1,34 @@
+from rapidfuzz import fuzz, process
+
+from common.matching import FuzzyMatcher
+
+CHOICES = ["paradox interactive", "paradox arc", "devolver digital", "team17 digital", "sega europe", "sega"]
+QUERIES = ["paradox interactve", "devolver", "team 17 digital", "sega of europe", "unknown studio", ""]
+
+
+def _extract_one(query, threshold):
+    if not query:
+        return None
+    hit = process.extractOne(query, CHOICES, scorer=fuzz.token_set_ratio, score_cutoff=threshold)
+    return None if hit is None else (hit[2], hit[1])
+
+
+def test_match_agrees_with_extract_one():
+    for threshold in (0, 80, 85, 90, 95):
+        m = FuzzyMatcher(CHOICES).match(QUERIES, k=1, threshold=threshold)
+        got = {int(r.query_pos): (int(r.choice_pos), float(r.score)) for r in m.itertuples()}
+        for i, q in enumerate(QUERIES):
+            expected = _extract_one(q, threshold)
+            if expected is None:
+                assert i not in got, (q, threshold)
+            else:
+                assert got[i][0] == expected[0], (q, threshold)
+                assert abs(got[i][1] - expected[1]) < 1e-6
+
+
+def test_score_just_below_threshold_is_rejected():
+    query, choice = "a" * 35 + "bcde", "a" * 35 + "fghi"
+    score = fuzz.token_set_ratio(query, choice)
+    assert 89.5 <= score < 90  # would round to 90 as uint8
+    assert FuzzyMatcher([choice]).match([query], threshold=90).empty
+    assert len(FuzzyMatcher([choice]).match([query], threshold=89)) == 1
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from royalty import statements
+
+
+def test_colliding_slugs_get_distinct_files(tmp_path):
+    frame = pd.DataFrame({"pub": ["A&B", "A-B", "a b", "Solo"], "x": [1, 2, 3, 4]})
+    summary = statements.write_statements(frame, "pub", "t", ["csv"], out_dir=tmp_path, workers=2)
+
+    assert "error" not in summary.columns
+    assert summary["output"].nunique() == 4
+    for pub, path in zip(summary["pub"], summary["output"]):
+        assert pd.read_csv(path)["pub"].tolist() == [pub]
+    assert (tmp_path / "t" / "Solo.csv").exists()
+
+
+def test_unique_names_respect_limit():
+    long_a, long_b = "x" * 120 + "a", "x" * 120 + "b"
+    titles = statements.unique_names([long_a, long_b, "short"], lambda n: f"p {n}", 100)
+
+    assert titles["short"] == "p short"
+    assert titles[long_a] != titles[long_b]
+    assert all(len(t) <= 100 for t in titles.values())
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from common import fx
+from royalty.vaultn import vaultn_process_refactor as vaultn
+
+
+def test_promo_rows_only_see_their_own_suppliers_lines(monkeypatch):
+    monkeypatch.setattr(vaultn, "PROMO_ADJUSTMENTS", {"Bethesda": "Bethesda (VaultN)", "Ubisoft": "Ubisoft (VaultN)"})
+    monkeypatch.setitem(fx._tables, "ecb", fx.from_long(
+        pd.DataFrame({"day": ["2025-08-01"], "currency": ["EUR"], "rate": [1.0]}), source="test"))
+    # one bundle order with lines from both suppliers: only Ubisoft's line has a promo
+    promo_data = pd.DataFrame({
+        "iid": ["o1", "o1"], "status": ["COMPLETE"] * 2, "promo_name": [None, "Summer Sale"],
+        "bundle_name": [None, None], "od_supplier_name": ["Bethesda (VaultN)", "Ubisoft (VaultN)"],
+        "royalties": [4.0, 7.0],
+    })
+    df = pd.DataFrame({
+        "Publisher Name": ["Bethesda Softworks", "Ubisoft Entertainment", "Other Co"],
+        "Invoicing Currency": ["EUR"] * 3,
+        "Client Order Reference": ["o1", "o1", "o1"],
+        "Promotion Name": ["Summer Sale", "Summer Sale", "Summer Sale"],
+        "Purchase Price In Invoicing Currency": [10.0, 10.0, 10.0],
+        "Status": ["", "", ""],
+    })
+    comparison = pd.DataFrame({
+        "Publisher Name": df["Publisher Name"], "Invoicing Currency": ["EUR"] * 3,
+        "Purchase Price In Invoicing Currency": [10.0] * 3, "Converted to GBP": [10.0] * 3, "royalties": [0.0] * 3,
+    })
+
+    final, report = vaultn.adjust_promos(df, promo_data, comparison, pd.Timestamp("2025-08-01").date())
+
+    # Bethesda's own line has no promo -> its royalty; Ubisoft's line has one -> unchanged
+    assert report["Purchase Price In Invoicing Currency"].tolist() == [4.0, 10.0]
+    assert report["Status"].tolist() == ["Adjusted", ""]
+    assert np.isnan(final["Adjusted Purchase Price In Invoicing Currency"].iat[2])
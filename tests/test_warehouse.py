@@ -0,0 +1,105 @@
+# Runs against a throwaway local PostgreSQL: set CMA_TEST_PG_URI, e.g.
+#   CMA_TEST_PG_URI=postgresql://postgres@localhost/postgres python -m pytest tests
+import os
+import threading
+
+import psycopg2
+import pytest
+
+from common import warehouse
+
+PG_URI = os.getenv("CMA_TEST_PG_URI")
+pytestmark = pytest.mark.skipif(not PG_URI, reason="CMA_TEST_PG_URI not set")
+
+
+@pytest.fixture(autouse=True)
+def local_pool(monkeypatch):
+    monkeypatch.setattr(warehouse, "connect_kwargs", lambda: {"dsn": PG_URI})
+    monkeypatch.setattr(warehouse, "REQUIRED_ENV", [])
+    warehouse.close_pool()
+    yield
+    warehouse.close_pool()
+
+
+def _timeout(conn):
+    with conn.cursor() as cur:
+        cur.execute("SHOW statement_timeout")
+        return cur.fetchone()[0]
+
+
+def test_connection_sets_timeout_and_commits():
+    with warehouse.connection(statement_timeout_ms=1234) as conn:
+        assert _timeout(conn) == "1234ms"
+        with conn.cursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS cma_test_commit (x int); TRUNCATE cma_test_commit;"
+                        "INSERT INTO cma_test_commit VALUES (1)")
+    with warehouse.connection() as conn:
+        assert warehouse.read_frame(conn, "SELECT x FROM cma_test_commit")["x"].tolist() == [1]
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE cma_test_commit")
+
+
+def test_connection_rolls_back_on_error():
+    with pytest.raises(psycopg2.Error):
+        with warehouse.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE TEMP TABLE cma_test_rb (x int)")
+                cur.execute("SELECT 1/0")
+    # the pooled connection is usable again and the temp table is gone
+    with warehouse.connection() as conn:
+        assert warehouse.read_frame(conn, "SELECT to_regclass('pg_temp.cma_test_rb') AS t")["t"].isna().all()
+
+
+def test_rollback_keeps_statement_timeout():
+    with warehouse.connection(statement_timeout_ms=4321) as conn:
+        with pytest.raises(psycopg2.Error):
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1/0")
+        warehouse.rollback(conn, statement_timeout_ms=4321)
+        assert _timeout(conn) == "4321ms"
+
+
+def test_read_frame_chunks_and_schema():
+    sql = "SELECT g AS n, g::numeric / 2 AS half, 'r' || g AS label FROM generate_series(1, 25) g WHERE g > %s"
+    with warehouse.connection() as conn:
+        chunks = list(warehouse.iter_frames(conn, sql, (0,), fetch_size=10))
+        typed = warehouse.read_frame(conn, sql, (0,), fetch_size=10,
+                                     schema={"n": "int32", "half": "float64", "label": "string"})
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert typed["n"].dtype == "int32" and typed["half"].dtype == "float64"
+    assert typed["half"].iloc[-1] == 12.5 and typed["label"].iloc[0] == "r1"
+
+
+def test_read_frame_empty_result_keeps_columns():
+    sql = "SELECT g AS n, 'x'::text AS label FROM generate_series(1, 3) g WHERE g > %s"
+    with warehouse.connection() as conn:
+        plain = warehouse.read_frame(conn, sql, (10,))
+        typed = warehouse.read_frame(conn, sql, (10,), schema={"n": "int64", "label": "string"})
+    assert plain.empty and list(plain.columns) == ["n", "label"]
+    assert typed.empty and list(typed.columns) == ["n", "label"] and typed["n"].dtype == "int64"
+
+
+def test_run_concurrent_uses_separate_connections():
+    barrier = threading.Barrier(3, timeout=10)
+
+    def job(i):
+        def run(conn):
+            barrier.wait()  # all three hold a connection at once
+            df = warehouse.read_frame(conn, "SELECT pg_backend_pid() AS pid, %s AS i", (i,))
+            return int(df["pid"].iat[0]), int(df["i"].iat[0])
+        return run
+
+    out = warehouse.run_concurrent({f"job{i}": job(i) for i in range(3)}, max_workers=3)
+    assert [out[f"job{i}"][1] for i in range(3)] == [0, 1, 2]
+    assert len({pid for pid, _ in out.values()}) == 3
+
+
+def test_read_for_keys_modes_agree():
+    sql = "SELECT k FROM (VALUES ('a'), ('b'), ('c')) v(k) WHERE k IN {keys} AND k <> %s ORDER BY k"
+    with warehouse.connection() as conn:
+        temp = warehouse.read_for_keys(conn, sql, ["a", "b", "z"], params=("z",))
+        batched = warehouse.read_for_keys(conn, sql, ["a", "b", "z"], params=("z",), mode="in_list", batch_size=1)
+        none = warehouse.read_for_keys(conn, sql, [], params=("z",), mode="in_list")
+    assert temp["k"].tolist() == ["a", "b"]
+    assert sorted(batched["k"]) == ["a", "b"]
+    assert none.empty and list(none.columns) == ["k"]